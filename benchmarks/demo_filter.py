@@ -0,0 +1,64 @@
+import argparse
+import time
+
+import numpy as np
+
+from deepq.reward_shaper import ActionAdviceRewardShaper
+from dotaenv.codes import STATE_DIM
+
+
+def generate_demo_states(size, seed=0):
+    """ Generates trajectory-like states: slowly drifting coordinates and rarely flipping flags.
+    """
+    rng = np.random.RandomState(seed)
+    states = np.zeros((size, STATE_DIM), dtype=np.float32)
+    state = rng.uniform(0, 1, STATE_DIM)
+    for i in range(size):
+        state = np.clip(state + rng.normal(0, 0.02, STATE_DIM), -1, 1)
+        flips = rng.uniform(0, 1, STATE_DIM) < 0.01
+        state[flips] = 1 - state[flips]
+        states[i] = state
+    return states
+
+
+def filter_similar_states_quadratic(states):
+    """ The reference filtering that compares every state with every kept one.
+    """
+    kept = []
+    for i, state in enumerate(states):
+        similar = False
+        for j in kept:
+            sim = ActionAdviceRewardShaper.get_states_similarity(state, states[j])
+            if sim > ActionAdviceRewardShaper.FILTER_THRESHOLD:
+                similar = True
+                break
+        if not similar:
+            kept.append(i)
+    return np.array(kept, dtype=np.int64)
+
+
+def time_filter(filter_fn, states):
+    start = time.time()
+    kept = filter_fn(states)
+    return time.time() - start, kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Times the demo filtering of ActionAdviceRewardShaper')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--reference-max-size', type=int, default=10000,
+                        help='the quadratic reference is only timed up to this number of states')
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        states = generate_demo_states(size)
+        elapsed, kept = time_filter(ActionAdviceRewardShaper.filter_similar_states, states)
+        print('{} states: indexed filtering took {:.3f}s, kept {}'.format(size, elapsed, len(kept)))
+        if size <= args.reference_max_size:
+            ref_elapsed, ref_kept = time_filter(filter_similar_states_quadratic, states)
+            print('{} states: quadratic filtering took {:.3f}s, kept {}, same result: {}'.format(
+                size, ref_elapsed, len(ref_kept), np.array_equal(kept, ref_kept)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+from dotaenv.codes import STATE_DIM, ACTIONS_TOTAL
+
+# Registered benchmarks by name, every one is a function of the sizes returning (case name, function) pairs
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def measure(fn, repeats=5, min_repeat_time=0.05):
+    """ Times fn in repeats of a calibrated number of calls after a warm-up call.
+
+    :return: dict of the number of the calls per repeat and the mean, median and min time of a call in microseconds
+    """
+    fn()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_repeat_time or number >= 10 ** 6:
+            break
+        number *= 10
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((time.perf_counter() - start) / number * 1e6)
+    return {'number': number, 'repeats': repeats, 'mean_us': float(np.mean(timings)),
+            'median_us': float(np.median(timings)), 'min_us': float(np.min(timings))}
+
+
+def random_states(size, seed=0):
+    return np.random.RandomState(seed).uniform(0, 1, size=(size, STATE_DIM)).astype(np.float32)
+
+
+def random_observation(rng):
+    return {
+        'action_info': float(rng.randint(ACTIONS_TOTAL)),
+        'hero_info': rng.uniform(0, 1, 11).tolist(),
+        'enemy_info': rng.uniform(0, 1, STATE_DIM - 12).tolist(),
+    }
+
+
+@benchmark('bot_util')
+def bench_bot_util(sizes):
+    from dotaenv.bot_util import message_to_pairs, vectorize_observation
+
+    rng = np.random.RandomState(0)
+    observation = random_observation(rng)
+    # A request of the bot server carries the observations of the frames skipped between the actions
+    messages = [(rng.randint(ACTIONS_TOTAL), {'observation': random_observation(rng), 'reward': 0.0, 'done': False})
+                for _ in range(4)]
+    return [
+        ('vectorize_observation', lambda: vectorize_observation(observation)),
+        ('message_to_pairs/4', lambda: message_to_pairs(messages)),
+    ]
+
+
+def make_state_potential_shaper(replay_dir, demo_length=500):
+    from deepq.reward_shaper import StatePotentialRewardShaper
+    from dotaenv.codes import SHAPER_STATE_DIM
+
+    shaper = StatePotentialRewardShaper(replay_dir)
+    replays = StatePotentialRewardShaper.REPLAYS_TO_LEAVE
+    rng = np.random.RandomState(0)
+    shaper.set_compiled({
+        'states': rng.uniform(0, 1, size=(replays * demo_length, SHAPER_STATE_DIM)),
+        'lengths': np.full(replays, demo_length, dtype=np.int64),
+    })
+    return shaper
+
+
+@benchmark('dqn_replay')
+def bench_dqn_replay(sizes):
+    from deepq.replay_buffer import PrioritizedReplayBuffer, Transition
+
+    cases = []
+    replay_dir = tempfile.mkdtemp()
+    shaper = make_state_potential_shaper(replay_dir)
+    states = random_states(2)
+    for size in sizes:
+        replay_buffer = PrioritizedReplayBuffer(
+            replay_memory_size=size, total_steps=10 ** 6, reward_shaper=shaper, discount_factor=0.99,
+            save_dir=replay_dir)
+        # The buffer is filled directly, pushing would shape the rewards of every transition
+        replay_buffer.replay_memory.extend(Transition(states[0], 0, states[1], False, 0.0, np.random.uniform())
+                                           for _ in range(size))
+        _, _, idx = replay_buffer.sample(32, 0)
+        deltas = np.random.uniform(size=32)
+        cases.extend([
+            ('push/{}'.format(size), lambda rb=replay_buffer: rb.push(states[0], 0, states[1], False, 0.0)),
+            ('sample/{}'.format(size), lambda rb=replay_buffer: rb.sample(32, 0)),
+            ('update_priorities/{}'.format(size), lambda rb=replay_buffer, idx=idx: rb.update_priorities(idx, deltas)),
+        ])
+    return cases
+
+
+@benchmark('openai_replay')
+def bench_openai_replay(sizes):
+    from openai.deepq.replay_buffer import PrioritizedReplayBuffer
+
+    cases = []
+    states = random_states(2)
+    biases = np.zeros(ACTIONS_TOTAL, dtype=np.float32)
+    for size in sizes:
+        replay_buffer = PrioritizedReplayBuffer(size, alpha=0.6, store_biases=True)
+        for _ in range(size):
+            replay_buffer.add(states[0], 0, 0.0, states[1], 0.0, biases, biases)
+        idxes = replay_buffer.sample(32, beta=0.4)[-1]
+        priorities = np.random.uniform(0.1, 1, size=32)
+        cases.extend([
+            ('add/{}'.format(size),
+             lambda rb=replay_buffer: rb.add(states[0], 0, 0.0, states[1], 0.0, biases, biases)),
+            ('sample/{}'.format(size), lambda rb=replay_buffer: rb.sample(32, beta=0.4)),
+            ('update_priorities/{}'.format(size),
+             lambda rb=replay_buffer, idxes=idxes: rb.update_priorities(idxes, priorities)),
+        ])
+    return cases
+
+
+@benchmark('state_potential')
+def bench_state_potential(sizes):
+    shaper = make_state_potential_shaper(tempfile.mkdtemp())
+    state = random_states(1)[0]
+    return [('get_state_potential', lambda: shaper.get_state_potential(state))]
+
+
+def write_action_demos(replay_dir, demos, demo_length, seed=0):
+    rng = np.random.RandomState(seed)
+    for demo in range(demos):
+        with open(os.path.join(replay_dir, 'demo{}.json'.format(demo)), 'w') as demo_file:
+            for _ in range(demo_length):
+                observation = random_observation(rng)
+                state = {'hero_info': observation['hero_info'], 'enemy_info': observation['enemy_info']}
+                demo_file.write(json.dumps({'state': state, 'action': rng.randint(ACTIONS_TOTAL)}) + '\n')
+
+
+@benchmark('action_advice')
+def bench_action_advice(sizes):
+    from deepq.reward_shaper import ActionAdviceRewardShaper
+
+    replay_dir = tempfile.mkdtemp()
+    write_action_demos(replay_dir, demos=4, demo_length=2500)
+    store_dir = tempfile.mkdtemp()
+    exact_shaper = ActionAdviceRewardShaper(replay_dir, store_dir=store_dir)
+    exact_shaper.load()
+    cutoff_shaper = ActionAdviceRewardShaper(replay_dir, kernel_cutoff=0.01, store_dir=store_dir)
+    cutoff_shaper.load()
+    state = random_states(1)[0]
+    batch = random_states(64)
+    return [
+        ('get_action_potentials/exact', lambda: exact_shaper.get_action_potentials(state)),
+        ('get_action_potentials/cutoff', lambda: cutoff_shaper.get_action_potentials(state)),
+        ('get_action_potentials_batch/64', lambda: exact_shaper.get_action_potentials_batch(batch)),
+        ('load/compiled', lambda: ActionAdviceRewardShaper(replay_dir, store_dir=store_dir).load()),
+        ('load/rebuild', lambda: ActionAdviceRewardShaper(replay_dir, store_dir=store_dir).load(rebuild=True)),
+    ]
+
+
+@benchmark('pg_rewards')
+def bench_pg_rewards(sizes):
+    from policy_gradient.agent import PGAgent
+
+    rewards = np.random.uniform(-1, 1, size=1000).astype(np.float32)
+    return [('discount_rewards/1000', lambda: PGAgent.discount_rewards(rewards, 0.99))]
+
+
+@benchmark('returns')
+def bench_returns(sizes):
+    from deepq.returns import discounted_returns, n_step_targets, gae
+
+    rng = np.random.RandomState(0)
+    rewards = rng.uniform(-1, 1, size=10000)
+    values = rng.uniform(-1, 1, size=10001)
+    dones = rng.uniform(size=10000) < 0.001
+    return [
+        ('discounted_returns/10000', lambda: discounted_returns(rewards, 0.99, dones=dones)),
+        ('n_step_targets/10000/5', lambda: n_step_targets(rewards, dones, values[1:], 0.99, 5)),
+        ('gae/10000', lambda: gae(rewards, values, dones, 0.99, 0.95)),
+    ]
+
+
+@benchmark('pg_replay')
+def bench_pg_replay(sizes):
+    from policy_gradient.replay_buffer import ReplayBuffer
+
+    cases = []
+    state = random_states(1)[0]
+    for size in sizes:
+        replay_buffer = ReplayBuffer(directory=tempfile.mkdtemp(), max_size=size)
+        replay_buffer.extend((state, 0, 0.0) for _ in range(size))
+        cases.append(('get_data/{}'.format(size), lambda rb=replay_buffer: rb.get_data(100)))
+    return cases
+
+
+@benchmark('estimator')
+def bench_estimator(sizes):
+    import tensorflow as tf
+    from deepq.estimator import Estimator
+
+    tf.reset_default_graph()
+    tf.Variable(0, name="global_step", trainable=False)
+    q_estimator = Estimator(STATE_DIM, ACTIONS_TOTAL, scope="q")
+    target_estimator = Estimator(STATE_DIM, ACTIONS_TOTAL, scope="target_q")
+    q_estimator.build_double_dqn_update(target_estimator, discount_factor=0.99)
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    states = random_states(32)
+    next_states = random_states(32, seed=1)
+    actions = np.random.randint(ACTIONS_TOTAL, size=32)
+    rewards = np.random.uniform(-1, 1, size=32)
+    dones = np.zeros(32, dtype=bool)
+    weights = np.ones(32)
+    numpy_network = q_estimator.to_numpy()
+    numpy_network.refresh(sess)
+    state = states[:1]
+    return [
+        ('predict/1', lambda: q_estimator.predict(sess, state)),
+        ('numpy_outputs/1', lambda: numpy_network.outputs(state)),
+        ('double_dqn_update/32',
+         lambda: q_estimator.double_dqn_update(sess, states, actions, rewards, next_states, dones, weights)),
+    ]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)['results']
+    for name, stats in sorted(results.items()):
+        if name not in baseline or 'median_us' not in stats or 'median_us' not in baseline[name]:
+            continue
+        ratio = stats['median_us'] / baseline[name]['median_us']
+        print('{:<50} {:>12.1f}us {:>12.1f}us {:>7.2f}x'.format(
+            name, baseline[name]['median_us'], stats['median_us'], ratio))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Times the hot paths of the agents without the game')
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), default=None,
+                        help='the benchmarks to run, all by default')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10 ** 4, 10 ** 5, 10 ** 6],
+                        help='the replay buffer sizes')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--output', type=str, default='benchmark_results.json',
+                        help='a path to the JSON file to write the results to')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='a path to the results of a previous run to compare the medians with')
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.only or sorted(BENCHMARKS):
+        try:
+            cases = BENCHMARKS[name](args.sizes)
+        except ImportError as error:
+            # The benchmarks of the missing optional dependencies are recorded as skipped
+            print('{}: skipped, {}'.format(name, error))
+            results[name] = {'skipped': str(error)}
+            continue
+        for case, fn in cases:
+            stats = measure(fn, repeats=args.repeats)
+            results['{}/{}'.format(name, case)] = stats
+            print('{}/{}: {:.1f}us median, {:.1f}us min'.format(name, case, stats['median_us'], stats['min_us']))
+
+    report = {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'results': results,
+    }
+    with open(args.output, 'w') as output_file:
+        json.dump(report, output_file, indent=2, sort_keys=True)
+    print('Wrote the results to', args.output)
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
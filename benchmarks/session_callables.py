@@ -0,0 +1,46 @@
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from deepq.estimator import Estimator
+from dotaenv.codes import STATE_DIM, ACTIONS_TOTAL
+
+
+def time_per_call(fn, calls):
+    """ Returns the mean time of a call in microseconds after a warm-up call.
+    """
+    fn()
+    start = time.time()
+    for _ in range(calls):
+        fn()
+    return (time.time() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Times the per-step inference of the Q-value estimator')
+    parser.add_argument('--calls', type=int, default=10000)
+    args = parser.parse_args()
+
+    tf.reset_default_graph()
+    tf.Variable(0, name="global_step", trainable=False)
+    estimator = Estimator(STATE_DIM, ACTIONS_TOTAL, scope="q")
+    numpy_network = estimator.to_numpy()
+    state = np.random.uniform(-1, 1, size=(1, STATE_DIM)).astype(np.float32)
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        numpy_network.refresh(sess)
+        timings = [
+            ('sess.run with a feed dict', lambda: sess.run(estimator.predictions, feed_dict={estimator.X: state})),
+            # Estimator.predict runs the step compiled by SessionCallable
+            ('session callable', lambda: estimator.predict(sess, state)),
+            ('numpy snapshot', lambda: numpy_network.outputs(state)),
+        ]
+        for name, fn in timings:
+            print('{}: {:.1f}us per call'.format(name, time_per_call(fn, args.calls)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+-- Local policy module: picks actions with the exported network instead of asking the bot server.
+
+local Policy = {}
+
+local Func = require(GetScriptDirectory() .. '/util/func')
+
+-- Written by deepq/lua_export.py
+local weights = require(GetScriptDirectory() .. '/agent_utils/policy_weights')
+
+local ACTIVATIONS = {
+    ['linear'] = function(x) return x end,
+    ['relu'] = function(x) return math.max(x, 0) end,
+    ['tanh'] = function(x)
+        local e = math.exp(2 * x)
+        return (e - 1) / (e + 1)
+    end,
+}
+
+--- Applies dense layers to the input vector.
+-- @param layers list of {kernel, bias, activation}
+-- @param input vector
+-- @return output vector
+--
+function apply_layers(layers, input)
+    local output = input
+    for _, layer in ipairs(layers) do
+        local activation = ACTIVATIONS[layer.activation]
+        local next_output = {}
+        for j=1,#layer.bias do
+            local sum = layer.bias[j]
+            for i=1,#output do
+                sum = sum + output[i] * layer.kernel[i][j]
+            end
+            next_output[j] = activation(sum)
+        end
+        output = next_output
+    end
+    return output
+end
+
+--- Flattens the observation in the order of dotaenv.bot_util.vectorize_observation.
+-- @param observation table returned by Observation.get_observation
+-- @return state vector
+--
+function vectorize_observation(observation)
+    local features = {observation['action_info']}
+    Func.extend_table(features, observation['hero_info'])
+    Func.extend_table(features, observation['enemy_info'])
+    local state = {}
+    for _, index in ipairs(weights.state_project) do
+        state[#state + 1] = features[index]
+    end
+    return state
+end
+
+--- Computes the network outputs, Q-values or logits, for the observation.
+-- @param observation table returned by Observation.get_observation
+-- @return output vector
+--
+function Policy.get_outputs(observation)
+    local hidden = apply_layers(weights.torso, vectorize_observation(observation))
+    local outputs = apply_layers(weights.head, hidden)
+    if #weights.value_head > 0 then
+        -- Dueling network
+        local value = apply_layers(weights.value_head, hidden)[1]
+        local mean = 0
+        for i=1,#outputs do
+            mean = mean + outputs[i] / #outputs
+        end
+        for i=1,#outputs do
+            outputs[i] = value + outputs[i] - mean
+        end
+    end
+    return outputs
+end
+
+--- Picks the action with the largest output.
+-- @param observation table returned by Observation.get_observation
+-- @return action number starting from 0
+--
+function Policy.get_action(observation)
+    local outputs = Policy.get_outputs(observation)
+    local best = 1
+    for i=2,#outputs do
+        if outputs[i] > outputs[best] then
+            best = i
+        end
+    end
+    return best - 1
+end
+
+return Policy
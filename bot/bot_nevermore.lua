@@ -3,6 +3,8 @@ require(GetScriptDirectory() .. '/util/json')
 local Observation = require(GetScriptDirectory() .. '/agent_utils/observation')
 local Reward = require(GetScriptDirectory() .. '/agent_utils/reward')
 local Action = require(GetScriptDirectory() .. '/agent_utils/action')
+local Config = require(GetScriptDirectory() .. '/config')
+local Policy = Config.use_local_policy and require(GetScriptDirectory() .. '/agent_utils/policy') or nil
 
 -- How many frames should pass before a new observation is sent
 local MIN_FRAMES_BETWEEN = 1
@@ -81,7 +83,21 @@ function send_observation_message(msg)
     send_message(create_message(msg, 'observation'), '/observation', nil)
 end
 
+--- Picks and executes the action with the local policy, no messages are sent.
+--
+function think_locally()
+    current_action = Policy.get_action(Observation.get_observation(current_action))
+    if Observation.is_done() then
+        DebugPause()
+    end
+    execute_action(current_action)
+end
+
 function Think()
+    if Config.use_local_policy then
+        think_locally()
+        return
+    end
     total_frames_reward = total_frames_reward + Reward.get_reward(wrong_action)
     frame_count = frame_count + 1
     -- Decide on what to do next based on the state
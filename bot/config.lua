@@ -5,4 +5,8 @@ local Config = {}
 -- If it is false, then the bot is in observer mode.
 Config.is_in_training_mode = true
 
+-- If it is true, then the bot picks the actions with the network exported by deepq/lua_export.py
+-- instead of asking the bot server.
+Config.use_local_policy = false
+
 return Config
@@ -1,7 +1,12 @@
 # Author: Mikita Sazanovich
 
+from deepq.checkpoint_manager import CheckpointManager
 from deepq.estimator import Estimator
-from deepq.persistence import get_last_episode
+from deepq.numpy_network import NumpyNetwork
+from deepq.persistence import get_last_episode, get_resume_state
+from deepq.profiling import PhaseTimers
 from deepq.replay_buffer import PrioritizedReplayBuffer
 from deepq.reward_shaper import StatePotentialRewardShaper, ActionAdviceRewardShaper
+from deepq.shaper_pool import ShaperWorkerPool
 from deepq.state_preprocessor import StatePreprocessor
+from deepq.telemetry import Telemetry
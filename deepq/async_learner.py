@@ -0,0 +1,97 @@
+# Author: Mikita Sazanovich
+
+import threading
+
+import numpy as np
+
+
+class AsyncLearner(threading.Thread):
+    """Runs Double DQN updates on its own thread while the actor steps the game.
+
+    The learner keeps sampling the shared replay buffer and training the
+    q_estimator. Every publish_every updates it copies the fresh weights into
+    the estimator the actor acts with. The copy is guarded by weights_lock, which
+    the actor holds while predicting, so it never sees half-copied weights.
+    """
+
+    def __init__(self,
+                 sess,
+                 q_estimator,
+                 replay_buffer,
+                 publish_op,
+                 step_fn,
+                 batch_size=32,
+                 publish_every=100,
+                 copy_params_op=None,
+                 update_target_estimator_every=500,
+                 numpy_network=None):
+        """
+        :param sess: the session to run the updates in, it is shared with the actor
+        :param q_estimator: an Estimator with a built Double DQN update
+        :param replay_buffer: the PrioritizedReplayBuffer the actor pushes to
+        :param publish_op: the op copying the q_estimator's weights to the actor's estimator
+        :param step_fn: returns the current actor step, used to anneal the importance sampling
+        :param batch_size: the size of a minibatch
+        :param publish_every: number of the updates between the weight publications
+        :param copy_params_op: if set, the op copying the weights to the target estimator
+        :param update_target_estimator_every: number of the updates between the target copies
+        :param numpy_network: if set, the actor's NumpyNetwork refreshed on every publication
+        """
+        super().__init__(name='AsyncLearner', daemon=True)
+        self.sess = sess
+        self.q_estimator = q_estimator
+        self.replay_buffer = replay_buffer
+        self.publish_op = publish_op
+        self.step_fn = step_fn
+        self.batch_size = batch_size
+        self.publish_every = publish_every
+        self.copy_params_op = copy_params_op
+        self.update_target_estimator_every = update_target_estimator_every
+        self.numpy_network = numpy_network
+        self.weights_lock = threading.Lock()
+        self.updates = 0
+        self.error = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        try:
+            while not self._stop_event.is_set():
+                if len(self.replay_buffer) < self.batch_size:
+                    self._stop_event.wait(0.01)
+                    continue
+                self._update()
+        except Exception as error:
+            self.error = error
+            raise
+
+    def _update(self):
+        if self.copy_params_op is not None and self.updates % self.update_target_estimator_every == 0:
+            self.sess.run(self.copy_params_op)
+
+        samples, weights, idx = self.replay_buffer.sample(self.batch_size, self.step_fn())
+        states, actions, next_states, dones, rewards, _ = map(np.array, zip(*samples))
+        td_errors = self.q_estimator.double_dqn_update(
+            self.sess, states, actions, rewards, next_states, dones, weights)
+        self.replay_buffer.update_priorities(idx, np.abs(td_errors))
+        self.updates += 1
+
+        if self.updates % self.publish_every == 0:
+            self.publish()
+
+    def publish(self):
+        """ Copies the current weights to the actor's estimator.
+        """
+        with self.weights_lock:
+            self.sess.run(self.publish_op)
+            if self.numpy_network is not None:
+                self.numpy_network.refresh(self.sess)
+
+    def check(self):
+        """ Raises in the actor's thread if the learner has failed.
+        """
+        if self.error is not None:
+            raise RuntimeError('The learner thread has failed') from self.error
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
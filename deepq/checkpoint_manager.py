@@ -0,0 +1,202 @@
+# Author: Mikita Sazanovich
+
+import json
+import os
+import pickle
+import threading
+import time
+import traceback
+
+import tensorflow as tf
+
+INDEX_FILE = 'checkpoints.json'
+
+
+def _write_atomically(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as output_file:
+        output_file.write(data)
+    os.replace(tmp_path, path)
+
+
+class CheckpointManager:
+    """Saves the variables of a session without stalling the training on disk I/O.
+
+    A checkpoint is a single session call copying the variables into host
+    memory. The copy is pickled and written to disk by a background thread. If
+    the thread is still busy, the pending checkpoint is replaced with the newer
+    one instead of blocking. The files are written atomically and hold a dict of
+    the variable values by name, the format of baselines' save_variables. The
+    last keep_last checkpoints are kept together with the best one by reward.
+    The index entries can carry metadata, which makes resuming a constant time
+    read of the index.
+    """
+
+    def __init__(self, sess, directory, var_list=None, prefix='model', keep_last=5,
+                 every_steps=None, every_seconds=None):
+        """
+        :param sess: the session to take the variables from
+        :param directory: the directory of the checkpoints and their index
+        :param var_list: the variables to save, all the global variables by default
+        :param prefix: the prefix of the checkpoint files
+        :param keep_last: number of the latest checkpoints to keep besides the best one
+        :param every_steps: if set, maybe_save saves once this number of steps has passed
+        :param every_seconds: if set, maybe_save saves once this number of seconds has passed
+        """
+        self.sess = sess
+        self.directory = directory
+        self.prefix = prefix
+        self.keep_last = keep_last
+        self.every_steps = every_steps
+        self.every_seconds = every_seconds
+        self.var_list = var_list if var_list is not None else tf.global_variables()
+        # The restoring ops are built beforehand so that the graph can be finalized
+        self._placeholders = [tf.placeholder(var.dtype.base_dtype, var.shape) for var in self.var_list]
+        self._restore_op = tf.group(*[var.assign(placeholder)
+                                      for var, placeholder in zip(self.var_list, self._placeholders)])
+        os.makedirs(directory, exist_ok=True)
+        self._index = self._read_index()
+        self._last_step = None
+        self._last_time = None
+        self._pending = None
+        self._writing = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='CheckpointWriter', daemon=True)
+        self._thread.start()
+
+    def _read_index(self):
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return []
+        with open(index_path) as index_file:
+            return json.load(index_file)['checkpoints']
+
+    def maybe_save(self, step, reward=None, extras=None, metadata=None):
+        """ Saves a checkpoint if the step or time cadence has passed since the last one.
+
+        :return: whether the checkpoint was taken
+        """
+        due = self._last_step is None
+        if self.every_steps is not None and self._last_step is not None:
+            due = due or step - self._last_step >= self.every_steps
+        if self.every_seconds is not None and self._last_time is not None:
+            due = due or time.time() - self._last_time >= self.every_seconds
+        if self.every_steps is None and self.every_seconds is None:
+            due = True
+        if due:
+            self.save(step, reward=reward, extras=extras, metadata=metadata)
+        return due
+
+    def save(self, step, reward=None, extras=None, metadata=None):
+        """ Copies the variables into memory and queues them to be written.
+
+        :param step: the training step of the checkpoint
+        :param reward: if set, the reward the best checkpoint is chosen by
+        :param extras: dict of the bytes written to the files next to the checkpoint by their suffixes,
+        a value can also be a function returning the bytes, which is called on the writer thread
+        :param metadata: JSON serializable dict kept in the index entry, e.g. the counters to resume from
+        """
+        values = self.sess.run(self.var_list)
+        variables = {var.name: value for var, value in zip(self.var_list, values)}
+        self._last_step = step
+        self._last_time = time.time()
+        with self._cond:
+            self._pending = (step, reward, variables, extras or {}, metadata or {})
+            self._cond.notify_all()
+
+    def flush(self):
+        """ Waits until the queued checkpoint is written.
+        """
+        with self._cond:
+            while self._pending is not None or self._writing:
+                self._cond.wait()
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def latest(self):
+        """ Returns the index entry of the latest checkpoint or None.
+        """
+        with self._cond:
+            return max(self._index, key=lambda entry: entry['step'], default=None)
+
+    def best(self):
+        """ Returns the index entry of the checkpoint with the best reward or None.
+        """
+        with self._cond:
+            rewarded = [entry for entry in self._index if entry['reward'] is not None]
+            return max(rewarded, key=lambda entry: entry['reward'], default=None)
+
+    def path_of(self, entry, extra=None):
+        """ Returns the path of the checkpoint's variables or of its extra file.
+        """
+        path = os.path.join(self.directory, entry['path'])
+        return path if extra is None else '{}.{}'.format(path, extra)
+
+    def restore(self, entry=None):
+        """ Loads the variables of a checkpoint, the latest one by default, into the session.
+
+        :return: the restored entry or None if there are no checkpoints
+        """
+        self.flush()
+        entry = entry or self.latest()
+        if entry is None:
+            return None
+        with open(self.path_of(entry), 'rb') as checkpoint_file:
+            variables = pickle.load(checkpoint_file)
+        feed_dict = {placeholder: variables[var.name]
+                     for var, placeholder in zip(self.var_list, self._placeholders)}
+        self.sess.run(self._restore_op, feed_dict=feed_dict)
+        return entry
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                if self._pending is None:
+                    return
+                pending = self._pending
+                self._pending = None
+                self._writing = True
+            try:
+                self._write(*pending)
+            except Exception:
+                # The training goes on, the next checkpoint may be written successfully
+                traceback.print_exc()
+            finally:
+                with self._cond:
+                    self._writing = False
+                    self._cond.notify_all()
+
+    def _write(self, step, reward, variables, extras, metadata):
+        name = '{}-{}.pkl'.format(self.prefix, step)
+        path = os.path.join(self.directory, name)
+        for suffix, data in extras.items():
+            _write_atomically('{}.{}'.format(path, suffix), data() if callable(data) else data)
+        _write_atomically(path, pickle.dumps(variables, protocol=pickle.HIGHEST_PROTOCOL))
+
+        entry = {'step': step, 'reward': None if reward is None else float(reward), 'path': name,
+                 'extras': sorted(extras.keys()), 'metadata': metadata}
+        with self._cond:
+            index = [old for old in self._index if old['path'] != name] + [entry]
+            index.sort(key=lambda old: old['step'])
+            kept = index[-self.keep_last:] if self.keep_last > 0 else []
+            rewarded = [old for old in index if old['reward'] is not None]
+            if rewarded:
+                best = max(rewarded, key=lambda old: old['reward'])
+                if best not in kept:
+                    kept.insert(0, best)
+            removed = [old for old in index if old not in kept]
+            self._index = kept
+        _write_atomically(os.path.join(self.directory, INDEX_FILE),
+                          json.dumps({'checkpoints': kept}, indent=2).encode('utf-8'))
+        for old in removed:
+            for old_path in [self.path_of(old)] + [self.path_of(old, extra) for extra in old['extras']]:
+                if os.path.exists(old_path):
+                    os.remove(old_path)
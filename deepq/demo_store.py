@@ -0,0 +1,147 @@
+# Author: Mikita Sazanovich
+
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b'DEMOSTOR'
+VERSION = 1
+# Arrays are aligned in the file so that memory-mapped views are aligned too
+ALIGNMENT = 64
+
+
+def list_demo_files(replay_dir):
+    """ Returns the name, size and modification time of every demo file, which a rewrite changes.
+    """
+    files = []
+    for name in sorted(os.listdir(replay_dir)):
+        stat = os.stat(os.path.join(replay_dir, name))
+        files.append([name, stat.st_size, stat.st_mtime_ns])
+    return files
+
+
+def compute_demo_key(replay_dir, params, manifest_path=None):
+    """ Hashes the contents of the demo files together with the compilation parameters.
+
+    If manifest_path is set, the key is kept there with the listing of the
+    files, and the contents are hashed again only when the listing changes.
+    """
+    manifest = json.loads(json.dumps({'params': params, 'files': list_demo_files(replay_dir)}, sort_keys=True))
+    if manifest_path is not None and os.path.exists(manifest_path):
+        with open(manifest_path) as manifest_file:
+            cached = json.load(manifest_file)
+        if cached.get('manifest') == manifest:
+            return cached['key']
+
+    digest = hashlib.sha1()
+    digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    for name, _, _ in manifest['files']:
+        digest.update(name.encode('utf-8'))
+        with open(os.path.join(replay_dir, name), 'rb') as demo_file:
+            for chunk in iter(lambda: demo_file.read(1 << 20), b''):
+                digest.update(chunk)
+    key = digest.hexdigest()
+
+    if manifest_path is not None:
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        tmp_path = manifest_path + '.tmp'
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump({'manifest': manifest, 'key': key}, manifest_file)
+        os.replace(tmp_path, manifest_path)
+    return key
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save_arrays(path, arrays):
+    """ Writes named arrays into a single file atomically.
+
+    The file is the magic, the length of a JSON header describing every
+    array and the raw array bytes, each starting at an aligned offset.
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    header = {'version': VERSION, 'arrays': {}}
+    offset = 0
+    for name, array in sorted(arrays.items()):
+        header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset = _aligned(offset + array.nbytes)
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _aligned(len(MAGIC) + 8 + len(header_bytes))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as store_file:
+        store_file.write(MAGIC)
+        store_file.write(struct.pack('<Q', len(header_bytes)))
+        store_file.write(header_bytes)
+        for name, array in sorted(arrays.items()):
+            store_file.seek(data_start + header['arrays'][name]['offset'])
+            store_file.write(array.tobytes())
+    os.replace(tmp_path, path)
+
+
+def load_arrays(path):
+    """ Memory-maps the named arrays of a file written by save_arrays.
+
+    Returns None if the file is not a store of the current version.
+    """
+    with open(path, 'rb') as store_file:
+        if store_file.read(len(MAGIC)) != MAGIC:
+            return None
+        header_len, = struct.unpack('<Q', store_file.read(8))
+        header = json.loads(store_file.read(header_len).decode('utf-8'))
+    if header['version'] != VERSION:
+        return None
+    data_start = _aligned(len(MAGIC) + 8 + header_len)
+    arrays = {}
+    for name, info in header['arrays'].items():
+        dtype = np.dtype(info['dtype'])
+        shape = tuple(info['shape'])
+        if int(np.prod(shape)) == 0:
+            # Empty arrays can not be memory-mapped
+            arrays[name] = np.zeros(shape, dtype=dtype)
+        else:
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=data_start + info['offset'], shape=shape)
+    return arrays
+
+
+class DemoStore:
+    """Directory of compiled demos keyed by a hash of their sources and parameters.
+    """
+
+    def __init__(self, store_dir, prefix):
+        self.store_dir = store_dir
+        self.prefix = prefix
+
+    def path_for(self, key):
+        return os.path.join(self.store_dir, '{}-{}.demos'.format(self.prefix, key))
+
+    def key_for(self, replay_dir, params):
+        """ Returns the key of the demos of replay_dir, the contents are hashed only if the files changed.
+        """
+        manifest_path = os.path.join(self.store_dir, '{}.manifest.json'.format(self.prefix))
+        return compute_demo_key(replay_dir, params, manifest_path=manifest_path)
+
+    def load(self, key):
+        """ Returns the compiled arrays for the key or None if they were not stored.
+        """
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            return None
+        return load_arrays(path)
+
+    def save(self, key, arrays):
+        """ Stores the compiled arrays for the key and removes the stale ones.
+        """
+        os.makedirs(self.store_dir, exist_ok=True)
+        path = self.path_for(key)
+        save_arrays(path, arrays)
+        for name in os.listdir(self.store_dir):
+            stale_path = os.path.join(self.store_dir, name)
+            if name.startswith(self.prefix + '-') and name.endswith('.demos') and stale_path != path:
+                os.remove(stale_path)
+        return path
@@ -11,18 +11,23 @@ import tensorflow as tf
 sys.path.append('../')
 
 from deepq import StatePotentialRewardShaper, Estimator, StatePreprocessor, PrioritizedReplayBuffer
-from deepq import get_last_episode
+from deepq import CheckpointManager, Telemetry, PhaseTimers
+from deepq import get_resume_state
+from deepq.async_learner import AsyncLearner
+from deepq.returns import n_step_targets
 from dotaenv import DotaEnvironment
 from dotaenv.codes import STATE_DIM, ACTIONS_TOTAL
 
 
-def copy_model_parameters(sess, estimator1, estimator2):
+def make_copy_model_parameters_op(estimator1, estimator2, tau=1.0):
     """
-    Copies the model parameters of one estimator to another.
+    Builds a single op that moves the model parameters of one estimator towards another.
     Args:
-      sess: Tensorflow session instance
       estimator1: Estimator to copy the parameters from
       estimator2: Estimator to copy the parameters to
+      tau: Weight of estimator1's parameters in the result, 1.0 copies them
+    Returns:
+      A grouped op that updates all the parameters of estimator2
     """
     e1_params = [t for t in tf.trainable_variables() if t.name.startswith(estimator1.scope)]
     e1_params = sorted(e1_params, key=lambda v: v.name)
@@ -31,32 +36,103 @@ def copy_model_parameters(sess, estimator1, estimator2):
 
     update_ops = []
     for e1_v, e2_v in zip(e1_params, e2_params):
-        op = e2_v.assign(e1_v)
+        # The value is read by an op created here, so that the control dependencies the caller
+        # builds the update under order the read of a ref variable after the writes
+        e1_value = tf.identity(e1_v)
+        if tau == 1.0:
+            op = e2_v.assign(e1_value)
+        else:
+            op = e2_v.assign(tau * e1_value + (1.0 - tau) * e2_v)
         update_ops.append(op)
 
-    sess.run(update_ops)
+    return tf.group(*update_ops)
 
 
-def make_epsilon_greedy_policy(estimator, acts):
+def make_epsilon_greedy_policy(estimator, acts, numpy_network=None):
     """
     Creates an epsilon-greedy policy based on a given Q-function approximator and epsilon.
     Args:
         estimator: An estimator that returns q values for a given state
         acts: Number of actions in the environment.
+        numpy_network: If set, the NumpyNetwork of the estimator used to compute the q values
     Returns:
         A function that takes the (sess, state, epsilon) as an argument and returns
         the probabilities for each action in the form of a numpy array of length nA.
     """
     def policy_fn(sess, state, epsilon):
         A = np.ones(acts, dtype=float) * epsilon / acts
-        q_values = estimator.predict(sess, np.expand_dims(state, 0))[0]
+        if numpy_network is not None:
+            q_values = numpy_network.outputs(np.expand_dims(state, 0))[0]
+        else:
+            q_values = estimator.predict(sess, np.expand_dims(state, 0))[0]
         best_action = np.argmax(q_values)
         A[best_action] += (1.0 - epsilon)
         return A
     return policy_fn
 
 
-def populate_replay_buffer(replay_buffer, action_sampler, env):
+def make_locked_policy(policy, lock):
+    """
+    Wraps a policy so that it predicts holding the lock, e.g. while no weights are being published.
+    """
+    def policy_fn(sess, state, epsilon):
+        with lock:
+            return policy(sess, state, epsilon)
+    return policy_fn
+
+
+class NStepPusher:
+    """
+    Pushes the n-step transitions of an episode to the replay buffer.
+
+    A transition is pushed once n steps after it are known: its reward is the
+    discounted sum of their rewards and its next state is the state the last
+    of them leads to. The sums are computed by n_step_targets for push_every
+    transitions at once. The transitions of the last steps of a finished
+    episode are pushed with the sums of the steps left, the incomplete ones of
+    an episode broken off before its end are dropped.
+    """
+
+    def __init__(self, replay_buffer, n_step, discount_factor, push_every=32):
+        self.replay_buffer = replay_buffer
+        self.n_step = n_step
+        self.discount_factor = discount_factor
+        self.push_every = push_every
+        # (state, action, next_state, reward) of the steps not pushed yet
+        self.pending = []
+
+    def push(self, state, action, next_state, done, reward):
+        if self.n_step == 1:
+            self.replay_buffer.push(state, action, next_state, done, reward)
+            return
+        self.pending.append((state, action, next_state, reward))
+        if done:
+            self._push_pending(len(self.pending), done=True)
+        elif len(self.pending) >= self.n_step - 1 + self.push_every:
+            # The windows of the last n - 1 steps are not complete yet
+            self._push_pending(len(self.pending) - self.n_step + 1, done=False)
+
+    def _push_pending(self, count, done):
+        length = len(self.pending)
+        dones = np.zeros(length, dtype=bool)
+        dones[-1] = done
+        # The transitions are bootstrapped by the estimator, so only the rewards are summed
+        rewards = n_step_targets([step[3] for step in self.pending], dones, np.zeros(length),
+                                 self.discount_factor, self.n_step)
+        for i in range(count):
+            last = min(i + self.n_step, length) - 1
+            state, action = self.pending[i][:2]
+            self.replay_buffer.push(state, action, self.pending[last][2], bool(dones[last]), rewards[i])
+        del self.pending[:count]
+
+    def end_episode(self):
+        # The complete windows of an episode broken off before its end are still pushed
+        if len(self.pending) >= self.n_step:
+            self._push_pending(len(self.pending) - self.n_step + 1, done=False)
+        self.pending = []
+
+
+def populate_replay_buffer(replay_buffer, action_sampler, env, telemetry):
     print("Populating replay memory...")
     state = env.reset()
     state = StatePreprocessor.process(state)
@@ -66,11 +142,13 @@ def populate_replay_buffer(replay_buffer, action_sampler, env):
             break
         action_probs = action_sampler(state)
         action = np.random.choice(np.arange(len(action_probs)), p=action_probs)
-        print("Step {step} state: {state}, action: {action}.".format(step=t, state=state, action=action))
+        if telemetry.verbose(t):
+            print("Step {step} state: {state}, action: {action}.".format(step=t, state=state, action=action))
         next_state, reward, done, _ = env.step(action=action)
         next_state = StatePreprocessor.process(next_state)
         replay_buffer.push(state, action, next_state, done, reward)
         state = next_state
+    replay_buffer.end_episode()
 
 
 def deep_q_learning(sess,
@@ -79,6 +157,7 @@ def deep_q_learning(sess,
                     target_estimator,
                     num_steps,
                     experiment_dir,
+                    reward_shaper,
                     replay_memory_size=5000,
                     update_target_estimator_every=500,
                     discount_factor=0.999,
@@ -87,13 +166,46 @@ def deep_q_learning(sess,
                     epsilon_decay_steps=10000,
                     update_q_values_every=4,
                     batch_size=32,
+                    target_update_tau=None,
+                    actor_estimator=None,
+                    publish_weights_every=100,
+                    numpy_refresh_every=None,
+                    checkpoint_every_seconds=60,
+                    telemetry=None,
+                    timers=None,
+                    n_step=1,
                     restore=True):
+    """
+    Trains the q_estimator by Double DQN with prioritized replay.
+    Args:
+      reward_shaper: The loaded StatePotentialRewardShaper shaping the rewards of the
+        transitions. It has to be loaded before the session is created, compiling the
+        demos may fork worker processes
+      target_update_tau: If set, the target estimator is softly updated towards the
+        q_estimator with this weight after every gradient step instead of being
+        copied every update_target_estimator_every steps
+      actor_estimator: If set, the agent acts with this estimator while an AsyncLearner
+        trains the q_estimator on its own thread. The updates are then counted by the
+        learner and update_q_values_every is not used
+      publish_weights_every: Number of the learner's updates between the copies of the
+        q_estimator's weights to the actor_estimator
+      numpy_refresh_every: If set, the agent acts with a NumPy snapshot of the estimator's
+        weights refreshed every numpy_refresh_every updates, or on every publication
+        with an actor_estimator
+      checkpoint_every_seconds: The least number of seconds between the checkpoints
+        taken at the starts of the episodes
+      telemetry: The Telemetry recording the rewards and the TD errors and sampling the
+        per-step state records, nothing is recorded by default
+      timers: The PhaseTimers timing the phases of the steps, the phases are not timed
+        by default. The report is printed when the training stops
+      n_step: Number of the rewards summed in the targets before bootstrapping from the
+        target estimator, the targets are one-step by default
+    """
 
     # Create directories for checkpoints and summaries
     checkpoint_dir = os.path.join(experiment_dir, "checkpoints")
     if not os.path.exists(checkpoint_dir):
         os.makedirs(checkpoint_dir)
-    checkpoint_path = os.path.join(checkpoint_dir, "model")
     reward_dir = os.path.join(experiment_dir, "rewards")
     if not os.path.exists(reward_dir):
         os.makedirs(reward_dir)
@@ -101,120 +213,216 @@ def deep_q_learning(sess,
 
     starting_episode = 0
 
-    saver = tf.train.Saver()
+    # The updates are built once so that the graph does not grow during training
+    # An n-step transition is bootstrapped from the state n steps later
+    q_estimator.build_double_dqn_update(target_estimator, discount_factor ** n_step)
+    copy_params_op = make_copy_model_parameters_op(q_estimator, target_estimator)
+    if target_update_tau is not None:
+        # The weights are read only after the gradient step has written them
+        with tf.control_dependencies([q_estimator.double_dqn_train_op]):
+            soft_update_op = make_copy_model_parameters_op(q_estimator, target_estimator, tau=target_update_tau)
+        # Fused with the gradient step so that it takes no extra session call
+        q_estimator.double_dqn_train_op = tf.group(q_estimator.double_dqn_train_op, soft_update_op)
+    if actor_estimator is not None:
+        publish_op = make_copy_model_parameters_op(q_estimator, actor_estimator)
+
+    # The checkpoints are written in the background, the latest ones and the best by reward are kept
+    checkpoints = CheckpointManager(sess, checkpoint_dir, every_seconds=checkpoint_every_seconds)
+    resume_state = {}
     if restore:
-        starting_episode = get_last_episode(reward_dir)
         # Load a previous checkpoint if we find one
-        latest_checkpoint = tf.train.latest_checkpoint(checkpoint_dir)
+        latest_checkpoint = checkpoints.latest()
+        # The counters saved with the checkpoint, the event files are scanned for the legacy runs
+        resume_state = get_resume_state(latest_checkpoint, reward_dir)
+        starting_episode = resume_state['episode']
+        legacy_checkpoint = tf.train.latest_checkpoint(checkpoint_dir)
         if latest_checkpoint:
-            print("Loading model checkpoint {}...\n".format(latest_checkpoint))
-            saver.restore(sess, latest_checkpoint)
+            print("Loading model checkpoint {}...\n".format(checkpoints.path_of(latest_checkpoint)))
+            checkpoints.restore(latest_checkpoint)
+        elif legacy_checkpoint:
+            print("Loading model checkpoint {}...\n".format(legacy_checkpoint))
+            tf.train.Saver().restore(sess, legacy_checkpoint)
+
+    total_t = resume_state['total_t'] if 'total_t' in resume_state else sess.run(tf.train.get_global_step())
 
-    total_t = sess.run(tf.train.get_global_step())
+    if telemetry is None:
+        telemetry = Telemetry(enabled=False)
+    if timers is None:
+        timers = PhaseTimers(enabled=False)
 
     # The epsilon decay schedule
     epsilons = np.linspace(epsilon_start, epsilon_end, epsilon_decay_steps)
 
-    reward_shaper = StatePotentialRewardShaper('replays/')
-    reward_shaper.load()
-
     replay_buffer = PrioritizedReplayBuffer(
         replay_memory_size=replay_memory_size,
         total_steps=num_steps,
         reward_shaper=reward_shaper,
-        discount_factor=discount_factor,
+        # The potentials of the n-step transitions telescope over the whole windows. The
+        # shorter windows at the ends of the episodes are shaped approximately
+        discount_factor=discount_factor ** n_step,
         save_dir=experiment_dir)
 
     # The policy we're following
-    policy = make_epsilon_greedy_policy(q_estimator, ACTIONS_TOTAL)
+    acting_estimator = actor_estimator or q_estimator
+    numpy_network = None
+    if numpy_refresh_every is not None:
+        numpy_network = acting_estimator.to_numpy(refresh_every=numpy_refresh_every)
+    policy = make_epsilon_greedy_policy(acting_estimator, ACTIONS_TOTAL, numpy_network=numpy_network)
+
+    learner = None
+    if actor_estimator is not None:
+        # The learner takes over the updates and the target copies
+        learner = AsyncLearner(
+            sess=sess,
+            q_estimator=q_estimator,
+            replay_buffer=replay_buffer,
+            publish_op=publish_op,
+            step_fn=lambda: total_t,
+            batch_size=batch_size,
+            publish_every=publish_weights_every,
+            copy_params_op=copy_params_op if target_update_tau is None else None,
+            update_target_estimator_every=update_target_estimator_every,
+            numpy_network=numpy_network)
+        learner.publish()
+        policy = make_locked_policy(policy, learner.weights_lock)
+    elif numpy_network is not None:
+        numpy_network.refresh(sess)
 
     # Populate the replay memory with initial experience
     action_sampler = lambda state: policy(sess, state, epsilons[min(total_t, epsilon_decay_steps-1)])
-    populate_replay_buffer(replay_buffer, action_sampler, env)
-
-    print('Training is starting...')
-    # Training the agent
-    for i_episode in itertools.count(starting_episode):
-        episode_reward = 0
-        multiplier = 1
+    pusher = NStepPusher(replay_buffer, n_step, discount_factor)
+    populate_replay_buffer(pusher, action_sampler, env, telemetry)
 
-        # Save the current checkpoint
-        saver.save(tf.get_default_session(), checkpoint_path)
+    if target_update_tau is not None and total_t == 0:
+        sess.run(copy_params_op)
+    sess.graph.finalize()
 
-        # Reset the environment
-        state = env.reset()
-        state = StatePreprocessor.process(state)
-        done = False
-
-        # One step in the environment
-        for t in itertools.count():
-            if total_t >= num_steps:
-                return
-
-            eps = epsilons[min(total_t, epsilon_decay_steps-1)]
-
-            if done or len(state) != STATE_DIM:
-                print("Finished episode with reward", episode_reward)
-                summary = tf.Summary(value=[tf.Summary.Value(tag="rewards", simple_value=episode_reward)])
-                reward_writer.add_summary(summary, i_episode)
-                summary = tf.Summary(value=[tf.Summary.Value(tag="eps", simple_value=eps)])
-                reward_writer.add_summary(summary, i_episode)
-                break
-
-            # Maybe update the target estimator
-            if total_t % update_target_estimator_every == 0:
-                copy_model_parameters(sess, q_estimator, target_estimator)
-                print("\nCopied model parameters to target network.")
-
-            print('State potential:', reward_shaper.get_state_potential(state))
-
-            # Take a step
-            action_probs = policy(sess, state, eps)
-            action = np.random.choice(np.arange(len(action_probs)), p=action_probs)
-            print("state: {state}, action: {action}.".format(state=state, action=action))
-
-            next_state, reward, done, _ = env.step(action=action)
-            next_state = StatePreprocessor.process(next_state)
-
-            episode_reward += reward * multiplier
-            multiplier *= discount_factor
-
-            # Save transition to replay memory
-            replay_buffer.push(state, action, next_state, done, reward)
-
-            if total_t % update_q_values_every == 0:
-                # Sample a minibatch from the replay memory
-                samples, weights, idx = replay_buffer.sample(batch_size, total_t)
-                states, actions, next_states, dones, rewards, _ = map(np.array, zip(*samples))
-
-                not_dones = np.invert(dones).astype(np.float32)
-                # Calculate q values and targets (Double DQN)
-                next_q_values = q_estimator.predict(sess, next_states)
-                best_actions = np.argmax(next_q_values, axis=1)
-                next_q_values_target = target_estimator.predict(sess, next_states)
-                targets = (
-                    rewards +
-                    discount_factor * not_dones * next_q_values_target[np.arange(batch_size), best_actions])
-
-                # Perform gradient descent update
-                predictions = q_estimator.update(sess, states, actions, targets, weights)
-
-                # Update transition priorities
-                deltas = np.abs(predictions - targets)
-                replay_buffer.update_priorities(idx, deltas)
-
-            print("\rStep {}, episode {} ({}/{})".format(t, i_episode, total_t, num_steps), end="\t")
-            sys.stdout.flush()
-
-            state = next_state
-            total_t += 1
+    print('Training is starting...')
+    if learner is not None:
+        learner.start()
+    last_episode_reward = None
+    try:
+        # Training the agent
+        for i_episode in itertools.count(starting_episode):
+            episode_reward = 0
+            multiplier = 1
+
+            # Save the current checkpoint
+            with timers.phase('checkpoint'):
+                checkpoints.maybe_save(total_t, reward=last_episode_reward, metadata={
+                    'episode': i_episode,
+                    'total_t': int(total_t),
+                })
+
+            # Reset the environment, the steps of a broken off episode are not pushed
+            pusher.end_episode()
+            with timers.phase('env'):
+                state = env.reset()
+            state = StatePreprocessor.process(state)
+            done = False
+
+            # One step in the environment
+            for t in itertools.count():
+                if total_t >= num_steps:
+                    return
+
+                eps = epsilons[min(total_t, epsilon_decay_steps-1)]
+
+                if done or len(state) != STATE_DIM:
+                    print("Finished episode with reward", episode_reward)
+                    last_episode_reward = episode_reward
+                    summary = tf.Summary(value=[tf.Summary.Value(tag="rewards", simple_value=episode_reward)])
+                    reward_writer.add_summary(summary, i_episode)
+                    summary = tf.Summary(value=[tf.Summary.Value(tag="eps", simple_value=eps)])
+                    reward_writer.add_summary(summary, i_episode)
+                    break
+
+                # Maybe update the target estimator
+                if learner is None and target_update_tau is None and total_t % update_target_estimator_every == 0:
+                    with timers.phase('target_sync'):
+                        sess.run(copy_params_op)
+                    print("\nCopied model parameters to target network.")
+
+                verbose = telemetry.verbose(total_t)
+                if verbose:
+                    print('State potential:', reward_shaper.get_state_potential(state))
+
+                # Take a step
+                with timers.phase('inference'):
+                    action_probs = policy(sess, state, eps)
+                    action = np.random.choice(np.arange(len(action_probs)), p=action_probs)
+                if verbose:
+                    print("state: {state}, action: {action}.".format(state=state, action=action))
+
+                with timers.phase('env'):
+                    next_state, reward, done, _ = env.step(action=action)
+                next_state = StatePreprocessor.process(next_state)
+
+                episode_reward += reward * multiplier
+                telemetry.record('reward', reward)
+                multiplier *= discount_factor
+
+                # Save transition to replay memory, the reward is shaped by the buffer
+                with timers.phase('replay_push'):
+                    pusher.push(state, action, next_state, done, reward)
+
+                if learner is not None:
+                    learner.check()
+                elif total_t % update_q_values_every == 0:
+                    # Sample a minibatch from the replay memory
+                    with timers.phase('sampling'):
+                        samples, weights, idx = replay_buffer.sample(batch_size, total_t)
+                        states, actions, next_states, dones, rewards, _ = map(np.array, zip(*samples))
+
+                    # Calculate the Double DQN targets and perform gradient descent update in one call
+                    with timers.phase('update'):
+                        td_errors = q_estimator.double_dqn_update(
+                            sess, states, actions, rewards, next_states, dones, weights)
+
+                    # Update transition priorities
+                    deltas = np.abs(td_errors)
+                    with timers.phase('sampling'):
+                        replay_buffer.update_priorities(idx, deltas)
+                    telemetry.record('td_error', np.mean(deltas))
+
+                    if numpy_network is not None:
+                        with timers.phase('target_sync'):
+                            numpy_network.maybe_refresh(sess)
+
+                if verbose:
+                    print("\rStep {}, episode {} ({}/{})".format(t, i_episode, total_t, num_steps), end="\t")
+                    sys.stdout.flush()
+
+                telemetry.maybe_flush(total_t)
+
+                state = next_state
+                total_t += 1
+    finally:
+        telemetry.flush(total_t)
+        if timers.enabled:
+            print(timers.format_report())
+        if learner is not None:
+            learner.stop()
+        checkpoints.close()
 
 
 def main():
     parser = argparse.ArgumentParser(description='Trains the agent by DQN')
     parser.add_argument('experiment', help='specifies the experiment name')
+    parser.add_argument('--async-learner', action='store_true',
+                        help='trains on a separate thread while the agent acts with published weights')
+    parser.add_argument('--verbose-every', type=int, default=100,
+                        help='number of the steps between the printed progress, states and actions, 0 to print none')
+    parser.add_argument('--profile-phases', action='store_true',
+                        help='times the phases of the steps, SIGUSR1 prints them and toggles a cProfile dump')
+    parser.add_argument('--n-step', type=int, default=1,
+                        help='number of the rewards summed in the targets before bootstrapping')
     args = parser.parse_args()
 
+    # The demos are compiled before the session exists, the compilation may fork worker processes
+    reward_shaper = StatePotentialRewardShaper('replays/')
+    reward_shaper.load()
+
     env = DotaEnvironment()
 
     # Where we save our checkpoints and graphs
@@ -234,16 +442,30 @@ def main():
         STATE_DIM,
         ACTIONS_TOTAL,
         scope="target_q")
+    actor_estimator = None
+    if args.async_learner:
+        actor_estimator = Estimator(
+            STATE_DIM,
+            ACTIONS_TOTAL,
+            scope="actor_q")
 
     with tf.Session() as sess:
         sess.run(tf.global_variables_initializer())
 
+        telemetry = Telemetry(
+            summary_writer=tf.summary.FileWriter(os.path.join(experiment_dir, "telemetry")),
+            verbose_every=args.verbose_every)
+        timers = PhaseTimers(enabled=args.profile_phases)
+        if args.profile_phases:
+            timers.install_signal_handler(os.path.join(experiment_dir, "profile.prof"))
+
         deep_q_learning(
             sess=sess,
             env=env,
             q_estimator=q_estimator,
             target_estimator=target_estimator,
             experiment_dir=experiment_dir,
+            reward_shaper=reward_shaper,
             num_steps=500000,
             replay_memory_size=10000,
             epsilon_decay_steps=100000,
@@ -252,6 +474,10 @@ def main():
             update_target_estimator_every=1000,
             update_q_values_every=4,
             batch_size=32,
+            actor_estimator=actor_estimator,
+            telemetry=telemetry,
+            timers=timers,
+            n_step=args.n_step,
             restore=False)
 
     env.close()
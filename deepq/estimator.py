@@ -3,6 +3,9 @@
 import os
 import tensorflow as tf
 
+from deepq.numpy_network import NumpyNetwork
+from deepq.session_callable import SessionCallable
+
 
 class Estimator:
     """Q-Value estimation neural network.
@@ -16,9 +19,14 @@ class Estimator:
             state_space,
             action_space,
             scope="estimator",
-            summaries_dir=None):
+            summaries_dir=None,
+            summaries_every=100):
         self.scope = scope
         self.summary_writer = None
+        # The histogram summaries are evaluated only on every summaries_every-th update
+        self.summaries_every = summaries_every
+        self._updates = 0
+        self._predict_fn = None
         with tf.variable_scope(scope):
             # Build the graph
             self._build_model(state_space, action_space)
@@ -40,16 +48,17 @@ class Estimator:
 
         layer_shape = 20
 
-        # Network
-        fc1 = tf.layers.dense(inputs=self.X, units=layer_shape, activation=tf.nn.relu)
-        fc2 = tf.layers.dense(inputs=fc1, units=layer_shape, activation=tf.nn.relu)
-
+        # Network layers are kept to apply the same weights to other inputs
+        self.hidden_layers = [
+            tf.layers.Dense(units=layer_shape, activation=tf.nn.relu),
+            tf.layers.Dense(units=layer_shape, activation=tf.nn.relu),
+        ]
         # State values
-        fc3s = tf.layers.dense(inputs=fc2, units=1, activation=None)
+        self.value_layer = tf.layers.Dense(units=1, activation=None)
         # Advantage values
-        fc3a = tf.layers.dense(inputs=fc2, units=action_space, activation=None)
+        self.advantage_layer = tf.layers.Dense(units=action_space, activation=None)
 
-        self.predictions = fc3s + (fc3a - tf.reduce_mean(fc3a, reduction_indices=[1, ], keep_dims=True))
+        self.predictions = self.q_values(self.X)
 
         # Get the predictions for the chosen actions only
         batch_size = tf.shape(self.X)[0]
@@ -70,21 +79,93 @@ class Estimator:
                                                 global_step=tf.train.get_global_step())
 
         # Summaries for Tensorboard
-        self.summaries = tf.summary.merge([
-            tf.summary.scalar("loss", self.loss),
-            tf.summary.histogram("loss_hist", self.losses),
+        self.summaries = self._build_summaries(self.losses, self.loss)
+
+    def _build_summaries(self, losses, loss):
+        return tf.summary.merge([
+            tf.summary.scalar("loss", loss),
+            tf.summary.histogram("loss_hist", losses),
             tf.summary.histogram("q_values_hist", self.predictions),
             tf.summary.scalar("max_q_value", tf.reduce_max(self.predictions))])
 
+    def q_values(self, X):
+        """Applies the network to a batch of states."""
+        hidden = X
+        for layer in self.hidden_layers:
+            hidden = layer(hidden)
+        state_values = self.value_layer(hidden)
+        advantages = self.advantage_layer(hidden)
+        return state_values + (advantages - tf.reduce_mean(advantages, reduction_indices=[1, ], keep_dims=True))
+
+    def to_numpy(self, refresh_every=1):
+        """Creates a NumpyNetwork computing the same Q-values, it has to be refreshed before it is used."""
+        return NumpyNetwork.from_dense_layers(
+            self.hidden_layers, [self.advantage_layer], [self.value_layer], refresh_every=refresh_every)
+
+    def build_double_dqn_update(self, target_estimator, discount_factor):
+        """Builds the update that computes the Double DQN targets in the graph.
+
+        The best next actions are selected by this estimator and evaluated by
+        target_estimator, so the whole update takes a single session call.
+        """
+        with tf.name_scope("double_dqn"):
+            # Next states, rewards and terminal flags of the transitions
+            self.next_X = tf.placeholder(shape=self.X.shape, dtype=tf.float32, name="next_X")
+            self.rewards = tf.placeholder(shape=[None], dtype=tf.float32, name="rewards")
+            self.dones = tf.placeholder(shape=[None], dtype=tf.bool, name="dones")
+
+            best_actions = tf.argmax(self.q_values(self.next_X), axis=1, output_type=tf.int32)
+            next_q_values_target = target_estimator.q_values(self.next_X)
+            next_best_q_values = tf.reduce_sum(
+                next_q_values_target * tf.one_hot(best_actions, tf.shape(next_q_values_target)[1]), axis=1)
+            not_dones = 1.0 - tf.cast(self.dones, tf.float32)
+            targets = tf.stop_gradient(self.rewards + discount_factor * not_dones * next_best_q_values)
+
+            self.td_errors = self.action_predictions - targets
+            losses = tf.square(self.td_errors)
+            self.double_dqn_loss = loss = tf.losses.compute_weighted_loss(losses, self.weights)
+            var_list = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope=self.scope + "/")
+            self.double_dqn_train_op = self.optimizer.minimize(loss,
+                                                               global_step=tf.train.get_global_step(),
+                                                               var_list=var_list)
+            self.double_dqn_summaries = self._build_summaries(losses, loss)
+
     def predict(self, sess, X):
-        feed_dict = {self.X: X}
-        return sess.run(self.predictions, feed_dict=feed_dict)
+        # The prediction step is compiled once per session
+        if self._predict_fn is None or self._predict_fn.sess is not sess:
+            self._predict_fn = SessionCallable(sess, [self.X], [self.predictions])
+        return self._predict_fn(X)[0]
+
+    def _summarize_update(self):
+        summarize = self.summary_writer is not None and self._updates % self.summaries_every == 0
+        self._updates += 1
+        return summarize
 
     def update(self, sess, X, actions, targets, weights):
         feed_dict = {self.X: X, self.Y: targets, self.action_ind: actions, self.weights: weights}
+        if not self._summarize_update():
+            predictions, _ = sess.run([self.action_predictions, self.train_op], feed_dict)
+            return predictions
         summaries, global_step, predictions, _ = sess.run(
             [self.summaries, tf.train.get_global_step(), self.action_predictions, self.train_op],
             feed_dict)
-        if self.summary_writer:
-            self.summary_writer.add_summary(summaries, global_step)
+        self.summary_writer.add_summary(summaries, global_step)
         return predictions
+
+    def double_dqn_update(self, sess, X, actions, rewards, next_X, dones, weights):
+        """Performs the update built by build_double_dqn_update and returns the TD errors."""
+        feed_dict = {
+            self.X: X,
+            self.action_ind: actions,
+            self.rewards: rewards,
+            self.next_X: next_X,
+            self.dones: dones,
+            self.weights: weights}
+        if not self._summarize_update():
+            td_errors, _ = sess.run([self.td_errors, self.double_dqn_train_op], feed_dict)
+            return td_errors
+        summaries, global_step, td_errors, _ = sess.run(
+            [self.double_dqn_summaries, tf.train.get_global_step(), self.td_errors, self.double_dqn_train_op],
+            feed_dict)
+        self.summary_writer.add_summary(summaries, global_step)
+        return td_errors
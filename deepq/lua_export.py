@@ -0,0 +1,53 @@
+# Author: Mikita Sazanovich
+
+import os
+
+from dotaenv.codes import STATE_PROJECT
+
+
+def _lua_number(value):
+    return repr(float(value))
+
+
+def _lua_vector(values):
+    return '{' + ', '.join(_lua_number(value) for value in values) + '}'
+
+
+def _lua_layers(layers, indent):
+    lines = ['{']
+    for kernel, bias, activation in layers:
+        lines.append(indent + '    {')
+        lines.append(indent + "        activation = '{}',".format(activation))
+        lines.append(indent + '        bias = {},'.format(_lua_vector(bias)))
+        # Every row of the kernel holds the weights of an input
+        lines.append(indent + '        kernel = {')
+        for row in kernel:
+            lines.append(indent + '            {},'.format(_lua_vector(row)))
+        lines.append(indent + '        },')
+        lines.append(indent + '    },')
+    lines.append(indent + '}')
+    return '\n'.join(lines)
+
+
+def export_to_lua(numpy_network, path):
+    """ Writes the snapshot of a NumpyNetwork into a Lua module read by bot/agent_utils/policy.lua.
+
+    The module also holds the 1-based indices of the observation features the
+    network takes, see dotaenv.codes.STATE_PROJECT.
+    """
+    torso, head, value_head = numpy_network.snapshot()
+    content = '\n'.join([
+        '-- Weights of the policy network, generated by deepq/lua_export.py.',
+        '',
+        'return {',
+        '    state_project = {' + ', '.join(str(index + 1) for index in STATE_PROJECT) + '},',
+        '    torso = ' + _lua_layers(torso, '    ') + ',',
+        '    head = ' + _lua_layers(head, '    ') + ',',
+        '    value_head = ' + _lua_layers(value_head, '    ') + ',',
+        '}',
+        '',
+    ])
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as lua_file:
+        lua_file.write(content)
+    os.replace(tmp_path, path)
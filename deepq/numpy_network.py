@@ -0,0 +1,101 @@
+# Author: Mikita Sazanovich
+
+import numpy as np
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'tanh': np.tanh,
+}
+
+
+def _activation_name(activation):
+    if activation is None:
+        return 'linear'
+    if isinstance(activation, str):
+        return activation
+    return activation.__name__
+
+
+def _apply(layers, X):
+    for kernel, bias, activation in layers:
+        X = ACTIVATIONS[activation](X.dot(kernel) + bias)
+    return X
+
+
+class NumpyNetwork:
+    """Snapshot of the weights of a small dense network evaluated with NumPy.
+
+    The network is a torso of dense layers followed by a head of dense layers,
+    plus a state value head if the network is dueling. Acting with a single
+    state this way skips the session call, which costs much more than the
+    network itself. The snapshot is taken from the session by refresh.
+    """
+
+    def __init__(self, torso, head, value_head=None, refresh_every=1):
+        """
+        :param torso: list of (kernel, bias, activation) of the shared layers, where kernel
+        and bias are tf variables and activation is a function, its name or None
+        :param head: list of such layers computing the outputs, the advantages if dueling
+        :param value_head: list of such layers computing the state value of a dueling network
+        :param refresh_every: number of the updates between the snapshots taken by maybe_refresh
+        """
+        self.refresh_every = refresh_every
+        self._structure = [[(kernel, bias, _activation_name(activation)) for kernel, bias, activation in layers]
+                           for layers in (torso, head, value_head or [])]
+        for layers in self._structure:
+            for _, _, activation in layers:
+                if activation not in ACTIVATIONS:
+                    raise ValueError('Unsupported activation {}'.format(activation))
+        self._layers = None
+        self._updates = 0
+
+    @staticmethod
+    def from_dense_layers(torso, head, value_head=None, refresh_every=1):
+        """ Creates the network from built tf.layers.Dense layers.
+        """
+        def convert(layers):
+            return [(layer.kernel, layer.bias, layer.activation) for layer in layers]
+        return NumpyNetwork(convert(torso), convert(head),
+                            value_head=convert(value_head) if value_head else None,
+                            refresh_every=refresh_every)
+
+    def refresh(self, sess):
+        """ Takes a snapshot of the current weights from the session.
+        """
+        variables = [[(kernel, bias) for kernel, bias, _ in layers] for layers in self._structure]
+        values = sess.run(variables)
+        # The layers are replaced at once so that a concurrent evaluation sees either snapshot
+        self._layers = [[(kernel, bias, activation) for (kernel, bias), (_, _, activation) in zip(layer_values, layers)]
+                        for layer_values, layers in zip(values, self._structure)]
+
+    def maybe_refresh(self, sess, updates=1):
+        """ Counts the updates of the weights and refreshes the snapshot every refresh_every of them.
+        """
+        previous = self._updates
+        self._updates += updates
+        if self._layers is None or self._updates // self.refresh_every > previous // self.refresh_every:
+            self.refresh(sess)
+
+    def snapshot(self):
+        """ Returns the torso, head and value head of the current snapshot as lists of
+        (kernel, bias, activation name), the value head being empty if the network is not dueling.
+        """
+        return self._layers
+
+    def outputs(self, X):
+        """ Returns the outputs of the network, Q-values or logits, for a batch of states.
+        """
+        torso, head, value_head = self._layers
+        hidden = _apply(torso, np.asarray(X, dtype=np.float32))
+        outputs = _apply(head, hidden)
+        if value_head:
+            outputs = _apply(value_head, hidden) + (outputs - np.mean(outputs, axis=1, keepdims=True))
+        return outputs
+
+    def softmax(self, X):
+        """ Returns the softmax of the outputs for a batch of states.
+        """
+        logits = self.outputs(X)
+        exps = np.exp(logits - np.max(logits, axis=1, keepdims=True))
+        return exps / np.sum(exps, axis=1, keepdims=True)
@@ -5,8 +5,22 @@ import tensorflow as tf
 
 
 def get_last_episode(rewards_dir):
+    """ Counts the episodes by scanning every event file in rewards_dir, which is slow for long runs.
+    """
     last_episode = 0
     for reward_file in os.listdir(rewards_dir):
         reward_path = os.path.join(rewards_dir, reward_file)
         last_episode += len(list(tf.train.summary_iterator(reward_path)))
     return last_episode
+
+
+def get_resume_state(checkpoint_entry, rewards_dir):
+    """ Returns the counters to resume the training from.
+
+    The counters are kept in the metadata of the checkpoint's index entry. For
+    the runs checkpointed without the metadata only the episode is known, it is
+    counted by scanning the event files.
+    """
+    if checkpoint_entry is not None and checkpoint_entry.get('metadata'):
+        return checkpoint_entry['metadata']
+    return {'episode': get_last_episode(rewards_dir)}
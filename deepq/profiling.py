@@ -0,0 +1,130 @@
+# Author: Mikita Sazanovich
+
+import cProfile
+import signal
+import time
+
+import numpy as np
+
+PERCENTILES = (50, 90, 99)
+
+
+class _Phase:
+    """Context manager timing a phase into a rolling window of durations."""
+
+    __slots__ = ('durations', 'position', 'count', 'total', '_start')
+
+    def __init__(self, window):
+        self.durations = np.zeros(window, dtype=np.float64)
+        self.position = 0
+        self.count = 0
+        self.total = 0.0
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self._start
+        self.durations[self.position] = duration
+        self.position = (self.position + 1) % len(self.durations)
+        self.count += 1
+        self.total += duration
+        return False
+
+
+class _NullPhase:
+    """Context manager doing nothing, returned by disabled timers."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class PhaseTimers:
+    """Named timers of the phases of a training step.
+
+    A phase is timed by a with statement, e.g. `with timers.phase('env'):`. The
+    context managers are created once per name and reused, so a timed phase
+    costs two perf_counter calls and an array write. The percentiles are
+    computed over the rolling window of the latest durations only when a
+    report is requested. Disabled timers return a context manager doing
+    nothing.
+    """
+
+    def __init__(self, window=1000, enabled=True):
+        """
+        :param window: number of the latest durations of a phase the percentiles are computed over
+        :param enabled: whether the phases are timed
+        """
+        self.window = window
+        self.enabled = enabled
+        self._phases = {}
+        self._profile = None
+
+    def phase(self, name):
+        """ Returns the context manager timing the phase.
+        """
+        if not self.enabled:
+            return _NULL_PHASE
+        timer = self._phases.get(name)
+        if timer is None:
+            timer = self._phases[name] = _Phase(self.window)
+        return timer
+
+    def report(self):
+        """ Returns a dict of the phase statistics by name: the number of the timings, the total
+        seconds and the percentiles of the window in milliseconds.
+        """
+        report = {}
+        for name, timer in self._phases.items():
+            if timer.count == 0:
+                continue
+            window = timer.durations[:min(timer.count, len(timer.durations))]
+            stats = {'count': timer.count, 'total': timer.total}
+            for percentile, value in zip(PERCENTILES, np.percentile(window, PERCENTILES)):
+                stats['p{}'.format(percentile)] = value * 1000
+            report[name] = stats
+        return report
+
+    def format_report(self):
+        """ Returns the report as a table sorted by the total time of the phases.
+        """
+        report = self.report()
+        lines = ['{:<16} {:>10} {:>10} {:>9} {:>9} {:>9}'.format('phase', 'count', 'total, s', 'p50, ms', 'p90, ms',
+                                                                'p99, ms')]
+        for name, stats in sorted(report.items(), key=lambda item: -item[1]['total']):
+            lines.append('{:<16} {:>10} {:>10.2f} {:>9.3f} {:>9.3f} {:>9.3f}'.format(
+                name, stats['count'], stats['total'], stats['p50'], stats['p90'], stats['p99']))
+        return '\n'.join(lines)
+
+    def install_signal_handler(self, dump_path, signum=getattr(signal, 'SIGUSR1', None)):
+        """ Makes the signal toggle a cProfile of the main thread and print the report.
+
+        The first signal starts the profile, the next one stops it and dumps it to
+        dump_path in the pstats format, which snakeviz or flameprof turn into a
+        flamegraph. Has to be called from the main thread.
+        """
+        if signum is None:
+            # The platform has no user signals
+            return
+
+        def handle(signum, frame):
+            print(self.format_report())
+            if self._profile is None:
+                print('Profiling until the next signal...')
+                self._profile = cProfile.Profile()
+                self._profile.enable()
+            else:
+                self._profile.disable()
+                self._profile.dump_stats(dump_path)
+                self._profile = None
+                print('Dumped the profile to', dump_path)
+
+        signal.signal(signum, handle)
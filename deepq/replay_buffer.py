@@ -2,6 +2,7 @@
 
 import os
 import pickle
+import threading
 from collections import deque
 
 import numpy as np
@@ -19,6 +20,10 @@ Transition = namedlist(
 
 class PrioritizedReplayBuffer:
     """Reference paper: https://arxiv.org/pdf/1511.05952.pdf.
+
+    The buffer can be shared by an actor and a learner thread. The indices it
+    returns count all the pushed transitions, so they stay valid when older
+    transitions are evicted before the priorities are updated.
     """
 
     def __init__(self,
@@ -38,6 +43,12 @@ class PrioritizedReplayBuffer:
         self.dump_path = os.path.join(save_dir, 'replay_buffer.pickle')
         self.alpha = alpha
         self.beta0 = beta0
+        # Number of the transitions evicted from the left of the memory
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.replay_memory)
 
     def push(self, state, action, next_state, done, reward):
         """ Pushes the transition into memory with MAX_PRIORITY.
@@ -51,42 +62,53 @@ class PrioritizedReplayBuffer:
         reward += (self.discount_factor*self.reward_shaper.get_state_potential(next_state) -
                    self.reward_shaper.get_state_potential(state))
         transition = Transition(state, action, next_state, done, reward, MAX_PRIORITY)
-        self.replay_memory.append(transition)
+        with self.lock:
+            if len(self.replay_memory) == self.replay_memory.maxlen:
+                self.evicted += 1
+            self.replay_memory.append(transition)
 
     def sample(self, batch_size, step):
         """Samples the batch according to priorities.
 
         Returns a tuple of (samples, weights, idx).
         """
-        N = len(self.replay_memory)
-        # Transition sampling probabilities.
-        p = np.zeros(N)
-        for i in range(N):
-            p[i] = self.replay_memory[i].priority ** self.alpha
-        p /= p.sum()
-        # Indices of samples.
-        idx = np.random.choice(N, batch_size, replace=False, p=p).tolist()
-        samples = [self.replay_memory[id] for id in idx]
+        with self.lock:
+            N = len(self.replay_memory)
+            # Transition sampling probabilities.
+            p = np.zeros(N)
+            for i in range(N):
+                p[i] = self.replay_memory[i].priority ** self.alpha
+            p /= p.sum()
+            # Indices of samples.
+            idx = np.random.choice(N, batch_size, replace=False, p=p).tolist()
+            samples = [self.replay_memory[id] for id in idx]
+            evicted = self.evicted
         # Linearly annealing importance-sampling exponent.
         beta = self.beta0 + (1 - self.beta0) * (step / self.total_steps)
         # Importance-sampling weights.
         weights = (N * p[idx]) ** (-beta)
         # Normalize weights.
         weights = weights / np.max(weights)
-        return samples, weights, idx
+        return samples, weights, [id + evicted for id in idx]
 
     def update_priorities(self, idx, deltas):
-        for index, delta in zip(idx, deltas):
-            priority = min(MAX_PRIORITY, delta + EPS_PRIORITY)
-            self.replay_memory[index].priority = min(MAX_PRIORITY, priority)
+        with self.lock:
+            for index, delta in zip(idx, deltas):
+                index -= self.evicted
+                if index < 0:
+                    # The transition has been evicted since it was sampled
+                    continue
+                priority = min(MAX_PRIORITY, delta + EPS_PRIORITY)
+                self.replay_memory[index].priority = min(MAX_PRIORITY, priority)
 
     def save_buffer(self):
         print('saving to', self.dump_path)
-        with open(self.dump_path, 'wb') as dump_file:
+        with self.lock, open(self.dump_path, 'wb') as dump_file:
             pickle.dump(self.replay_memory, dump_file)
 
     def load_buffer(self):
         if os.path.exists(self.dump_path):
             print('loading from', self.dump_path)
-            with open(self.dump_path, 'rb') as dump_file:
+            with self.lock, open(self.dump_path, 'rb') as dump_file:
                 self.replay_memory = pickle.load(dump_file)
+                self.evicted = 0
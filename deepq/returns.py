@@ -0,0 +1,105 @@
+# Author: Mikita Sazanovich
+
+import numpy as np
+
+
+def _discount_cumsum(x, gamma):
+    # y[t] = x[t] + gamma * y[t + 1] is a linear filter run over the reversed sequence
+    from scipy.signal import lfilter
+    return lfilter([1], [1, -gamma], x[..., ::-1], axis=-1)[..., ::-1]
+
+
+def _episode_bounds(dones, length):
+    ends = np.flatnonzero(dones) + 1
+    starts = np.concatenate([[0], ends])
+    ends = np.concatenate([ends, [length]])
+    return [(start, end) for start, end in zip(starts, ends) if start < end]
+
+
+def discounted_returns(rewards, gamma, dones=None, bootstrap=0.0):
+    """ Returns the discounted returns G[t] = rewards[t] + gamma * G[t + 1].
+
+    :param rewards: array of the rewards of the steps, or a 2D array with the sequences in the rows
+    :param gamma: discount factor
+    :param dones: if set, array of the flags of the steps ending an episode, the returns do not
+    cross them. Only 1D rewards are supported with dones
+    :param bootstrap: the value of the state after the last step, added to the returns of the
+    steps after the last done
+    """
+    rewards = np.asarray(rewards, dtype=np.float64)
+    if dones is None:
+        returns = _discount_cumsum(rewards, gamma)
+        tail_start = 0
+    else:
+        returns = np.empty_like(rewards)
+        tail_start = 0
+        for start, end in _episode_bounds(dones, len(rewards)):
+            returns[start:end] = _discount_cumsum(rewards[start:end], gamma)
+            tail_start = end if dones[end - 1] else start
+    tail = rewards.shape[-1] - tail_start
+    if bootstrap != 0.0 and tail > 0:
+        returns[..., tail_start:] += bootstrap * gamma ** np.arange(tail, 0, -1)
+    return returns
+
+
+def n_step_targets(rewards, dones, bootstrap_values, gamma, n):
+    """ Returns the n-step bootstrapped targets.
+
+    The target of a step is the discounted sum of the rewards of up to n steps
+    starting from it plus the discounted value of the state the last of them
+    leads to. The sums stop at the end of an episode, which is not bootstrapped,
+    and at the end of the arrays.
+
+    :param rewards: array of the rewards of the steps
+    :param dones: array of the flags of the steps ending an episode
+    :param bootstrap_values: array of the values of the states the steps lead to
+    :param gamma: discount factor
+    :param n: the largest number of the rewards summed
+    """
+    rewards = np.asarray(rewards, dtype=np.float64)
+    dones = np.asarray(dones, dtype=bool)
+    length = len(rewards)
+    steps = np.arange(length)
+    targets = np.zeros(length)
+    discounts = np.ones(length)
+    last = steps.copy()
+    running = np.ones(length, dtype=bool)
+    # Every step is advanced by one reward at once, so the loop runs n times regardless of the length
+    for k in range(n):
+        index = steps + k
+        running &= index < length
+        index = np.minimum(index, length - 1)
+        targets += np.where(running, discounts * rewards[index], 0.0)
+        last = np.where(running, index, last)
+        discounts = np.where(running, discounts * gamma, discounts)
+        running &= ~dones[index]
+    return targets + discounts * np.asarray(bootstrap_values)[last] * ~dones[last]
+
+
+def gae(rewards, values, dones, gamma, lam):
+    """ Returns the generalized advantage estimates (https://arxiv.org/abs/1506.02438).
+
+    The advantages plus values[:-1] are the targets of the value function.
+
+    :param rewards: array of the rewards of the steps
+    :param values: array of the values of the states the steps start from followed by the value of
+    the state the last step leads to, one longer than rewards
+    :param dones: array of the flags of the steps ending an episode
+    :param gamma: discount factor
+    :param lam: the weight of the longer advantage estimates
+    """
+    values = np.asarray(values, dtype=np.float64)
+    dones = np.asarray(dones, dtype=bool)
+    deltas = np.asarray(rewards) + gamma * values[1:] * ~dones - values[:-1]
+    return discounted_returns(deltas, gamma * lam, dones=dones)
+
+
+def shape_rewards(rewards, potentials, next_potentials, gamma):
+    """ Returns the rewards with the potential-based shaping r + gamma * F(s') - F(s) added.
+
+    :param rewards: array of the rewards of the steps
+    :param potentials: array of the potentials of the states the steps start from
+    :param next_potentials: array of the potentials of the states the steps lead to
+    :param gamma: discount factor
+    """
+    return np.asarray(rewards) + gamma * np.asarray(next_potentials) - np.asarray(potentials)
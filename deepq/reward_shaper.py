@@ -2,6 +2,7 @@
 
 import json
 import math
+import multiprocessing
 import os
 import pickle
 import matplotlib.pyplot as plt
@@ -9,6 +10,7 @@ from abc import ABC, abstractmethod
 
 import numpy as np
 
+from deepq.demo_store import DemoStore
 from deepq.state_preprocessor import StatePreprocessor
 from dotaenv.codes import SHAPER_STATE_PROJECT, SHAPER_STATE_DIM, STATE_DIM, \
     ACTIONS_TOTAL
@@ -17,24 +19,73 @@ from dotaenv.codes import SHAPER_STATE_PROJECT, SHAPER_STATE_DIM, STATE_DIM, \
 class AbstractRewardShaper(ABC):
 
     @abstractmethod
-    def __init__(self, replay_dir):
+    def __init__(self, replay_dir, store_dir=None):
+        """
+        :param replay_dir: directory with the demos
+        :param store_dir: directory for the compiled demos, defaults to replay_dir with the '-compiled' suffix
+        """
         self.replay_dir = replay_dir
         self.state_preprocessor = StatePreprocessor
         self.demos = []
+        if store_dir is None:
+            store_dir = os.path.normpath(replay_dir) + '-compiled'
+        self.demo_store = DemoStore(store_dir, type(self).__name__)
 
-    @abstractmethod
-    def load(self):
+    def load(self, rebuild=False):
+        """ Loads the demos from the compiled store, compiling them from the replay_dir if they are stale.
+        """
+        key = self.demo_store.key_for(self.replay_dir, self.get_compile_params())
+        arrays = None if rebuild else self.demo_store.load(key)
+        if arrays is None:
+            arrays = self.compile()
+            path = self.demo_store.save(key, arrays)
+            print('Compiled demos from {} into {}'.format(self.replay_dir, path))
+        self.set_compiled(arrays)
+
+    def get_compile_params(self):
+        """ Returns the parameters that the compiled arrays depend on besides the demo files.
+        """
+        return {'shaper': type(self).__name__, 'state_dim': STATE_DIM, 'actions_total': ACTIONS_TOTAL}
+
+    def iter_demos(self, limit=None, processes=None):
+        """ Reads the demo files of the replay_dir in a process pool.
+
+        Yields (path, demo) pairs in the sorted order of the file names while
+        the following files are still being processed.
+        """
         # Making the limiting of the number of replays deterministic
-        demo_names = sorted(list(os.listdir(self.replay_dir)))
-        for name in demo_names:
-            dump_path = os.path.join(self.replay_dir, name)
-            with open(dump_path, 'rb') as dump_file:
-                dumped_replay = pickle.load(dump_file)
-            demo = self.process_replay(dumped_replay)
-            self.demos.append(demo)
+        demo_names = sorted(list(os.listdir(self.replay_dir)))[:limit]
+        demo_paths = [os.path.join(self.replay_dir, name) for name in demo_names]
+        if len(demo_paths) <= 1 or processes == 1:
+            demos = map(self.read_demo, demo_paths)
+            yield from zip(demo_paths, demos)
+            return
+        with multiprocessing.Pool(processes=processes) as pool:
+            demos = pool.imap(type(self).read_demo, demo_paths)
+            yield from zip(demo_paths, demos)
 
     @abstractmethod
-    def process_replay(self, dumped_replay):
+    def compile(self):
+        """ Processes the demos from the replay_dir into a dict of named arrays.
+        """
+        pass
+
+    @abstractmethod
+    def set_compiled(self, arrays):
+        """ Sets the demos from the arrays returned by compile.
+        """
+        pass
+
+    @staticmethod
+    @abstractmethod
+    def read_demo(path):
+        """ Reads and processes a single demo file. It is run in the worker processes.
+        """
+        pass
+
+    @staticmethod
+    @abstractmethod
+    def process_replay(dumped_replay):
         pass
 
 
@@ -45,25 +96,43 @@ class StatePotentialRewardShaper(AbstractRewardShaper):
     """
     CLOSE_TO_STATE_EPS = 1e-1
     K = 100
+    # Experimenting with the different number of replays
+    REPLAYS_TO_LEAVE = 3
+
+    def __init__(self, replay_dir, store_dir=None):
+        super(StatePotentialRewardShaper, self).__init__(replay_dir, store_dir)
 
-    def __init__(self, replay_dir):
-        super(StatePotentialRewardShaper, self).__init__(replay_dir)
+    def get_compile_params(self):
+        params = super(StatePotentialRewardShaper, self).get_compile_params()
+        params.update(replays_to_leave=StatePotentialRewardShaper.REPLAYS_TO_LEAVE,
+                      state_project=list(SHAPER_STATE_PROJECT))
+        return params
 
-    def load(self):
-        super(StatePotentialRewardShaper, self).load()
-        # Experimenting with the different number of replays
-        replays_to_leave = 3
-        self.demos = self.demos[:replays_to_leave]
-        assert len(self.demos) == replays_to_leave
+    def compile(self):
+        demos = [demo for _, demo in self.iter_demos(limit=StatePotentialRewardShaper.REPLAYS_TO_LEAVE)]
+        assert len(demos) == StatePotentialRewardShaper.REPLAYS_TO_LEAVE
+        states = np.concatenate([np.reshape(demo, (-1, SHAPER_STATE_DIM)) for demo in demos])
+        lengths = np.array([len(demo) for demo in demos], dtype=np.int64)
+        return {'states': states, 'lengths': lengths}
 
-    def process_replay(self, replay):
+    def set_compiled(self, arrays):
+        self.demos = np.split(arrays['states'], np.cumsum(arrays['lengths'])[:-1])
+
+    @staticmethod
+    def read_demo(path):
+        with open(path, 'rb') as dump_file:
+            dumped_replay = pickle.load(dump_file)
+        return StatePotentialRewardShaper.process_replay(dumped_replay)
+
+    @staticmethod
+    def process_replay(replay):
         demo = []
         for replay_step in replay:
             if len(replay_step) == 0:
                 continue
             state = replay_step
             state_proj = state[SHAPER_STATE_PROJECT]
-            state_proc = self.state_preprocessor.process(state_proj)
+            state_proc = StatePreprocessor.process(state_proj)
             if not demo or np.linalg.norm(demo[len(demo) - 1] - state_proc) > 0:
                 demo.append(state_proc)
         return demo
@@ -90,6 +159,8 @@ class ActionAdviceRewardShaper(AbstractRewardShaper):
     SIGMA[0][0] = 1.0
     SIGMA[1][1] = 1.0
     SIGMA[2][2] = 1.0
+    # SIGMA = SIGMA_FACTOR * SIGMA_FACTOR^T, so the SIGMA metric is Euclidean after projecting by the factor
+    SIGMA_FACTOR = np.linalg.cholesky(SIGMA)
     K = 10
 
     FILTER_THRESHOLD = 0.95
@@ -100,39 +171,148 @@ class ActionAdviceRewardShaper(AbstractRewardShaper):
         value = math.e ** (-1 / 2 * diff.dot(ActionAdviceRewardShaper.SIGMA).dot(diff))
         return value
 
-    def __init__(self, replay_dir):
-        super(ActionAdviceRewardShaper, self).__init__(replay_dir)
-
-    def load(self):
-        filenames = os.listdir(self.replay_dir)
-        filenames = sorted(filenames)
-        for filename in filenames:
-            filepath = os.path.join(self.replay_dir, filename)
-            file = open(filepath, 'r')
-            lines = file.readlines()
-            file.close()
-            demo = self.process_replay(lines)
-            self.demos.append(demo)
-            print('Loaded state-action demo from {}. Its length is {}'.format(filepath, len(demo)))
-        print('Total number of demos:', sum(map(len, self.demos)))
-        filtered_demo = []
-        for demo in self.demos:
-            for demo_state, demo_action in demo:
-                similar = False
-                for filtered_state, filtered_action in filtered_demo:
-                    sim = ActionAdviceRewardShaper.get_states_similarity(
-                        demo_state, filtered_state)
-                    if sim > ActionAdviceRewardShaper.FILTER_THRESHOLD:
-                        similar = True
-                        break
-                if not similar:
-                    filtered_demo.append((demo_state, demo_action))
-        print('Demos after filtering:', len(filtered_demo))
-        self.demos = filtered_demo
-
-    def process_replay(self, replay_lines):
+    @staticmethod
+    def project_states(states):
+        """ Projects the states so that the similarity of two states is exp(-|p1 - p2|^2 / 2).
+        """
+        return np.dot(np.asarray(states, dtype=np.float64), ActionAdviceRewardShaper.SIGMA_FACTOR)
+
+    def __init__(self, replay_dir, kernel_cutoff=None, store_dir=None):
+        """
+        :param replay_dir: directory with the state-action demos
+        :param kernel_cutoff: if set, the potentials are approximated by visiting
+            only the demo states whose similarity to the queried state exceeds
+            the cutoff, which must be in (0, 1). The approximation is indexed by a
+            ball tree built on load.
+        :param store_dir: directory for the compiled demos
+        """
+        if kernel_cutoff is not None and not 0 < kernel_cutoff < 1:
+            raise ValueError('kernel_cutoff must be in (0, 1), got {}'.format(kernel_cutoff))
+        super(ActionAdviceRewardShaper, self).__init__(replay_dir, store_dir)
+        self.kernel_cutoff = kernel_cutoff
+        self.demo_states = np.zeros((0, STATE_DIM), dtype=np.float32)
+        self.demo_actions = np.zeros(0, dtype=np.int64)
+        self._demo_points = np.zeros((0, STATE_DIM))
+        self._demo_sq_norms = np.zeros(0)
+        self._advised_actions = np.zeros(0, dtype=np.int64)
+        self._action_starts = np.zeros(0, dtype=np.int64)
+        self._index = None
+
+    @property
+    def error_bound(self):
+        """ The maximum amount by which a returned potential may underestimate the exact one.
+        """
+        if self.kernel_cutoff is None:
+            return 0.0
+        return ActionAdviceRewardShaper.K * self.kernel_cutoff
+
+    def get_compile_params(self):
+        params = super(ActionAdviceRewardShaper, self).get_compile_params()
+        params.update(sigma=ActionAdviceRewardShaper.SIGMA.tolist(),
+                      filter_threshold=ActionAdviceRewardShaper.FILTER_THRESHOLD)
+        return params
+
+    def compile(self):
+        demo_states = []
+        demo_actions = []
+        for filepath, (states, actions) in self.iter_demos():
+            demo_states.append(states)
+            demo_actions.append(actions)
+            print('Loaded state-action demo from {}. Its length is {}'.format(filepath, len(states)))
+        print('Total number of demos:', sum(map(len, demo_states)))
+        states = np.concatenate([np.zeros((0, STATE_DIM), dtype=np.float32)] + demo_states)
+        actions = np.concatenate([np.zeros(0, dtype=np.int64)] + demo_actions)
+        kept = ActionAdviceRewardShaper.filter_similar_states(states)
+        print('Demos after filtering:', len(kept))
+        return ActionAdviceRewardShaper.compile_demos(states[kept], actions[kept])
+
+    @staticmethod
+    def filter_similar_states(states):
+        """ Returns the indices of the states left after the greedy similarity filtering.
+
+        The states are visited in order and a state is kept unless it is more
+        similar than FILTER_THRESHOLD to an already kept one. A ball tree over
+        all states is queried once per kept state to mark its similar successors.
+        """
+        if len(states) == 0:
+            return np.zeros(0, dtype=np.int64)
+        from sklearn.neighbors import BallTree
+        points = ActionAdviceRewardShaper.project_states(states)
+        radius = math.sqrt(-2 * math.log(ActionAdviceRewardShaper.FILTER_THRESHOLD))
+        tree = BallTree(points)
+        covered = np.zeros(len(points), dtype=bool)
+        kept = []
+        for i in range(len(points)):
+            if covered[i]:
+                continue
+            kept.append(i)
+            neighbours, dists = tree.query_radius(points[i:i + 1], radius, return_distance=True)
+            similar = np.exp(-1 / 2 * dists[0] ** 2) > ActionAdviceRewardShaper.FILTER_THRESHOLD
+            covered[neighbours[0][similar]] = True
+        return np.array(kept, dtype=np.int64)
+
+    @staticmethod
+    def compile_demos(states, actions):
+        """ Builds the lookup arrays for the demonstrated state-action pairs.
+        """
+        # Grouping the demos by action lets the exact mode reduce every action's segment at once
+        order = np.argsort(actions, kind='stable')
+        states = states[order]
+        actions = actions[order]
+        points = ActionAdviceRewardShaper.project_states(states)
+        advised_actions, action_starts = np.unique(actions, return_index=True)
+        return {
+            'states': states,
+            'actions': actions,
+            'points': points,
+            'sq_norms': np.sum(points ** 2, axis=1),
+            'advised_actions': advised_actions,
+            'action_starts': action_starts,
+        }
+
+    def set_demos(self, states, actions):
+        """ Replaces the demonstrated state-action pairs and rebuilds the lookup structures.
+        """
+        self.set_compiled(ActionAdviceRewardShaper.compile_demos(states, actions))
+
+    def get_compiled(self):
+        """ Returns the lookup arrays in the form accepted by set_compiled.
+        """
+        return {
+            'states': self.demo_states,
+            'actions': self.demo_actions,
+            'points': self._demo_points,
+            'sq_norms': self._demo_sq_norms,
+            'advised_actions': self._advised_actions,
+            'action_starts': self._action_starts,
+        }
+
+    def set_compiled(self, arrays):
+        self.demo_states = arrays['states']
+        self.demo_actions = arrays['actions']
+        self._demo_points = arrays['points']
+        self._demo_sq_norms = arrays['sq_norms']
+        self._advised_actions = arrays['advised_actions']
+        self._action_starts = arrays['action_starts']
+        self._index = None
+        if self.kernel_cutoff is not None and len(self.demo_states) > 0:
+            from sklearn.neighbors import BallTree
+            self._index = BallTree(self._demo_points)
+            print('Potentials are approximated with the error bound of', self.error_bound)
+
+    @staticmethod
+    def read_demo(path):
+        # The lines are streamed from the file instead of being read at once
+        with open(path, 'r') as demo_file:
+            return ActionAdviceRewardShaper.process_replay(demo_file)
+
+    @staticmethod
+    def process_replay(replay_lines):
+        """ Returns the arrays of the demo states and actions.
+        """
         last_action = 0
-        demo = []
+        states = []
+        actions = []
         for line in replay_lines:
             state_action_pair = json.loads(line)
             state = state_action_pair['state']
@@ -143,17 +323,35 @@ class ActionAdviceRewardShaper(AbstractRewardShaper):
             vector_state[0] = last_action / (ACTIONS_TOTAL - 1.0)
             vector_state[1:12] = state['hero_info']
             vector_state[12:] = state['enemy_info']
-            demo.append((vector_state, action))
+            states.append(vector_state)
+            actions.append(action)
             last_action = action
-        return demo
+        return np.array(states, dtype=np.float32).reshape(-1, STATE_DIM), np.array(actions, dtype=np.int64)
 
     def get_action_potentials(self, state):
-        potentials = np.zeros(ACTIONS_TOTAL, dtype=np.float32)
-        for demo_state, demo_action in self.demos:
-            potential = ActionAdviceRewardShaper.get_states_similarity(state, demo_state)
-            potential *= ActionAdviceRewardShaper.K
-            potentials[demo_action] = max(potentials[demo_action], potential)
-        return potentials
+        return self.get_action_potentials_batch(np.expand_dims(state, 0))[0]
+
+    def get_action_potentials_batch(self, states):
+        """ Returns the potentials of all actions for every state in the batch.
+
+        The potential of an action is K times the maximum similarity between
+        the state and the demo states where the action was taken.
+        """
+        points = ActionAdviceRewardShaper.project_states(states).reshape(-1, STATE_DIM)
+        potentials = np.zeros((len(points), ACTIONS_TOTAL), dtype=np.float32)
+        if len(self.demo_states) == 0:
+            return potentials
+        if self._index is None:
+            sq_dists = (np.sum(points ** 2, axis=1)[:, np.newaxis] + self._demo_sq_norms[np.newaxis, :] -
+                        2 * points.dot(self._demo_points.T))
+            similarities = np.exp(-1 / 2 * np.maximum(sq_dists, 0))
+            potentials[:, self._advised_actions] = np.maximum.reduceat(similarities, self._action_starts, axis=1)
+        else:
+            radius = math.sqrt(-2 * math.log(self.kernel_cutoff))
+            neighbours, dists = self._index.query_radius(points, radius, return_distance=True)
+            for i in range(len(points)):
+                np.maximum.at(potentials[i], self.demo_actions[neighbours[i]], np.exp(-1 / 2 * dists[i] ** 2))
+        return potentials * ActionAdviceRewardShaper.K
 
 
 def plot_distance_distrib(demo):
@@ -173,7 +371,7 @@ def plot_distance_distrib(demo):
 def main():
     reward_shaper = ActionAdviceRewardShaper('../completed-observations')
     reward_shaper.load()
-    for state, action in reward_shaper.demos:
+    for state, action in zip(reward_shaper.demo_states, reward_shaper.demo_actions):
         print(state, action)
         print('action potentials are:', reward_shaper.get_action_potentials(state))
 
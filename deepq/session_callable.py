@@ -0,0 +1,54 @@
+# Author: Mikita Sazanovich
+
+import numpy as np
+from tensorflow.core.protobuf import config_pb2
+
+
+def _feed_shape(placeholder):
+    # The shape the values are reshaped to, None if it can not be inferred from the placeholder
+    if placeholder.shape.ndims is None:
+        return None
+    dims = placeholder.shape.as_list()
+    if dims.count(None) > 1:
+        return None
+    return [-1 if dim is None else dim for dim in dims]
+
+
+class SessionCallable:
+    """Runs fixed fetches of a graph for the values of fixed placeholders.
+
+    The step is compiled once by Session._make_callable_from_options, as the
+    tf.keras backend does, so a call neither builds a feed dict nor prunes the
+    graph again. Session.make_callable would not do: given a feed list, it
+    builds a feed dict and calls run. The values are cast to the dtypes of the
+    placeholders and reshaped to their shapes, like the adjust_shape of
+    baselines' U.function, e.g. a single row of biases is fed to a
+    (None, actions) placeholder.
+    """
+
+    def __init__(self, sess, feeds, fetches, targets=()):
+        """
+        :param sess: the session to run the step in
+        :param feeds: the placeholders, the values are passed to the call in this order
+        :param fetches: the tensors the call returns the values of
+        :param targets: the ops run without returning values, e.g. the updates
+        """
+        options = config_pb2.CallableOptions()
+        options.feed.extend(feed.name for feed in feeds)
+        options.fetch.extend(fetch.name for fetch in fetches)
+        options.target.extend(target.name for target in targets)
+        self.sess = sess
+        self._dtypes = [feed.dtype.as_numpy_dtype for feed in feeds]
+        self._shapes = [_feed_shape(feed) for feed in feeds]
+        self._callable = sess._make_callable_from_options(options)
+
+    def __call__(self, *values):
+        """ Returns the list of the values of the fetches.
+        """
+        arrays = []
+        for value, dtype, shape in zip(values, self._dtypes, self._shapes):
+            array = np.asarray(value, dtype=dtype)
+            if shape is not None:
+                array = array.reshape(shape)
+            arrays.append(array)
+        return self._callable(*arrays)
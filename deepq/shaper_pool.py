@@ -0,0 +1,120 @@
+# Author: Mikita Sazanovich
+
+import ctypes
+import multiprocessing
+import time
+
+import numpy as np
+
+from deepq.reward_shaper import ActionAdviceRewardShaper
+from dotaenv.codes import STATE_DIM, ACTIONS_TOTAL
+
+# Set in every worker process by _init_worker
+_worker_shaper = None
+_worker_states = None
+_worker_potentials = None
+
+
+def _to_shared(array):
+    raw = multiprocessing.RawArray(ctypes.c_byte, max(array.nbytes, 1))
+    shared = (raw, array.dtype.str, array.shape)
+    _from_shared(shared)[...] = array
+    return shared
+
+
+def _from_shared(shared):
+    raw, dtype, shape = shared
+    return np.frombuffer(raw, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def _init_worker(kernel_cutoff, shared_arrays, shared_states, shared_potentials):
+    global _worker_shaper, _worker_states, _worker_potentials
+    # The shaper is only used for the lookups, so it does not need the demo files
+    _worker_shaper = ActionAdviceRewardShaper(replay_dir='', kernel_cutoff=kernel_cutoff)
+    _worker_shaper.set_compiled({name: _from_shared(shared) for name, shared in shared_arrays.items()})
+    _worker_states = _from_shared(shared_states)
+    _worker_potentials = _from_shared(shared_potentials)
+
+
+def _evaluate_slice(bounds):
+    start, end = bounds
+    _worker_potentials[start:end] = _worker_shaper.get_action_potentials_batch(_worker_states[start:end])
+
+
+def _best_time(fn, repeats=5):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.time()
+        fn()
+        best = min(best, time.time() - start)
+    return best
+
+
+class ShaperWorkerPool:
+    """Persistent process pool evaluating action-advice potentials for batches of states.
+
+    The compiled demo arrays are copied into shared memory once when the pool
+    starts. Batches are passed through shared state and potential buffers, so
+    only the slice bounds go through the pipes. The first batch of every size
+    is timed both in the pool and in-process, and the faster way is used for
+    that size from then on.
+    """
+
+    def __init__(self, reward_shaper, processes=None, max_batch_size=256):
+        """
+        :param reward_shaper: a loaded ActionAdviceRewardShaper
+        :param processes: number of the worker processes, defaults to the number of CPUs
+        :param max_batch_size: the size of the shared buffers, larger batches are split
+        """
+        self.reward_shaper = reward_shaper
+        self.max_batch_size = max_batch_size
+        self.processes = processes or multiprocessing.cpu_count()
+        self._routes = {}
+        shared_arrays = {name: _to_shared(np.asarray(array))
+                         for name, array in reward_shaper.get_compiled().items()}
+        shared_states = _to_shared(np.zeros((max_batch_size, STATE_DIM)))
+        shared_potentials = _to_shared(np.zeros((max_batch_size, ACTIONS_TOTAL), dtype=np.float32))
+        self._states = _from_shared(shared_states)
+        self._potentials = _from_shared(shared_potentials)
+        self._pool = multiprocessing.Pool(
+            processes=self.processes,
+            initializer=_init_worker,
+            initargs=(reward_shaper.kernel_cutoff, shared_arrays, shared_states, shared_potentials))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def get_action_potentials_batch(self, states):
+        """ Returns the potentials of all actions for every state in the batch.
+        """
+        states = np.asarray(states).reshape(-1, STATE_DIM)
+        if not self._uses_pool(len(states)):
+            return self.reward_shaper.get_action_potentials_batch(states)
+        return self._evaluate_in_pool(states)
+
+    def _uses_pool(self, batch_size):
+        if self.processes < 2 or batch_size < 2:
+            return False
+        if batch_size not in self._routes:
+            states = np.resize(self.reward_shaper.demo_states, (batch_size, STATE_DIM))
+            inline_time = _best_time(lambda: self.reward_shaper.get_action_potentials_batch(states))
+            pool_time = _best_time(lambda: self._evaluate_in_pool(states))
+            self._routes[batch_size] = pool_time < inline_time
+        return self._routes[batch_size]
+
+    def _evaluate_in_pool(self, states):
+        potentials = np.zeros((len(states), ACTIONS_TOTAL), dtype=np.float32)
+        for chunk_start in range(0, len(states), self.max_batch_size):
+            chunk = states[chunk_start:chunk_start + self.max_batch_size]
+            self._states[:len(chunk)] = chunk
+            bounds = np.linspace(0, len(chunk), min(self.processes, len(chunk)) + 1).astype(int)
+            self._pool.map(_evaluate_slice, list(zip(bounds[:-1], bounds[1:])))
+            potentials[chunk_start:chunk_start + len(chunk)] = self._potentials[:len(chunk)]
+        return potentials
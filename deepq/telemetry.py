@@ -0,0 +1,99 @@
+# Author: Mikita Sazanovich
+
+import numpy as np
+import tensorflow as tf
+
+
+class _Ring:
+    """Preallocated ring buffer of the scalars recorded since the last flush."""
+
+    def __init__(self, capacity):
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self.position = 0
+        self.count = 0
+
+    def append(self, value):
+        self.values[self.position] = value
+        self.position = (self.position + 1) % len(self.values)
+        if self.count < len(self.values):
+            self.count += 1
+
+    def drain(self):
+        if self.position >= self.count:
+            window = self.values[self.position - self.count:self.position]
+        else:
+            window = np.concatenate([self.values[self.position - self.count:], self.values[:self.position]])
+        self.count = 0
+        return window
+
+
+class Telemetry:
+    """Cheap recording of the training loop's scalars and verbose per-step records.
+
+    The scalars are written into preallocated ring buffers and flushed to the
+    summary writer as aggregates (mean, min, max, last) in a single summary
+    every flush_every steps, so a step costs an array write instead of a
+    protobuf. The verbose records, e.g. the states and the actions, are only
+    formatted on the steps selected by verbose. A disabled telemetry returns
+    from every call right away.
+    """
+
+    def __init__(self, summary_writer=None, capacity=1024, flush_every=1000, verbose_every=0, enabled=True):
+        """
+        :param summary_writer: the tf.summary.FileWriter to flush the aggregates to, none by default
+        :param capacity: number of the latest values of a tag aggregated on a flush
+        :param flush_every: number of the steps between the flushes done by maybe_flush
+        :param verbose_every: number of the steps between the verbose records, 0 to turn them off
+        :param enabled: whether anything is recorded
+        """
+        self.summary_writer = summary_writer
+        self.capacity = capacity
+        self.flush_every = flush_every
+        self.verbose_every = verbose_every
+        self.enabled = enabled
+        self._rings = {}
+        self._last_flush = None
+
+    def record(self, tag, value):
+        """ Records a scalar to be aggregated on the next flush.
+        """
+        if not self.enabled:
+            return
+        ring = self._rings.get(tag)
+        if ring is None:
+            ring = self._rings[tag] = _Ring(self.capacity)
+        ring.append(value)
+
+    def verbose(self, step):
+        """ Returns whether the verbose records of the step should be made.
+        """
+        return self.enabled and self.verbose_every > 0 and step % self.verbose_every == 0
+
+    def maybe_flush(self, step):
+        """ Flushes the aggregates if flush_every steps have passed since the last flush.
+        """
+        if not self.enabled:
+            return
+        if self._last_flush is None:
+            self._last_flush = step
+        elif step - self._last_flush >= self.flush_every:
+            self.flush(step)
+
+    def flush(self, step):
+        """ Writes the aggregates of the values recorded since the last flush as one summary.
+        """
+        self._last_flush = step
+        values = []
+        for tag, ring in sorted(self._rings.items()):
+            if ring.count == 0:
+                continue
+            last = ring.values[ring.position - 1]
+            window = ring.drain()
+            values.extend([
+                tf.Summary.Value(tag=tag + '/mean', simple_value=float(np.mean(window))),
+                tf.Summary.Value(tag=tag + '/min', simple_value=float(np.min(window))),
+                tf.Summary.Value(tag=tag + '/max', simple_value=float(np.max(window))),
+                tf.Summary.Value(tag=tag + '/last', simple_value=float(last)),
+            ])
+        if values and self.summary_writer is not None:
+            self.summary_writer.add_summary(tf.Summary(value=values), step)
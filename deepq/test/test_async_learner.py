@@ -0,0 +1,96 @@
+import threading
+import unittest
+
+import numpy as np
+
+from deepq.async_learner import AsyncLearner
+
+
+class RecordingSession:
+
+    def __init__(self):
+        self.ops = []
+
+    def run(self, op):
+        self.ops.append(op)
+
+
+class StubEstimator:
+    """Returns the rewards as the TD errors, or raises once the given number of updates is done."""
+
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.updates = 0
+        self.done = threading.Event()
+
+    def double_dqn_update(self, sess, states, actions, rewards, next_states, dones, weights):
+        if self.fail_after is not None and self.updates >= self.fail_after:
+            raise ValueError('The update has failed')
+        self.updates += 1
+        if self.updates >= 10:
+            self.done.set()
+        return rewards
+
+
+class StubReplayBuffer:
+
+    def __init__(self, size):
+        self.size = size
+        self.priorities = {}
+
+    def __len__(self):
+        return self.size
+
+    def sample(self, batch_size, step):
+        samples = [(np.zeros(4), 0, np.zeros(4), False, -float(i), None) for i in range(batch_size)]
+        return samples, np.ones(batch_size), list(range(batch_size))
+
+    def update_priorities(self, idx, priorities):
+        self.priorities.update(zip(idx, priorities))
+
+
+class TestAsyncLearner(unittest.TestCase):
+
+    def make_learner(self, estimator, replay_buffer):
+        return AsyncLearner(RecordingSession(), estimator, replay_buffer, publish_op='publish',
+                            step_fn=lambda: 0, batch_size=4, publish_every=5,
+                            copy_params_op='copy', update_target_estimator_every=5)
+
+    def test_updates(self):
+        estimator = StubEstimator()
+        replay_buffer = StubReplayBuffer(size=8)
+        learner = self.make_learner(estimator, replay_buffer)
+        learner.start()
+        self.assertTrue(estimator.done.wait(10))
+        learner.stop()
+        self.assertFalse(learner.is_alive())
+        learner.check()
+        updates = learner.updates
+        self.assertGreaterEqual(updates, 10)
+        self.assertEqual(estimator.updates, updates)
+        self.assertEqual(replay_buffer.priorities, {i: float(i) for i in range(4)})
+        # The target is copied before every 5th update and the weights are published after it
+        self.assertEqual(learner.sess.ops.count('copy'), (updates - 1) // 5 + 1)
+        self.assertEqual(learner.sess.ops.count('publish'), updates // 5)
+
+    def test_waits_for_batch(self):
+        estimator = StubEstimator()
+        learner = self.make_learner(estimator, StubReplayBuffer(size=3))
+        learner.start()
+        learner.stop()
+        self.assertFalse(learner.is_alive())
+        self.assertEqual(estimator.updates, 0)
+
+    def test_error_reaches_trainer(self):
+        learner = self.make_learner(StubEstimator(fail_after=3), StubReplayBuffer(size=8))
+        learner.start()
+        learner.join(10)
+        self.assertFalse(learner.is_alive())
+        with self.assertRaises(RuntimeError) as context:
+            learner.check()
+        self.assertIsInstance(context.exception.__cause__, ValueError)
+        self.assertEqual(learner.updates, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+import tensorflow as tf
+
+from deepq.checkpoint_manager import CheckpointManager, INDEX_FILE, _write_atomically
+
+
+class TestCheckpointManager(unittest.TestCase):
+
+    def setUp(self):
+        tf.reset_default_graph()
+        self.variable = tf.Variable(np.zeros(3, dtype=np.float32), name="variable")
+        self.sess = tf.Session()
+        self.sess.run(tf.global_variables_initializer())
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.sess.close()
+
+    def make_manager(self, **kwargs):
+        checkpoints = CheckpointManager(self.sess, self.directory, **kwargs)
+        self.addCleanup(checkpoints.close)
+        return checkpoints
+
+    def save(self, checkpoints, step, **kwargs):
+        self.variable.load(np.full(3, step, dtype=np.float32), self.sess)
+        checkpoints.save(step, **kwargs)
+        # Every checkpoint is written, none is replaced by a newer one while pending
+        checkpoints.flush()
+
+    def test_keep_last_and_best(self):
+        checkpoints = self.make_manager(keep_last=2)
+        for step, reward in zip(range(1, 6), [1.0, 5.0, 2.0, 3.0, 4.0]):
+            self.save(checkpoints, step, reward=reward)
+        self.assertEqual([entry['step'] for entry in checkpoints._index], [2, 4, 5])
+        self.assertEqual(checkpoints.best()['step'], 2)
+        self.assertEqual(checkpoints.latest()['step'], 5)
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         sorted([INDEX_FILE, 'model-2.pkl', 'model-4.pkl', 'model-5.pkl']))
+        # The index is read back by a new manager
+        self.assertEqual(self.make_manager().best()['step'], 2)
+
+    def test_restore(self):
+        checkpoints = self.make_manager()
+        self.save(checkpoints, 1, reward=2.0)
+        self.save(checkpoints, 2, reward=1.0)
+        self.assertEqual(checkpoints.restore(checkpoints.best())['step'], 1)
+        self.assertTrue(np.array_equal(self.sess.run(self.variable), np.full(3, 1)))
+        self.assertEqual(checkpoints.restore()['step'], 2)
+        self.assertTrue(np.array_equal(self.sess.run(self.variable), np.full(3, 2)))
+
+    def test_atomic_write(self):
+        checkpoints = self.make_manager()
+        self.save(checkpoints, 1)
+
+        def fail():
+            raise IOError('The extra can not be serialized')
+        # A checkpoint that fails to be written leaves the previous ones and the index as they were
+        self.save(checkpoints, 2, extras={'buffer': fail})
+        self.assertEqual(checkpoints.latest()['step'], 1)
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted([INDEX_FILE, 'model-1.pkl']))
+        self.assertEqual(checkpoints.restore()['step'], 1)
+        self.assertTrue(np.array_equal(self.sess.run(self.variable), np.full(3, 1)))
+
+    def test_write_atomically(self):
+        path = os.path.join(self.directory, 'model-1.pkl')
+        _write_atomically(path, b'old')
+        # The write fails after the temporary file is opened, the file keeps the old content
+        with self.assertRaises(TypeError):
+            _write_atomically(path, 'not bytes')
+        with open(path, 'rb') as checkpoint_file:
+            self.assertEqual(checkpoint_file.read(), b'old')
+        _write_atomically(path, b'new')
+        with open(path, 'rb') as checkpoint_file:
+            self.assertEqual(checkpoint_file.read(), b'new')
+        self.assertEqual(os.listdir(self.directory), ['model-1.pkl'])
+
+    def test_extras(self):
+        checkpoints = self.make_manager(keep_last=1)
+        threads = []
+
+        def serialize():
+            threads.append(threading.current_thread())
+            return b'buffer'
+        self.save(checkpoints, 1, extras={'buffer': serialize, 'state': b'state'}, metadata={'episode': 3})
+        entry = checkpoints.latest()
+        self.assertEqual(entry['extras'], ['buffer', 'state'])
+        self.assertEqual(entry['metadata'], {'episode': 3})
+        # The callable is called on the writer thread
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+        with open(checkpoints.path_of(entry, 'buffer'), 'rb') as extra_file:
+            self.assertEqual(extra_file.read(), b'buffer')
+        with open(checkpoints.path_of(entry, 'state'), 'rb') as extra_file:
+            self.assertEqual(extra_file.read(), b'state')
+        # The extras are removed with their checkpoint
+        self.save(checkpoints, 2)
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted([INDEX_FILE, 'model-2.pkl']))
+
+
+if __name__ == '__main__':
+    unittest.main()
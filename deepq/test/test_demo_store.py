@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from deepq.demo_store import DemoStore, compute_demo_key, load_arrays, save_arrays
+
+
+class TestDemoStore(unittest.TestCase):
+
+    def setUp(self):
+        self.replay_dir = tempfile.mkdtemp()
+        self.store = DemoStore(tempfile.mkdtemp(), 'Shaper')
+        self.write_demo('demo0.json', b'{"state": 0}\n')
+
+    def write_demo(self, name, data, mtime_ns=None):
+        path = os.path.join(self.replay_dir, name)
+        with open(path, 'wb') as demo_file:
+            demo_file.write(data)
+        if mtime_ns is not None:
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def test_key_matches_contents_hash(self):
+        params = {'state_dim': 3}
+        self.assertEqual(self.store.key_for(self.replay_dir, params), compute_demo_key(self.replay_dir, params))
+        self.assertNotEqual(self.store.key_for(self.replay_dir, params),
+                            self.store.key_for(self.replay_dir, {'state_dim': 4}))
+
+    def test_contents_are_hashed_only_if_files_change(self):
+        self.write_demo('demo0.json', b'{"state": 0}\n', mtime_ns=10 ** 18)
+        key = self.store.key_for(self.replay_dir, {})
+        # The same name, size and modification time are taken for the same file
+        self.write_demo('demo0.json', b'{"state": 1}\n', mtime_ns=10 ** 18)
+        self.assertEqual(self.store.key_for(self.replay_dir, {}), key)
+
+        self.write_demo('demo0.json', b'{"state": 1}\n', mtime_ns=10 ** 18 + 1)
+        self.assertNotEqual(self.store.key_for(self.replay_dir, {}), key)
+        key = self.store.key_for(self.replay_dir, {})
+        self.write_demo('demo1.json', b'{"state": 2}\n')
+        self.assertNotEqual(self.store.key_for(self.replay_dir, {}), key)
+
+    def test_save_and_load(self):
+        arrays = {'states': np.arange(12, dtype=np.float32).reshape(4, 3), 'lengths': np.zeros(0, dtype=np.int64)}
+        path = os.path.join(self.store.store_dir, 'arrays.demos')
+        save_arrays(path, arrays)
+        loaded = load_arrays(path)
+        self.assertTrue(np.array_equal(loaded['states'], arrays['states']))
+        self.assertEqual(loaded['lengths'].shape, (0,))
+
+
+if __name__ == '__main__':
+    unittest.main()
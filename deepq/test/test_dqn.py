@@ -0,0 +1,43 @@
+import unittest
+
+import numpy as np
+import tensorflow as tf
+
+from deepq.dqn import make_copy_model_parameters_op
+from deepq.estimator import Estimator
+
+
+class TestCopyModelParameters(unittest.TestCase):
+
+    def setUp(self):
+        tf.reset_default_graph()
+        tf.Variable(0, name="global_step", trainable=False)
+        self.q_estimator = Estimator(18, 25, scope="q")
+        self.target_estimator = Estimator(18, 25, scope="target_q")
+        self.q_params = sorted(tf.trainable_variables("q/"), key=lambda v: v.name)
+        self.target_params = sorted(tf.trainable_variables("target_q/"), key=lambda v: v.name)
+
+    def run_update(self, tau):
+        update_op = make_copy_model_parameters_op(self.q_estimator, self.target_estimator, tau=tau)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            online, target_old = sess.run([self.q_params, self.target_params])
+            sess.run(update_op)
+            online_new, target_new = sess.run([self.q_params, self.target_params])
+        for before, after in zip(online, online_new):
+            self.assertTrue(np.array_equal(before, after))
+        return online, target_old, target_new
+
+    def test_soft_update(self):
+        online, target_old, target_new = self.run_update(tau=0.1)
+        for online_v, old_v, new_v in zip(online, target_old, target_new):
+            self.assertTrue(np.allclose(new_v, 0.1 * online_v + 0.9 * old_v, atol=1e-6))
+
+    def test_hard_update(self):
+        online, _, target_new = self.run_update(tau=1.0)
+        for online_v, new_v in zip(online, target_new):
+            self.assertTrue(np.array_equal(new_v, online_v))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+import numpy as np
+import tensorflow as tf
+
+from deepq.estimator import Estimator
+
+
+class TestDoubleDQNUpdate(unittest.TestCase):
+
+    def setUp(self):
+        tf.reset_default_graph()
+        tf.Variable(0, name="global_step", trainable=False)
+        rng = np.random.RandomState(0)
+        self.batch_size = 16
+        self.states = rng.uniform(-1, 1, size=(self.batch_size, 18)).astype(np.float32)
+        self.next_states = rng.uniform(-1, 1, size=(self.batch_size, 18)).astype(np.float32)
+        self.actions = rng.randint(25, size=self.batch_size)
+        self.rewards = rng.uniform(-1, 1, size=self.batch_size).astype(np.float32)
+        self.dones = rng.uniform(size=self.batch_size) < 0.25
+        self.weights = rng.uniform(0.5, 1, size=self.batch_size).astype(np.float32)
+
+    def sequential_update(self, sess, q_estimator, target_estimator, discount_factor):
+        # The update as it was done before build_double_dqn_update, with the targets computed in NumPy
+        not_dones = np.invert(self.dones).astype(np.float32)
+        best_actions = np.argmax(q_estimator.predict(sess, self.next_states), axis=1)
+        next_q_values_target = target_estimator.predict(sess, self.next_states)
+        targets = (
+            self.rewards +
+            discount_factor * not_dones * next_q_values_target[np.arange(self.batch_size), best_actions])
+        feed_dict = {q_estimator.X: self.states, q_estimator.Y: targets,
+                     q_estimator.action_ind: self.actions, q_estimator.weights: self.weights}
+        loss = sess.run(q_estimator.loss, feed_dict)
+        predictions = q_estimator.update(sess, self.states, self.actions, targets, self.weights)
+        return loss, predictions - targets
+
+    def fused_update(self, sess, q_estimator):
+        feed_dict = {q_estimator.X: self.states, q_estimator.action_ind: self.actions,
+                     q_estimator.rewards: self.rewards, q_estimator.next_X: self.next_states,
+                     q_estimator.dones: self.dones, q_estimator.weights: self.weights}
+        loss = sess.run(q_estimator.double_dqn_loss, feed_dict)
+        td_errors = q_estimator.double_dqn_update(
+            sess, self.states, self.actions, self.rewards, self.next_states, self.dones, self.weights)
+        return loss, td_errors
+
+    def test_fused_update_matches_sequential_update(self):
+        q_estimator = Estimator(18, 25, scope="q")
+        target_estimator = Estimator(18, 25, scope="target_q")
+        q_estimator.build_double_dqn_update(target_estimator, discount_factor=0.99)
+        variables = tf.global_variables()
+        q_variables = tf.trainable_variables("q/")
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            # Both updates start from the same weights and optimizer slots
+            initial_values = sess.run(variables)
+            expected_loss, expected_td_errors = self.sequential_update(sess, q_estimator, target_estimator, 0.99)
+            expected_weights = sess.run(q_variables)
+            for var, value in zip(variables, initial_values):
+                var.load(value, sess)
+            loss, td_errors = self.fused_update(sess, q_estimator)
+            updated_weights = sess.run(q_variables)
+        self.assertAlmostEqual(loss, expected_loss, places=5)
+        self.assertTrue(np.allclose(td_errors, expected_td_errors, atol=1e-5))
+        for updated, expected in zip(updated_weights, expected_weights):
+            self.assertTrue(np.allclose(updated, expected, atol=1e-5))
+
+
+if __name__ == '__main__':
+    unittest.main()
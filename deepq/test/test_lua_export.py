@@ -0,0 +1,118 @@
+import os
+import re
+import tempfile
+import unittest
+
+import numpy as np
+
+from deepq.lua_export import export_to_lua
+from deepq.numpy_network import NumpyNetwork
+from dotaenv.codes import STATE_DIM, STATE_PROJECT
+
+LUA_TOKEN = re.compile(r"\s*(?:(--[^\n]*)|([{}=,])|'([^']*)'|([-+0-9.eE]+|inf|nan)|(\w+))")
+LUA_ACTIVATIONS = {'linear': lambda x: x, 'relu': lambda x: max(x, 0.0), 'tanh': np.tanh}
+
+
+def parse_lua_module(content):
+    """ Parses the tables of a 'return {...}' module into dicts and lists. """
+    tokens = []
+    for comment, symbol, string, number, name in LUA_TOKEN.findall(content):
+        if comment:
+            continue
+        if symbol:
+            tokens.append(('symbol', symbol))
+        elif number:
+            tokens.append(('value', float(number)))
+        elif name:
+            tokens.append(('name', name))
+        else:
+            tokens.append(('value', string))
+    assert tokens[0] == ('name', 'return')
+    table, position = parse_table(tokens, 1)
+    assert position == len(tokens)
+    return table
+
+
+def parse_table(tokens, position):
+    assert tokens[position] == ('symbol', '{')
+    position += 1
+    items, fields = [], {}
+    while tokens[position] != ('symbol', '}'):
+        if tokens[position][0] == 'name' and tokens[position + 1] == ('symbol', '='):
+            key = tokens[position][1]
+            value, position = parse_value(tokens, position + 2)
+            fields[key] = value
+        else:
+            value, position = parse_value(tokens, position)
+            items.append(value)
+        if tokens[position] == ('symbol', ','):
+            position += 1
+    return (fields if fields else items), position + 1
+
+
+def parse_value(tokens, position):
+    if tokens[position] == ('symbol', '{'):
+        return parse_table(tokens, position)
+    return tokens[position][1], position + 1
+
+
+def apply_layers(layers, state):
+    # As apply_layers of bot/agent_utils/policy.lua, kernel[i][j] is the weight of input i for output j
+    output = list(state)
+    for layer in layers:
+        activation = LUA_ACTIVATIONS[layer['activation']]
+        output = [activation(layer['bias'][j] + sum(output[i] * layer['kernel'][i][j] for i in range(len(output))))
+                  for j in range(len(layer['bias']))]
+    return output
+
+
+class IdentitySession:
+    """Returns the arrays standing in for the variables as their values."""
+
+    def run(self, fetches):
+        return fetches
+
+
+class TestLuaExport(unittest.TestCase):
+
+    def make_network(self, dueling):
+        rng = np.random.RandomState(0)
+
+        def layer(inputs, outputs, activation):
+            return rng.uniform(-1, 1, size=(inputs, outputs)), rng.uniform(-1, 1, size=outputs), activation
+        torso = [layer(STATE_DIM, 6, 'tanh'), layer(6, 5, 'relu')]
+        head = [layer(5, 4, None)]
+        value_head = [layer(5, 1, None)] if dueling else None
+        network = NumpyNetwork(torso, head, value_head=value_head)
+        network.refresh(IdentitySession())
+        return network
+
+    def export(self, network):
+        path = os.path.join(tempfile.mkdtemp(), 'policy_weights.lua')
+        export_to_lua(network, path)
+        with open(path) as lua_file:
+            return parse_lua_module(lua_file.read())
+
+    def check_outputs(self, dueling):
+        network = self.make_network(dueling)
+        weights = self.export(network)
+        self.assertEqual(weights['state_project'], [index + 1 for index in STATE_PROJECT])
+        self.assertEqual(len(weights['value_head']), 1 if dueling else 0)
+        states = np.random.RandomState(1).uniform(-1, 1, size=(5, STATE_DIM))
+        for state, expected in zip(states, network.outputs(states)):
+            # As Policy.get_outputs of bot/agent_utils/policy.lua
+            hidden = apply_layers(weights['torso'], state)
+            outputs = np.array(apply_layers(weights['head'], hidden))
+            if weights['value_head']:
+                outputs = apply_layers(weights['value_head'], hidden)[0] + outputs - np.mean(outputs)
+            self.assertTrue(np.allclose(outputs, expected, atol=1e-5))
+
+    def test_dueling_network(self):
+        self.check_outputs(dueling=True)
+
+    def test_plain_network(self):
+        self.check_outputs(dueling=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+import numpy as np
+
+from deepq.dqn import NStepPusher
+
+
+class RecordingBuffer:
+
+    def __init__(self):
+        self.transitions = []
+
+    def push(self, state, action, next_state, done, reward):
+        self.transitions.append((state, action, next_state, done, reward))
+
+
+def reference_transitions(rewards, n, gamma, done):
+    transitions = []
+    for i in range(len(rewards)):
+        last = min(i + n, len(rewards)) - 1
+        if i + n > len(rewards) and not done:
+            # The window is not complete
+            continue
+        reward = sum(gamma ** (k - i) * rewards[k] for k in range(i, last + 1))
+        transitions.append((i, last + 1, done and last == len(rewards) - 1, reward))
+    return transitions
+
+
+class TestNStepPusher(unittest.TestCase):
+
+    def play(self, length, n_step, push_every, done):
+        rewards = np.random.RandomState(length).uniform(-1, 1, size=length)
+        replay_buffer = RecordingBuffer()
+        pusher = NStepPusher(replay_buffer, n_step, 0.9, push_every=push_every)
+        # The states are the numbers of the steps
+        for i in range(length):
+            pusher.push(i, 0, i + 1, done and i == length - 1, rewards[i])
+        pusher.end_episode()
+        expected = reference_transitions(rewards, n_step, 0.9, done)
+        self.assertEqual(len(replay_buffer.transitions), len(expected))
+        for (state, _, next_state, is_done, reward), expected_transition in zip(replay_buffer.transitions, expected):
+            self.assertEqual((state, next_state, is_done), expected_transition[:3])
+            self.assertAlmostEqual(reward, expected_transition[3])
+
+    def test_finished_episode(self):
+        self.play(length=100, n_step=4, push_every=7, done=True)
+        self.play(length=3, n_step=5, push_every=2, done=True)
+
+    def test_broken_off_episode(self):
+        self.play(length=100, n_step=4, push_every=7, done=False)
+
+    def test_one_step(self):
+        self.play(length=10, n_step=1, push_every=7, done=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
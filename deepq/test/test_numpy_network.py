@@ -0,0 +1,49 @@
+import unittest
+
+import numpy as np
+import tensorflow as tf
+
+from deepq.estimator import Estimator
+from policy_gradient.network import Network
+
+
+class TestNumpyNetwork(unittest.TestCase):
+
+    def setUp(self):
+        tf.reset_default_graph()
+        tf.Variable(0, name="global_step", trainable=False)
+        self.states = np.random.RandomState(0).uniform(-1, 1, size=(16, 18)).astype(np.float32)
+
+    def test_estimator_q_values(self):
+        estimator = Estimator(18, 25, scope="q")
+        numpy_network = estimator.to_numpy()
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            numpy_network.refresh(sess)
+            expected = estimator.predict(sess, self.states)
+        self.assertTrue(np.allclose(numpy_network.outputs(self.states), expected, atol=1e-5))
+
+    def test_refresh_every(self):
+        estimator = Estimator(18, 25, scope="q")
+        numpy_network = estimator.to_numpy(refresh_every=2)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            numpy_network.refresh(sess)
+            before = numpy_network.outputs(self.states)
+            estimator.update(sess, self.states, np.zeros(16, dtype=np.int32), np.ones(16), np.ones(16))
+            numpy_network.maybe_refresh(sess)
+            self.assertTrue(np.array_equal(numpy_network.outputs(self.states), before))
+            numpy_network.maybe_refresh(sess)
+            expected = estimator.predict(sess, self.states)
+        self.assertTrue(np.allclose(numpy_network.outputs(self.states), expected, atol=1e-5))
+
+    def test_policy_network_probabilities(self):
+        network = Network(input_shape=18, output_shape=25)
+        numpy_network = network.to_numpy()
+        numpy_network.refresh(network.session)
+        expected = network.session.run(network.predict_op, feed_dict={network.states: self.states})
+        self.assertTrue(np.allclose(numpy_network.softmax(self.states), expected, atol=1e-5))
+
+
+if __name__ == '__main__':
+    unittest.main()
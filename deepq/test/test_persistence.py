@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+
+import tensorflow as tf
+
+from deepq.checkpoint_manager import CheckpointManager
+from deepq.persistence import get_resume_state
+
+
+class TestResumeState(unittest.TestCase):
+
+    def setUp(self):
+        tf.reset_default_graph()
+        tf.Variable(0, name="global_step", trainable=False)
+        self.sess = tf.Session()
+        self.sess.run(tf.global_variables_initializer())
+        self.experiment_dir = tempfile.mkdtemp()
+        self.checkpoint_dir = os.path.join(self.experiment_dir, "checkpoints")
+        self.rewards_dir = os.path.join(self.experiment_dir, "rewards")
+        os.makedirs(self.rewards_dir)
+
+    def tearDown(self):
+        self.sess.close()
+
+    def write_rewards(self, episodes):
+        # As deep_q_learning writes the episode rewards
+        reward_writer = tf.summary.FileWriter(self.rewards_dir)
+        for i_episode in range(episodes):
+            summary = tf.Summary(value=[tf.Summary.Value(tag="reward", simple_value=1.0)])
+            reward_writer.add_summary(summary, i_episode)
+        reward_writer.close()
+
+    def test_saved_counters(self):
+        checkpoints = CheckpointManager(self.sess, self.checkpoint_dir)
+        checkpoints.save(1234, metadata={'episode': 7, 'total_t': 1234})
+        checkpoints.close()
+        # The counters are read back from the index by the manager of the resumed run
+        checkpoints = CheckpointManager(self.sess, self.checkpoint_dir)
+        resume_state = get_resume_state(checkpoints.latest(), self.rewards_dir)
+        checkpoints.close()
+        self.assertEqual(resume_state, {'episode': 7, 'total_t': 1234})
+
+    def test_legacy_fallback(self):
+        self.write_rewards(5)
+        # Every event file starts with the file version event, which the scan counts as well
+        expected = {'episode': 6}
+        self.assertEqual(get_resume_state(None, self.rewards_dir), expected)
+        legacy_entry = {'step': 10, 'reward': None, 'path': 'model-10.pkl', 'extras': [], 'metadata': {}}
+        self.assertEqual(get_resume_state(legacy_entry, self.rewards_dir), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+import numpy as np
+
+from deepq.returns import discounted_returns, n_step_targets, gae, shape_rewards
+
+
+def reference_n_step_targets(rewards, dones, bootstrap_values, gamma, n):
+    targets = []
+    for t in range(len(rewards)):
+        target, discount = 0.0, 1.0
+        for k in range(t, min(t + n, len(rewards))):
+            target += discount * rewards[k]
+            discount *= gamma
+            if dones[k] or k == min(t + n, len(rewards)) - 1:
+                if not dones[k]:
+                    target += discount * bootstrap_values[k]
+                break
+        targets.append(target)
+    return np.array(targets)
+
+
+class TestReturns(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.rewards = rng.uniform(-1, 1, size=50)
+        self.values = rng.uniform(-1, 1, size=51)
+        self.bootstrap_values = rng.uniform(-1, 1, size=50)
+        self.dones = rng.uniform(size=50) < 0.1
+
+    def test_discounted_returns(self):
+        returns = discounted_returns(np.array([0, 1, 1]), gamma=0.5)
+        self.assertTrue(np.allclose(returns, [0.75, 1.5, 1]))
+
+    def test_discounted_returns_with_dones(self):
+        returns = discounted_returns(np.array([1, 1, 1, 1]), gamma=0.5, dones=[False, True, False, False],
+                                     bootstrap=4)
+        self.assertTrue(np.allclose(returns, [1.5, 1, 2.5, 3]))
+
+    def test_batch_of_sequences(self):
+        rewards = np.stack([self.rewards, self.rewards[::-1]])
+        returns = discounted_returns(rewards, gamma=0.9)
+        self.assertTrue(np.allclose(returns[1], discounted_returns(self.rewards[::-1], gamma=0.9)))
+
+    def test_n_step_targets(self):
+        for n in (1, 3, 60):
+            targets = n_step_targets(self.rewards, self.dones, self.bootstrap_values, 0.9, n)
+            expected = reference_n_step_targets(self.rewards, self.dones, self.bootstrap_values, 0.9, n)
+            self.assertTrue(np.allclose(targets, expected))
+
+    def test_gae(self):
+        # With lambda = 1 the advantages are the discounted returns minus the values
+        advantages = gae(self.rewards, self.values, self.dones, 0.9, 1.0)
+        expected = discounted_returns(self.rewards, 0.9, dones=self.dones, bootstrap=self.values[-1]) - self.values[:-1]
+        self.assertTrue(np.allclose(advantages, expected))
+        # With lambda = 0 they are the one-step TD errors
+        advantages = gae(self.rewards, self.values, self.dones, 0.9, 0.0)
+        expected = self.rewards + 0.9 * self.values[1:] * ~self.dones - self.values[:-1]
+        self.assertTrue(np.allclose(advantages, expected))
+
+    def test_shape_rewards(self):
+        shaped = shape_rewards([1, 2], potentials=[10, 20], next_potentials=[20, 30], gamma=0.5)
+        self.assertTrue(np.allclose(shaped, [1, -3]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from deepq.reward_shaper import ActionAdviceRewardShaper
+from dotaenv.codes import STATE_DIM, ACTIONS_TOTAL
+
+
+def baseline_potentials(states, actions, state):
+    potentials = np.zeros(ACTIONS_TOTAL)
+    for demo_state, action in zip(states, actions):
+        similarity = ActionAdviceRewardShaper.get_states_similarity(state, demo_state)
+        potentials[action] = max(potentials[action], similarity)
+    return potentials * ActionAdviceRewardShaper.K
+
+
+class TestActionAdviceRewardShaper(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.states = rng.uniform(0, 1, size=(300, STATE_DIM)).astype(np.float32)
+        self.actions = rng.randint(ACTIONS_TOTAL, size=300)
+        # The queried states are spread around the demo states, so that some similarities fall below the cutoffs
+        self.queries = self.states[:20] + rng.normal(0, 1.0, size=(20, STATE_DIM)).astype(np.float32)
+
+    def make_shaper(self, kernel_cutoff=None):
+        shaper = ActionAdviceRewardShaper(tempfile.mkdtemp(), kernel_cutoff=kernel_cutoff,
+                                          store_dir=tempfile.mkdtemp())
+        shaper.set_demos(self.states, self.actions)
+        return shaper
+
+    def test_exact_potentials(self):
+        shaper = self.make_shaper()
+        self.assertEqual(shaper.error_bound, 0.0)
+        potentials = shaper.get_action_potentials_batch(self.queries)
+        for state, state_potentials in zip(self.queries, potentials):
+            expected = baseline_potentials(self.states, self.actions, state)
+            self.assertTrue(np.allclose(state_potentials, expected, atol=1e-5))
+
+    def test_cutoff_potentials_within_error_bound(self):
+        exact = self.make_shaper().get_action_potentials_batch(self.queries)
+        for kernel_cutoff in [0.01, 0.1, 0.5]:
+            shaper = self.make_shaper(kernel_cutoff)
+            approximate = shaper.get_action_potentials_batch(self.queries)
+            self.assertTrue(np.all(approximate <= exact + 1e-5))
+            self.assertTrue(np.all(exact - approximate <= shaper.error_bound + 1e-5))
+
+    def test_parallel_ingestion(self):
+        replay_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(1)
+        for demo in range(4):
+            with open(os.path.join(replay_dir, 'demo{}.json'.format(demo)), 'w') as demo_file:
+                for _ in range(50):
+                    state = {'hero_info': rng.uniform(0, 1, 11).tolist(), 'enemy_info': rng.uniform(0, 1, 6).tolist()}
+                    demo_file.write(json.dumps({'state': state, 'action': int(rng.randint(ACTIONS_TOTAL))}) + '\n')
+        shaper = ActionAdviceRewardShaper(replay_dir, store_dir=tempfile.mkdtemp())
+        sequential = list(shaper.iter_demos(processes=1))
+        parallel = list(shaper.iter_demos(processes=2))
+        self.assertEqual([path for path, _ in parallel], [path for path, _ in sequential])
+        for (_, (states, actions)), (_, (expected_states, expected_actions)) in zip(parallel, sequential):
+            self.assertTrue(np.array_equal(states, expected_states))
+            self.assertTrue(np.array_equal(actions, expected_actions))
+
+    def test_invalid_kernel_cutoff(self):
+        for kernel_cutoff in [0, 1, -0.5, 2]:
+            with self.assertRaises(ValueError):
+                ActionAdviceRewardShaper(tempfile.mkdtemp(), kernel_cutoff=kernel_cutoff)
+
+
+if __name__ == '__main__':
+    unittest.main()
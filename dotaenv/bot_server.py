@@ -1,3 +1,4 @@
+from collections import deque
 from enum import IntEnum
 from threading import Condition, Thread
 from flask import Flask
@@ -39,6 +40,65 @@ current_action = None  # Guarded by changed_condition
 is_reset = True  # Guarded by changed_condition
 
 
+# Set by register_policy to serve the actions on the request thread
+inline_policy = None
+# (pairs, action) for every observation served inline, appended by the request thread.
+# deque's append and popleft are atomic, so the learner consumes it without a lock.
+served_transitions = deque(maxlen=100000)
+# Number of the served transitions pushed out of the full queue before they were taken
+dropped_transitions = 0
+
+
+def register_policy(policy):
+    """
+    Serves the actions inline: the policy is called on the request thread with the observation of
+    the last pair of every message, and the pairs are queued with the served action for the learner.
+    The requests are not handed over to step while a policy is registered.
+
+    :param policy: function taking an observation and returning an action, None to stop serving inline
+    """
+    global inline_policy
+    inline_policy = policy
+
+
+def pop_served_transitions():
+    """
+    Takes all the transitions served inline so far.
+
+    :return: list of tuples (pairs, action), where pairs are the message_to_pairs of an observation
+    message and action is the action served in response to it
+    """
+    transitions = []
+    while True:
+        try:
+            transitions.append(served_transitions.popleft())
+        except IndexError:
+            return transitions
+
+
+def serve_inline(policy, messages):
+    """
+    Responds to the observation message with the action of the policy and queues the transition.
+
+    :param policy: function taking an observation and returning an action
+    :param messages: content of the observation request
+    :return: response with the action
+    """
+    global dropped_transitions
+    pairs = message_to_pairs(messages)
+    if not pairs:
+        logger.warning('Received an observation request without observations.')
+        abort(400)
+    action = action_to_json(policy(pairs[-1][1][0]))
+    if len(served_transitions) == served_transitions.maxlen:
+        dropped_transitions += 1
+        if dropped_transitions % 1000 == 1:
+            logger.warning('Dropped {count} served transitions, they are not taken fast enough.'.format(
+                count=dropped_transitions))
+    served_transitions.append((pairs, action))
+    return jsonify({'fsm_state': FsmState.ACTION_RECEIVED, 'action': action})
+
+
 def reset():
     """
     Returns the server to the initial state and notifies all waiting for an action threads.
@@ -100,6 +160,10 @@ def step(action):
 def process_observation():
     global observation, current_action, is_reset
 
+    policy = inline_policy
+    if policy is not None:
+        return serve_inline(policy, request.get_json()['content'])
+
     changed_condition.acquire()
     is_reset = False
     while observation is not None:
@@ -1,3 +1,5 @@
+import time
+
 import gym
 from gym import spaces
 import logging.config
@@ -34,6 +36,37 @@ class DotaEnvironment(gym.Env):
         # Check the validity of the result
         return observation if len(observation) != 0 else self.reset()
 
+    def play_inline(self, policy, timeout=30, poll_interval=0.1):
+        """
+        Plays an episode with the actions served by the policy on the bot server's request thread.
+
+        :param policy: function taking an observation and returning an action
+        :param timeout: seconds without a served observation after which the episode is abandoned
+        :param poll_interval: seconds between the checks of the served transitions
+        :return: list of the rewards of the episode
+        """
+        server.reset()
+        server.pop_served_transitions()
+        server.register_policy(policy)
+        try:
+            runner.restart_game()
+            rewards = []
+            last_served = time.time()
+            while time.time() - last_served < timeout:
+                transitions = server.pop_served_transitions()
+                if transitions:
+                    last_served = time.time()
+                for pairs, _ in transitions:
+                    for _, (_, reward, done, _) in pairs:
+                        rewards.append(reward)
+                        if done:
+                            return rewards
+                time.sleep(poll_interval)
+            logging.warning('No observation was served for {timeout} seconds.'.format(timeout=timeout))
+            return rewards
+        finally:
+            server.register_policy(None)
+
     def render(self, mode='human'):
         # It is rendered in the Dota 2 client
         return
@@ -0,0 +1,71 @@
+import unittest
+
+import numpy as np
+
+from dotaenv import bot_server
+from dotaenv.codes import STATE_DIM
+
+
+def observation_message(reward=0.0, done=False):
+    return {
+        'observation': {
+            'action_info': 0.0,
+            'hero_info': [0.5] * 11,
+            'enemy_info': [0.5] * (STATE_DIM - 12),
+        },
+        'reward': reward,
+        'done': done,
+    }
+
+
+class TestInlineServing(unittest.TestCase):
+
+    def setUp(self):
+        self.client = bot_server.app.test_client()
+        self.observations = []
+        bot_server.pop_served_transitions()
+        bot_server.register_policy(self.policy)
+
+    def tearDown(self):
+        bot_server.register_policy(None)
+        bot_server.pop_served_transitions()
+
+    def policy(self, observation):
+        self.observations.append(observation)
+        return 3
+
+    def post(self, messages):
+        return self.client.post('/observation', json={'content': messages})
+
+    def test_serves_action(self):
+        response = self.post([[1, observation_message()], [2, observation_message(reward=1.0)]])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['action'], 3)
+        self.assertEqual(response.get_json()['fsm_state'], bot_server.FsmState.ACTION_RECEIVED)
+        self.assertEqual(len(self.observations), 1)
+
+        transitions = bot_server.pop_served_transitions()
+        self.assertEqual(len(transitions), 1)
+        pairs, action = transitions[0]
+        self.assertEqual(action, 3)
+        self.assertEqual([pair[0] for pair in pairs], [1, 2])
+        self.assertEqual(pairs[-1][1][1], 1.0)
+        self.assertTrue(np.array_equal(pairs[-1][1][0], self.observations[0]))
+        self.assertEqual(bot_server.pop_served_transitions(), [])
+
+    def test_rejects_empty_message(self):
+        response = self.post([])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.observations, [])
+        self.assertEqual(bot_server.pop_served_transitions(), [])
+
+    def test_counts_dropped_transitions(self):
+        dropped = bot_server.dropped_transitions
+        for _ in range(bot_server.served_transitions.maxlen + 2):
+            bot_server.served_transitions.append(([], 0))
+        self.post([[0, observation_message()]])
+        self.assertEqual(bot_server.dropped_transitions, dropped + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
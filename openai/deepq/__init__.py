@@ -1,7 +1,8 @@
 from openai.deepq import models  # noqa
-from openai.deepq.build_graph import build_act, build_train  # noqa
+from openai.deepq.build_graph import build_act, build_train, build_multi_train  # noqa
 from openai.deepq.deepq import learn, load_act  # noqa
 from openai.deepq.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer  # noqa
+from openai.deepq.prefetcher import BatchPrefetcher  # noqa
 
 def wrap_atari_dqn(env):
     from baselines.common.atari_wrappers import wrap_deepmind
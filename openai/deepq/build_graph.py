@@ -96,6 +96,8 @@ The functions in this file can are used to create the following functions:
 import tensorflow as tf
 import baselines.common.tf_util as U
 
+from deepq.session_callable import SessionCallable
+
 
 def scope_vars(scope, trainable_only=False):
     """
@@ -143,6 +145,21 @@ def default_param_noise_filter(var):
     return False
 
 
+def _function(inputs, outputs, updates):
+    """Like U.function for plain placeholders, but the step is compiled once per session by
+    SessionCallable, which also reshapes the values to the placeholders' shapes.
+    """
+    update_op = tf.group(*updates)
+    callables = {}
+
+    def call(*args):
+        sess = U.get_session()
+        if sess not in callables:
+            callables[sess] = SessionCallable(sess, inputs, [outputs], targets=[update_op])
+        return callables[sess](*args)[0]
+    return call
+
+
 def build_act(make_obs_ph, q_func, num_actions, scope="deepq", reuse=None):
     """Creates the act function:
 
@@ -192,9 +209,8 @@ def build_act(make_obs_ph, q_func, num_actions, scope="deepq", reuse=None):
 
         output_actions = tf.cond(stochastic_ph, lambda: stochastic_actions, lambda: deterministic_actions)
         update_eps_expr = eps.assign(tf.cond(update_eps_ph >= 0, lambda: update_eps_ph, lambda: eps))
-        _act = U.function(inputs=[observations_ph, biases_ph, stochastic_ph, update_eps_ph],
+        _act = _function(inputs=[observations_ph.placeholder, biases_ph, stochastic_ph, update_eps_ph],
                          outputs=output_actions,
-                         givens={update_eps_ph: -1.0, stochastic_ph: True},
                          updates=[update_eps_expr])
         def act(ob, biases_ph, stochastic=True, update_eps=-1):
             return _act(ob, biases_ph, stochastic, update_eps)
@@ -318,6 +334,53 @@ def build_act_with_param_noise(make_obs_ph, q_func, num_actions, scope="deepq",
         return act
 
 
+def _build_td_error(obs_t, biases_t, act_t, rew_t, obs_tp1, biases_tp1, done_mask,
+                    q_func, num_actions, gamma, double_q, target_reuse):
+    """Builds the Q values and the error in Bellman's equation with action-advice biases for a batch of transitions."""
+    # q network evaluation
+    q_t = q_func(obs_t, num_actions, scope="q_func", reuse=True)  # reuse parameters from act
+
+    # q scores for actions which we know were selected in the given state.
+    q_t_selected = tf.reduce_sum(q_t * tf.one_hot(act_t, num_actions), 1)
+    # action-advice potentials of the taken actions
+    f_t_selected = tf.reduce_sum(biases_t * tf.one_hot(act_t, num_actions), 1)
+
+    # target q network evaluation
+    q_tp1 = q_func(obs_tp1, num_actions, scope="target_q_func", reuse=target_reuse)
+
+    # compute estimate of best possible value starting from state at t + 1
+    # note the use of the biased-greedy policy in the action selection
+    if double_q:
+        q_tp1_using_online_net = q_func(obs_tp1, num_actions, scope="q_func", reuse=True)
+        q_tp1_using_online_net = q_tp1_using_online_net + biases_tp1
+        q_tp1_best_act = tf.argmax(q_tp1_using_online_net, 1)
+    else:
+        q_tp1_best_act = tf.argmax(q_tp1 + biases_tp1, 1)
+    q_tp1_best = tf.reduce_sum(q_tp1 * tf.one_hot(q_tp1_best_act, num_actions), 1)
+    q_tp1_best_masked = (1.0 - done_mask) * q_tp1_best
+    f_tp1_best = tf.reduce_sum(biases_tp1 * tf.one_hot(q_tp1_best_act, num_actions), 1)
+
+    # compute RHS of bellman equation
+    q_t_selected_target = (
+        rew_t
+        + gamma * q_tp1_best_masked
+        + gamma * f_tp1_best
+        - f_t_selected)
+
+    return q_t, q_t_selected - tf.stop_gradient(q_t_selected_target)
+
+
+def _build_optimize_expr(optimizer, weighted_error, var_list, grad_norm_clipping):
+    if grad_norm_clipping is not None:
+        gradients = optimizer.compute_gradients(weighted_error, var_list=var_list)
+        for i, (grad, var) in enumerate(gradients):
+            if grad is not None:
+                gradients[i] = (tf.clip_by_norm(grad, grad_norm_clipping), var)
+        return optimizer.apply_gradients(gradients)
+    else:
+        return optimizer.minimize(weighted_error, var_list=var_list)
+
+
 def build_train(make_obs_ph, q_func, num_actions, optimizer, grad_norm_clipping=None, gamma=1.0,
     double_q=True, scope="deepq", reuse=None, param_noise=False, param_noise_filter_func=None):
     """Creates the train function:
@@ -390,52 +453,18 @@ def build_train(make_obs_ph, q_func, num_actions, optimizer, grad_norm_clipping=
         done_mask_ph = tf.placeholder(tf.float32, [None], name="done")
         importance_weights_ph = tf.placeholder(tf.float32, [None], name="weight")
 
-        # q network evaluation
-        q_t = q_func(obs_t_input.get(), num_actions, scope="q_func", reuse=True)  # reuse parameters from act
+        q_t, td_error = _build_td_error(
+            obs_t_input.get(), biases_t, act_t_ph, rew_t_ph, obs_tp1_input.get(), biases_tp1, done_mask_ph,
+            q_func, num_actions, gamma, double_q, target_reuse=None)
         q_func_vars = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope=tf.get_variable_scope().name + "/q_func")
-
-        # q scores for actions which we know were selected in the given state.
-        q_t_selected = tf.reduce_sum(q_t * tf.one_hot(act_t_ph, num_actions), 1)
-        # action-advice potentials of the taken actions
-        f_t_selected = tf.reduce_sum(biases_t * tf.one_hot(act_t_ph, num_actions), 1)
-
-        # target q network evaluation
-        q_tp1 = q_func(obs_tp1_input.get(), num_actions, scope="target_q_func")
         target_q_func_vars = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope=tf.get_variable_scope().name + "/target_q_func")
 
-        # compute estimate of best possible value starting from state at t + 1
-        # note the use of the biased-greedy policy in the action selection
-        if double_q:
-            q_tp1_using_online_net = q_func(obs_tp1_input.get(), num_actions, scope="q_func", reuse=True)
-            q_tp1_using_online_net = q_tp1_using_online_net + biases_tp1
-            q_tp1_best_act = tf.argmax(q_tp1_using_online_net, 1)
-        else:
-            q_tp1_best_act = tf.argmax(q_tp1 + biases_tp1, 1)
-        q_tp1_best = tf.reduce_sum(q_tp1 * tf.one_hot(q_tp1_best_act, num_actions), 1)
-        q_tp1_best_masked = (1.0 - done_mask_ph) * q_tp1_best
-        f_tp1_best = tf.reduce_sum(biases_tp1 * tf.one_hot(q_tp1_best_act, num_actions), 1)
-
-        # compute RHS of bellman equation
-        q_t_selected_target = (
-            rew_t_ph
-            + gamma * q_tp1_best_masked
-            + gamma * f_tp1_best
-            - f_t_selected)
-
         # compute the error (potentially clipped)
-        td_error = q_t_selected - tf.stop_gradient(q_t_selected_target)
         errors = U.huber_loss(td_error)
         weighted_error = tf.reduce_mean(importance_weights_ph * errors)
 
         # compute optimization op (potentially with gradient clipping)
-        if grad_norm_clipping is not None:
-            gradients = optimizer.compute_gradients(weighted_error, var_list=q_func_vars)
-            for i, (grad, var) in enumerate(gradients):
-                if grad is not None:
-                    gradients[i] = (tf.clip_by_norm(grad, grad_norm_clipping), var)
-            optimize_expr = optimizer.apply_gradients(gradients)
-        else:
-            optimize_expr = optimizer.minimize(weighted_error, var_list=q_func_vars)
+        optimize_expr = _build_optimize_expr(optimizer, weighted_error, q_func_vars, grad_norm_clipping)
 
         # update_target_fn will be called periodically to copy Q network to target Q network
         update_target_expr = []
@@ -467,3 +496,82 @@ def build_train(make_obs_ph, q_func, num_actions, optimizer, grad_norm_clipping=
         q_values = U.function([obs_t_input], q_t)
 
         return act_f, train, update_target, {'q_values': q_values}
+
+
+def build_multi_train(make_obs_ph, q_func, num_actions, optimizer, num_updates, grad_norm_clipping=None,
+    gamma=1.0, double_q=True, scope="deepq"):
+    """Creates the function running several consecutive train steps in one session call.
+
+    Must be called after build_train with the same scope and optimizer, so the
+    networks and the optimizer slots are shared with it. Every step reads the
+    parameters written by the previous one, which requires the graph to be built
+    with resource variables (see tf.variable_scope's use_resource), ValueError is
+    raised otherwise.
+
+    Parameters
+    ----------
+    num_updates: int
+        number of the train steps per call.
+    The rest are the same as in build_train.
+
+    Returns
+    -------
+    multi_train: (object, np.array, np.array, object, np.array, np.array) -> np.array
+        takes the same arguments as train with num_updates batches concatenated
+        into every one of them and optimizes the error of every batch in turn.
+        Returns the td errors of all of the batches concatenated and the weighted
+        error of every batch.
+    """
+    with tf.variable_scope(scope, reuse=True):
+        # set up placeholders
+        obs_t_input = make_obs_ph("multi_obs_t")
+        biases_t = tf.placeholder(tf.float32, (None, num_actions), name="multi_biases_t")
+        act_t_ph = tf.placeholder(tf.int32, [None], name="multi_action")
+        rew_t_ph = tf.placeholder(tf.float32, [None], name="multi_reward")
+        obs_tp1_input = make_obs_ph("multi_obs_tp1")
+        biases_tp1 = tf.placeholder(tf.float32, (None, num_actions), name="multi_biases_tp1")
+        done_mask_ph = tf.placeholder(tf.float32, [None], name="multi_done")
+        importance_weights_ph = tf.placeholder(tf.float32, [None], name="multi_weight")
+
+        inputs = [obs_t_input.get(), biases_t, act_t_ph, rew_t_ph, obs_tp1_input.get(), biases_tp1,
+                  done_mask_ph, importance_weights_ph]
+        batches = zip(*[tf.split(tensor, num_updates) for tensor in inputs])
+        q_func_vars = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope=tf.get_variable_scope().name + "/q_func")
+        # a step could read a ref variable before the previous step has written it
+        ref_vars = [var.name for var in q_func_vars if var.op.type != "VarHandleOp"]
+        if ref_vars:
+            raise ValueError("build_multi_train requires resource variables, build the graph under "
+                             "tf.variable_scope(..., use_resource=True). Ref variables: {}".format(ref_vars))
+
+        td_errors = []
+        weighted_errors = []
+        optimize_expr = tf.no_op()
+        for obs_t, b_t, act_t, rew_t, obs_tp1, b_tp1, done_mask, importance_weights in batches:
+            # the step evaluates the networks only after the previous one has updated them
+            with tf.control_dependencies([optimize_expr]):
+                _, td_error = _build_td_error(
+                    obs_t, b_t, act_t, rew_t, obs_tp1, b_tp1, done_mask,
+                    q_func, num_actions, gamma, double_q, target_reuse=True)
+                weighted_error = tf.reduce_mean(importance_weights * U.huber_loss(td_error))
+                optimize_expr = _build_optimize_expr(optimizer, weighted_error, q_func_vars, grad_norm_clipping)
+            td_errors.append(td_error)
+            weighted_errors.append(weighted_error)
+
+        multi_train = U.function(
+            inputs=[
+                obs_t_input,
+                biases_t,
+                act_t_ph,
+                rew_t_ph,
+                obs_tp1_input,
+                biases_tp1,
+                done_mask_ph,
+                importance_weights_ph,
+            ],
+            outputs=[
+                tf.concat(td_errors, 0),
+                tf.stack(weighted_errors),
+            ],
+            updates=[optimize_expr]
+        )
+        return multi_train
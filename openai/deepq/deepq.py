@@ -1,4 +1,6 @@
+import functools
 import os
+import random
 import time
 import tempfile
 from datetime import date
@@ -16,12 +18,14 @@ from baselines.common import set_global_seeds
 
 from openai import deepq
 from openai.deepq.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
+from openai.deepq.prefetcher import BatchPrefetcher
 from openai.deepq.utils import ObservationInput
 
 from baselines.common.tf_util import get_session
-from openai.deepq.models import build_q_func
+from openai.deepq.models import build_q_func, build_numpy_q_func
 
-from deepq import StatePreprocessor, ActionAdviceRewardShaper
+from deepq import StatePreprocessor, ActionAdviceRewardShaper, ShaperWorkerPool, CheckpointManager, Telemetry
+from deepq import PhaseTimers
 
 
 class ActWrapper(object):
@@ -99,7 +103,7 @@ def load_act(path):
 def learn(env,
           network,
           seed=None,
-          pool=None,
+          shaper_processes=None,
           lr=5e-4,
           total_timesteps=100000,
           buffer_size=50000,
@@ -118,7 +122,16 @@ def learn(env,
           prioritized_replay_beta0=0.4,
           prioritized_replay_beta_iters=None,
           prioritized_replay_eps=1e-6,
+          store_biases=True,
+          updates_per_call=1,
+          prefetch_batches=0,
+          numpy_act_refresh_every=None,
+          keep_checkpoints=5,
+          verbose_every=100,
+          telemetry_flush_every=1000,
+          profile_phases=False,
           param_noise=False,
+          action_advice_cutoff=None,
           callback=None,
           experiment_name='unnamed',
           load_path=None,
@@ -136,6 +149,9 @@ def learn(env,
         will be mapped to the Q function heads (see build_q_func in baselines.deepq.models for details on that)
     seed: int or None
         prng seed. The runs with the same seed "should" give the same results. If None, no seeding is used.
+    shaper_processes: int or None
+        number of the worker processes that compute the action-advice biases of sampled batches
+        when store_biases is False. If None, the number of CPUs is used.
     lr: float
         learning rate for adam optimizer
     total_timesteps: int
@@ -175,8 +191,34 @@ def learn(env,
         to 1.0. If set to None equals to total_timesteps.
     prioritized_replay_eps: float
         epsilon to add to the TD errors when updating priorities.
+    store_biases: bool
+        if True the action-advice biases are stored in the replay buffer when a transition is added.
+        Otherwise they are recomputed by a ShaperWorkerPool for every sampled batch.
+    updates_per_call: int
+        number of the train steps run in one session call when the learner catches up after an episode.
+        The batches of the steps are sampled beforehand, so the priorities they see lag behind by up to
+        updates_per_call - 1 steps.
+    prefetch_batches: int
+        number of the batches sampled in advance on a background thread while the model trains.
+        If 0 the batches are sampled right before their train steps.
+    numpy_act_refresh_every: int or None
+        if set, the actions are selected by a NumPy snapshot of the q function refreshed every
+        numpy_act_refresh_every train steps instead of a session call. Requires an mlp network
+        and no param_noise.
     param_noise: bool
         whether or not to use parameter space noise (https://arxiv.org/abs/1706.01905)
+    action_advice_cutoff: float or None
+        if set, action-advice potentials are approximated with a ball tree over the demos
+        that ignores demo states less similar than the cutoff. If None, they are exact.
+    keep_checkpoints: int
+        number of the latest checkpoints kept besides the best one.
+    verbose_every: int
+        number of the steps between the logged observations and actions, 0 to log none.
+    telemetry_flush_every: int
+        number of the train steps between the summaries of the aggregated training errors.
+    profile_phases: bool
+        whether the phases of the steps are timed. The report is logged at the end of the training
+        and SIGUSR1 logs it and toggles a cProfile dumped into the experiment directory.
     callback: (locals, globals) -> None
         function called at every steps with state of the algorithm.
         If callback returns true training stops.
@@ -193,6 +235,13 @@ def learn(env,
         Wrapper over act function. Adds ability to save it and load it.
         See header of baselines/deepq/categorical.py for details on the act function.
     """
+    # Load the demos and start the workers before the session so that they are not forked from it
+    reward_shaper = ActionAdviceRewardShaper('../completed-observations', kernel_cutoff=action_advice_cutoff)
+    reward_shaper.load()
+    shaper_pool = None
+    if not store_biases:
+        shaper_pool = ShaperWorkerPool(reward_shaper, processes=shaper_processes)
+
     # Create all the functions necessary to train the model
 
     sess = get_session()
@@ -207,15 +256,29 @@ def learn(env,
     def make_obs_ph(name):
         return ObservationInput(observation_space, name=name)
 
-    act, train, update_target, debug = deepq.build_train(
-        make_obs_ph=make_obs_ph,
-        q_func=q_func,
-        num_actions=env.action_space.n,
-        optimizer=tf.train.AdamOptimizer(learning_rate=lr),
-        gamma=gamma,
-        grad_norm_clipping=10,
-        param_noise=param_noise
-    )
+    optimizer = tf.train.AdamOptimizer(learning_rate=lr)
+    # The chained steps of multi_train have to read the variables updated by the previous step
+    with tf.variable_scope(tf.get_variable_scope(), use_resource=updates_per_call > 1):
+        act, train, update_target, debug = deepq.build_train(
+            make_obs_ph=make_obs_ph,
+            q_func=q_func,
+            num_actions=env.action_space.n,
+            optimizer=optimizer,
+            gamma=gamma,
+            grad_norm_clipping=10,
+            param_noise=param_noise
+        )
+        multi_train = None
+        if updates_per_call > 1:
+            multi_train = deepq.build_multi_train(
+                make_obs_ph=make_obs_ph,
+                q_func=q_func,
+                num_actions=env.action_space.n,
+                optimizer=optimizer,
+                num_updates=updates_per_call,
+                gamma=gamma,
+                grad_norm_clipping=10
+            )
 
     act_params = {
         'make_obs_ph': make_obs_ph,
@@ -225,29 +288,90 @@ def learn(env,
 
     act = ActWrapper(act, act_params)
 
+    numpy_q_func = None
+    if numpy_act_refresh_every is not None:
+        assert not param_noise, "The NumPy q function does not support param_noise"
+        if network != 'mlp':
+            raise ValueError("The NumPy q function supports only the mlp network, got {}".format(network))
+        # The snapshot has to apply the same activation as the mlp, it raises ValueError for the ones it lacks
+        numpy_q_func = build_numpy_q_func("deepq/q_func",
+                                          network_activation=network_kwargs.get('activation', tf.tanh),
+                                          refresh_every=numpy_act_refresh_every)
+
     # Create the replay buffer
     if prioritized_replay:
-        replay_buffer = PrioritizedReplayBuffer(buffer_size, alpha=prioritized_replay_alpha)
+        replay_buffer = PrioritizedReplayBuffer(buffer_size, alpha=prioritized_replay_alpha,
+                                                store_biases=store_biases)
         if prioritized_replay_beta_iters is None:
             prioritized_replay_beta_iters = total_timesteps
         beta_schedule = LinearSchedule(prioritized_replay_beta_iters,
                                        initial_p=prioritized_replay_beta0,
                                        final_p=1.0)
     else:
-        replay_buffer = ReplayBuffer(buffer_size)
+        replay_buffer = ReplayBuffer(buffer_size, store_biases=store_biases)
         beta_schedule = None
     # Create the schedule for exploration starting from 1.
     exploration = LinearSchedule(schedule_timesteps=int(exploration_fraction * total_timesteps),
                                  initial_p=exploration_initial_eps,
                                  final_p=exploration_final_eps)
 
+    def sample_batch(step_t, out=None):
+        # Sample a batch of transitions with their biases and importance weights from the replay buffer,
+        # writing it over the arrays of the used batch out if it is given
+        encoded_out = None
+        if out is not None:
+            (obses_t, biases_t, actions, rewards, obses_tp1, biases_tp1, dones, _) = out
+            encoded_out = (obses_t, actions, rewards, obses_tp1, dones)
+            if store_biases:
+                encoded_out += (biases_t, biases_tp1)
+        if prioritized_replay:
+            experience = replay_buffer.sample(batch_size, beta=beta_schedule.value(step_t), out=encoded_out)
+            (*experience, weights, batch_idxes) = experience
+        else:
+            experience = replay_buffer.sample(batch_size, out=encoded_out)
+            weights, batch_idxes = None, None
+        if store_biases:
+            (obses_t, actions, rewards, obses_tp1, dones, biases_t, biases_tp1) = experience
+        else:
+            (obses_t, actions, rewards, obses_tp1, dones) = experience
+            biases = shaper_pool.get_action_potentials_batch(np.concatenate([obses_t, obses_tp1]))
+            biases_t, biases_tp1 = np.split(biases, 2)
+        if weights is None:
+            weights = np.ones_like(rewards)
+        return (obses_t, biases_t, actions, rewards, obses_tp1, biases_tp1, dones, weights), batch_idxes
+
+    def train_on_batches(steps):
+        # Minimize the error in Bellman's equation on batches sampled from replay buffer,
+        # all in one call if there are enough of them
+        if not steps:
+            return
+        with timers.phase('sampling'):
+            if prefetcher is not None:
+                batches = [prefetcher.get() for _ in steps]
+            else:
+                batches = [sample_batch(step_t) for step_t in steps]
+        with timers.phase('update'):
+            if multi_train is not None and len(steps) == updates_per_call:
+                stacked = [np.concatenate(arrays) for arrays in zip(*[batch for batch, _ in batches])]
+                td_errors, weighted_errors = multi_train(*stacked)
+                td_errors = np.split(td_errors, len(steps))
+            else:
+                td_errors, weighted_errors = zip(*[train(*batch) for batch, _ in batches])
+        if numpy_q_func is not None:
+            with timers.phase('target_sync'):
+                numpy_q_func.maybe_refresh(sess, updates=len(steps))
+        for (_, batch_idxes), step_td_errors, weighted_error in zip(batches, td_errors, weighted_errors):
+            # Loss logging
+            telemetry.record('weighted_error', weighted_error)
+
+            if prioritized_replay:
+                new_priorities = np.abs(step_td_errors) + prioritized_replay_eps
+                update_priorities(batch_idxes, new_priorities)
+
     # Initialize the parameters and copy them to the target network.
     U.initialize()
     update_target()
 
-    reward_shaper = ActionAdviceRewardShaper('../completed-observations')
-    reward_shaper.load()
-
     full_exp_name = '{}-{}'.format(date.today().isoformat(), experiment_name)
     experiment_dir = os.path.join('experiments', full_exp_name)
     if not os.path.exists(experiment_dir):
@@ -256,141 +380,176 @@ def learn(env,
     summary_dir = os.path.join(experiment_dir, 'summaries')
     os.makedirs(summary_dir, exist_ok=True)
     summary_writer = tf.summary.FileWriter(summary_dir)
+    # The training errors are aggregated and written in batches
+    telemetry = Telemetry(summary_writer, flush_every=telemetry_flush_every, verbose_every=verbose_every)
+    timers = PhaseTimers(enabled=profile_phases)
+    if profile_phases:
+        timers.install_signal_handler(os.path.join(experiment_dir, 'profile.prof'))
 
     checkpoint_dir = os.path.join(experiment_dir, 'checkpoints')
     os.makedirs(checkpoint_dir, exist_ok=True)
 
-    with tempfile.TemporaryDirectory() as td:
-        td = checkpoint_dir or td
-
-        os.makedirs(td, exist_ok=True)
-        model_file = os.path.join(td, "best_model")
-        model_saved = False
-        saved_mean_reward = None
-
-        if os.path.exists(model_file):
-            print('Model is loading')
-            load_variables(model_file)
-            logger.log('Loaded model from {}'.format(model_file))
-            model_saved = True
-        elif load_path is not None:
-            load_variables(load_path)
-            logger.log('Loaded model from {}'.format(load_path))
-
-        episode_rewards = []
-        update_step_t = 0
-        while update_step_t < total_timesteps:
-            # Reset the environment
+    checkpoints = CheckpointManager(sess, checkpoint_dir, keep_last=keep_checkpoints)
+    saved_mean_reward = None
+
+    best_checkpoint = checkpoints.best()
+    if best_checkpoint is not None:
+        print('Model is loading')
+        checkpoints.restore(best_checkpoint)
+        logger.log('Loaded model from {}'.format(checkpoints.path_of(best_checkpoint)))
+        saved_mean_reward = best_checkpoint['reward']
+    elif load_path is not None:
+        load_variables(load_path)
+        logger.log('Loaded model from {}'.format(load_path))
+
+    if numpy_q_func is not None:
+        numpy_q_func.refresh(sess)
+
+    episode_rewards = []
+    update_step_t = 0
+
+    prefetcher = None
+    if prefetch_batches > 0:
+        # The batches are prepared for the current step, so beta lags behind by at most prefetch_batches steps
+        prefetcher = BatchPrefetcher(
+            replay_buffer,
+            lambda out: sample_batch(update_step_t, out),
+            depth=prefetch_batches,
+            max_held=updates_per_call)
+        add_transition = prefetcher.add
+        update_priorities = prefetcher.update_priorities
+    else:
+        add_transition = replay_buffer.add
+        update_priorities = replay_buffer.update_priorities if prioritized_replay else None
+
+    while update_step_t < total_timesteps:
+        # Reset the environment
+        with timers.phase('env'):
             obs = env.reset()
-            obs = StatePreprocessor.process(obs)
-            episode_rewards.append(0.0)
-            reset = True
-            done = False
-            # Sample the episode until it is completed
-            act_step_t = update_step_t
-            while not done:
-                if callback is not None:
-                    if callback(locals(), globals()):
-                        break
-                # Take action and update exploration to the newest value
-                kwargs = {}
-                if not param_noise:
-                    update_eps = exploration.value(act_step_t)
-                    update_param_noise_threshold = 0.
+        obs = StatePreprocessor.process(obs)
+        with timers.phase('shaping'):
+            biases = reward_shaper.get_action_potentials(obs)
+        episode_rewards.append(0.0)
+        reset = True
+        done = False
+        # Sample the episode until it is completed
+        act_step_t = update_step_t
+        while not done:
+            if callback is not None:
+                if callback(locals(), globals()):
+                    break
+            # Take action and update exploration to the newest value
+            kwargs = {}
+            if not param_noise:
+                update_eps = exploration.value(act_step_t)
+                update_param_noise_threshold = 0.
+            else:
+                update_eps = 0.
+                # Compute the threshold such that the KL divergence between perturbed and non-perturbed
+                # policy is comparable to eps-greedy exploration with eps = exploration.value(act_step_t).
+                # See Appendix C.1 in Parameter Space Noise for Exploration, Plappert et al., 2017
+                # for detailed explanation.
+                update_param_noise_threshold = -np.log(
+                    1. - exploration.value(act_step_t) +
+                    exploration.value(act_step_t) / float(env.action_space.n))
+                kwargs['reset'] = reset
+                kwargs['update_param_noise_threshold'] = update_param_noise_threshold
+                kwargs['update_param_noise_scale'] = True
+            with timers.phase('inference'):
+                if numpy_q_func is not None:
+                    if random.random() < update_eps:
+                        action = random.randrange(env.action_space.n)
+                    else:
+                        action = np.argmax(numpy_q_func.outputs(np.array(obs)[None])[0] + biases)
                 else:
-                    update_eps = 0.
-                    # Compute the threshold such that the KL divergence between perturbed and non-perturbed
-                    # policy is comparable to eps-greedy exploration with eps = exploration.value(act_step_t).
-                    # See Appendix C.1 in Parameter Space Noise for Exploration, Plappert et al., 2017
-                    # for detailed explanation.
-                    update_param_noise_threshold = -np.log(
-                        1. - exploration.value(act_step_t) +
-                        exploration.value(act_step_t) / float(env.action_space.n))
-                    kwargs['reset'] = reset
-                    kwargs['update_param_noise_threshold'] = update_param_noise_threshold
-                    kwargs['update_param_noise_scale'] = True
-                biases = reward_shaper.get_action_potentials(obs)
-                action = act(np.array(obs)[None], biases, update_eps=update_eps, **kwargs)[0]
-                reset = False
+                    action = act(np.array(obs)[None], biases, update_eps=update_eps, **kwargs)[0]
+            reset = False
 
+            with timers.phase('env'):
                 pairs = env.step(action)
-                action, (new_obs, rew, done, _) = pairs[-1]
-                # Write down the real reward but learn from normalized version
-                episode_rewards[-1] += rew
-                rew = np.sign(rew) * np.log(1 + np.abs(rew))
-                new_obs = StatePreprocessor.process(new_obs)
+            action, (new_obs, rew, done, _) = pairs[-1]
+            # Write down the real reward but learn from normalized version
+            episode_rewards[-1] += rew
+            rew = np.sign(rew) * np.log(1 + np.abs(rew))
+            new_obs = StatePreprocessor.process(new_obs)
 
+            if telemetry.verbose(act_step_t):
                 logger.log('{}/{} obs {} action {}'.format(act_step_t, total_timesteps, obs, action))
-                act_step_t += 1
-                if len(new_obs) == 0:
-                    done = True
-                else:
-                    replay_buffer.add(obs, action, rew, new_obs, float(done))
-                    obs = new_obs
-            # Post episode logging
-            summary = tf.Summary(value=[tf.Summary.Value(tag="rewards", simple_value=episode_rewards[-1])])
-            summary_writer.add_summary(summary, act_step_t)
-            summary = tf.Summary(value=[tf.Summary.Value(tag="eps", simple_value=update_eps)])
-            summary_writer.add_summary(summary, act_step_t)
-            summary = tf.Summary(value=[tf.Summary.Value(tag="episode_steps", simple_value=act_step_t-update_step_t)])
-            summary_writer.add_summary(summary, act_step_t)
-            mean_5ep_reward = round(np.mean(episode_rewards[-5:]), 1)
-            num_episodes = len(episode_rewards)
-            if print_freq is not None and num_episodes % print_freq == 0:
-                logger.record_tabular("steps", act_step_t)
-                logger.record_tabular("episodes", num_episodes)
-                logger.record_tabular("mean 5 episode reward", mean_5ep_reward)
-                logger.record_tabular("% time spent exploring", int(100 * exploration.value(act_step_t)))
-                logger.dump_tabular()
-            # Do the learning
-            start = time.time()
-            while update_step_t < min(act_step_t, total_timesteps):
-                if update_step_t % train_freq == 0:
-                    # Minimize the error in Bellman's equation on a batch sampled from replay buffer.
-                    if prioritized_replay:
-                        experience = replay_buffer.sample(batch_size, beta=beta_schedule.value(update_step_t))
-                        (obses_t, actions, rewards, obses_tp1, dones, weights, batch_idxes) = experience
+            act_step_t += 1
+            if len(new_obs) == 0:
+                done = True
+            else:
+                with timers.phase('shaping'):
+                    new_biases = reward_shaper.get_action_potentials(new_obs)
+                with timers.phase('replay_push'):
+                    if store_biases:
+                        add_transition(obs, action, rew, new_obs, float(done), biases, new_biases)
                     else:
-                        obses_t, actions, rewards, obses_tp1, dones = replay_buffer.sample(batch_size)
-                        weights, batch_idxes = np.ones_like(rewards), None
-                    biases_t = pool.map(reward_shaper.get_action_potentials, obses_t)
-                    biases_tp1 = pool.map(reward_shaper.get_action_potentials, obses_tp1)
-                    td_errors, weighted_error = train(
-                        obses_t, biases_t, actions, rewards, obses_tp1, biases_tp1, dones, weights)
-
-                    # Loss logging
-                    summary = tf.Summary(
-                        value=[tf.Summary.Value(tag='weighted_error', simple_value=weighted_error)])
-                    summary_writer.add_summary(summary, update_step_t)
-
-                    if prioritized_replay:
-                        new_priorities = np.abs(td_errors) + prioritized_replay_eps
-                        replay_buffer.update_priorities(batch_idxes, new_priorities)
-                if update_step_t % target_network_update_freq == 0:
-                    # Update target network periodically.
+                        add_transition(obs, action, rew, new_obs, float(done))
+                obs = new_obs
+                biases = new_biases
+        # Post episode logging
+        summary = tf.Summary(value=[tf.Summary.Value(tag="rewards", simple_value=episode_rewards[-1])])
+        summary_writer.add_summary(summary, act_step_t)
+        summary = tf.Summary(value=[tf.Summary.Value(tag="eps", simple_value=update_eps)])
+        summary_writer.add_summary(summary, act_step_t)
+        summary = tf.Summary(value=[tf.Summary.Value(tag="episode_steps", simple_value=act_step_t-update_step_t)])
+        summary_writer.add_summary(summary, act_step_t)
+        mean_5ep_reward = round(np.mean(episode_rewards[-5:]), 1)
+        num_episodes = len(episode_rewards)
+        if print_freq is not None and num_episodes % print_freq == 0:
+            logger.record_tabular("steps", act_step_t)
+            logger.record_tabular("episodes", num_episodes)
+            logger.record_tabular("mean 5 episode reward", mean_5ep_reward)
+            logger.record_tabular("% time spent exploring", int(100 * exploration.value(act_step_t)))
+            logger.dump_tabular()
+        # Do the learning
+        start = time.time()
+        train_steps = []
+        while update_step_t < min(act_step_t, total_timesteps):
+            if update_step_t % train_freq == 0:
+                train_steps.append(update_step_t)
+                if len(train_steps) == updates_per_call:
+                    train_on_batches(train_steps)
+                    train_steps = []
+            if update_step_t % target_network_update_freq == 0:
+                # Update target network periodically.
+                train_on_batches(train_steps)
+                train_steps = []
+                with timers.phase('target_sync'):
                     update_target()
-                update_step_t += 1
-            stop = time.time()
-            logger.log("Learning took {:.2f} seconds".format(stop - start))
-            if checkpoint_freq is not None and num_episodes % checkpoint_freq == 0:
-                # Periodically save the model and the replay buffer
-                rec_model_file = os.path.join(td, "model_{}_{:.2f}".format(num_episodes, mean_5ep_reward))
-                save_variables(rec_model_file)
-                buffer_file = os.path.join(td, "buffer_{}_{}".format(num_episodes, update_step_t))
-                with open(buffer_file, 'wb') as foutput:
-                    cloudpickle.dump(replay_buffer, foutput)
-                # Check whether it is best
-                if saved_mean_reward is None or mean_5ep_reward > saved_mean_reward:
-                    if print_freq is not None:
-                        logger.log("Saving model due to mean reward increase: {} -> {}".format(
-                            saved_mean_reward, mean_5ep_reward))
-                    save_variables(model_file)
-                    model_saved = True
-                    saved_mean_reward = mean_5ep_reward
-
-        if model_saved:
-            if print_freq is not None:
-                logger.log("Restored model with mean reward: {}".format(saved_mean_reward))
-            load_variables(model_file)
+            update_step_t += 1
+        train_on_batches(train_steps)
+        telemetry.maybe_flush(update_step_t)
+        stop = time.time()
+        logger.log("Learning took {:.2f} seconds".format(stop - start))
+        if checkpoint_freq is not None and num_episodes % checkpoint_freq == 0:
+            # Periodically save the model and the replay buffer, they are written in the background
+            # and the manager keeps the best model by the mean reward. Only the references of the
+            # buffer are copied here, it is pickled by the writer thread
+            with timers.phase('checkpoint'):
+                checkpoints.save(update_step_t, reward=mean_5ep_reward,
+                                 extras={'buffer': functools.partial(cloudpickle.dumps, replay_buffer.snapshot())})
+            # Check whether it is best
+            if saved_mean_reward is None or mean_5ep_reward > saved_mean_reward:
+                if print_freq is not None:
+                    logger.log("Saving model due to mean reward increase: {} -> {}".format(
+                        saved_mean_reward, mean_5ep_reward))
+                saved_mean_reward = mean_5ep_reward
+
+    telemetry.flush(update_step_t)
+    if profile_phases:
+        logger.log(timers.format_report())
+    best_checkpoint = checkpoints.best()
+    if best_checkpoint is not None:
+        if print_freq is not None:
+            logger.log("Restored model with mean reward: {}".format(best_checkpoint['reward']))
+        checkpoints.restore(best_checkpoint)
+    checkpoints.close()
+
+    if prefetcher is not None:
+        prefetcher.close()
+    if shaper_pool is not None:
+        shaper_pool.close()
 
     return act
@@ -1,6 +1,10 @@
+import collections
+
 import tensorflow as tf
 import tensorflow.contrib.layers as layers
 
+from deepq.numpy_network import NumpyNetwork
+
 
 def _mlp(hiddens, input_, num_actions, scope, reuse=False, layer_norm=False):
     with tf.variable_scope(scope, reuse=reuse):
@@ -138,3 +142,45 @@ def build_q_func(network, hiddens=[256], dueling=True, layer_norm=False, **netwo
             return q_out
 
     return q_func_builder
+
+
+def build_numpy_q_func(scope, network_activation=tf.tanh, refresh_every=1):
+    """Creates a NumPy snapshot of a q function built by build_q_func on top of an mlp network.
+
+    Parameters
+    ----------
+    scope: str
+        full name of the scope of the q function, e.g. "deepq/q_func".
+    network_activation: function
+        activation of the hidden layers of the mlp network, the activation keyword argument
+        of the mlp network builder, which is tanh by default.
+    refresh_every: int
+        number of the updates between the snapshots taken by NumpyNetwork.maybe_refresh.
+
+    Returns
+    -------
+    q_func: NumpyNetwork
+        the network computing the q values, it has to be refreshed before it is used.
+    """
+    variables = collections.OrderedDict()
+    for var in tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope=scope + "/"):
+        layer_name = var.name[len(scope) + 1:].rsplit("/", 1)[0]
+        if "LayerNorm" in layer_name or len(var.shape) > 2:
+            raise ValueError("Only dense q functions without layer normalization are supported")
+        variables.setdefault(layer_name, []).append(var)
+
+    torso, head, value_head = [], [], []
+    for layer_name, layer_vars in variables.items():
+        kernel, = [var for var in layer_vars if len(var.shape) == 2]
+        bias, = [var for var in layer_vars if len(var.shape) == 1]
+        if layer_name.startswith("action_value/"):
+            head.append((kernel, bias, tf.nn.relu))
+        elif layer_name.startswith("state_value/"):
+            value_head.append((kernel, bias, tf.nn.relu))
+        else:
+            torso.append((kernel, bias, network_activation))
+    # The last layers of the heads are linear
+    head[-1] = head[-1][:2] + (None,)
+    if value_head:
+        value_head[-1] = value_head[-1][:2] + (None,)
+    return NumpyNetwork(torso, head, value_head=value_head or None, refresh_every=refresh_every)
@@ -0,0 +1,99 @@
+import threading
+from collections import deque
+
+
+class BatchPrefetcher(object):
+    def __init__(self, replay_buffer, sample_fn, depth=4, max_held=1):
+        """Prepares replay minibatches on a background thread while the current train step runs.
+
+        The transitions are added and the priorities updated through the prefetcher,
+        which serializes them with the sampling. A prepared batch containing a
+        transition whose priority has been updated or which has been overwritten by
+        an add since it was sampled is sampled again when it is taken, so no batch is
+        used with stale priorities or updates the priority of another transition.
+
+        Parameters
+        ----------
+        replay_buffer: ReplayBuffer or PrioritizedReplayBuffer
+            the buffer to sample from.
+        sample_fn: (tuple of np.array or None) -> (tuple of np.array, [int] or None)
+            samples a batch and returns it with the idxes of its transitions. It is given
+            None or a batch that has been used, whose arrays it may write the new batch over.
+        depth: int
+            number of the batches prepared in advance.
+        max_held: int
+            number of the batches taken by get that can be in use at the same time. The
+            arrays of older batches are reused.
+        """
+        self._replay_buffer = replay_buffer
+        self._sample_fn = sample_fn
+        self._depth = depth
+        # Reusable batch arrays, None for the ones not allocated yet
+        self._free = [None] * (depth + max_held + 1)
+        self._ready = deque()
+        self._held = deque(maxlen=max_held)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='BatchPrefetcher', daemon=True)
+        self._thread.start()
+
+    def add(self, *args, **kwargs):
+        """See ReplayBuffer.add"""
+        with self._cond:
+            idx = self._replay_buffer.add(*args, **kwargs)
+            self._mark_stale([idx])
+            self._cond.notify_all()
+
+    def update_priorities(self, idxes, priorities):
+        """See PrioritizedReplayBuffer.update_priorities"""
+        with self._cond:
+            self._replay_buffer.update_priorities(idxes, priorities)
+            self._mark_stale(idxes)
+
+    def _mark_stale(self, idxes):
+        changed = set(idxes)
+        for batch in self._ready:
+            if batch[1] is not None and not batch[2] and not changed.isdisjoint(batch[1]):
+                batch[2] = True
+
+    def get(self):
+        """Returns the next batch and the idxes of its transitions."""
+        with self._cond:
+            while not self._ready and self._error is None:
+                self._cond.wait()
+            if self._error is not None:
+                raise RuntimeError('The prefetching thread has failed') from self._error
+            arrays, idxes, stale = self._ready.popleft()
+            if stale:
+                arrays, idxes = self._sample_fn(arrays)
+            if len(self._held) == self._held.maxlen:
+                self._free.append(self._held[0])
+            self._held.append(arrays)
+            self._cond.notify_all()
+            return arrays, idxes
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        try:
+            while True:
+                # The lock is released after every batch to let the trainer add and take batches
+                with self._cond:
+                    while not self._closed and (len(self._ready) >= self._depth or not self._free or
+                                                len(self._replay_buffer) == 0):
+                        self._cond.wait()
+                    if self._closed:
+                        return
+                    arrays, idxes = self._sample_fn(self._free.pop())
+                    self._ready.append([arrays, idxes, False])
+                    self._cond.notify_all()
+        except Exception as error:
+            with self._cond:
+                self._error = error
+                self._cond.notify_all()
+            raise
@@ -1,11 +1,19 @@
+import copy
+
 import numpy as np
 import random
 
 from baselines.common.segment_tree import SumSegmentTree, MinSegmentTree
 
 
+def _copy_segment_tree(tree):
+    tree_copy = copy.copy(tree)
+    tree_copy._value = list(tree._value)
+    return tree_copy
+
+
 class ReplayBuffer(object):
-    def __init__(self, size):
+    def __init__(self, size, store_biases=False):
         """Create Replay buffer.
 
         Parameters
@@ -13,42 +21,82 @@ class ReplayBuffer(object):
         size: int
             Max number of transitions to store in the buffer. When the buffer
             overflows the old memories are dropped.
+        store_biases: bool
+            if True every transition also keeps the action biases of obs_t and obs_tp1,
+            so that they are computed once on add instead of on every sample.
         """
         self._storage = []
         self._maxsize = size
         self._next_idx = 0
+        self._store_biases = store_biases
 
     def __len__(self):
         return len(self._storage)
 
-    def add(self, obs_t, action, reward, obs_tp1, done):
-        data = (obs_t, action, reward, obs_tp1, done)
+    def snapshot(self):
+        """Returns a copy of the buffer that the later adds do not change.
+
+        The stored transitions are never modified, so only the list of the references
+        to them is copied. The copy can be pickled on another thread.
+        """
+        snapshot = copy.copy(self)
+        snapshot._storage = list(self._storage)
+        return snapshot
+
+    def add(self, obs_t, action, reward, obs_tp1, done, biases_t=None, biases_tp1=None):
+        """Stores a transition, overwriting the oldest one if the buffer is full.
 
-        if self._next_idx >= len(self._storage):
+        Returns the idx the transition is stored at.
+        """
+        idx = self._next_idx
+        if self._store_biases:
+            assert biases_t is not None and biases_tp1 is not None
+            data = (obs_t, action, reward, obs_tp1, done, biases_t, biases_tp1)
+        else:
+            data = (obs_t, action, reward, obs_tp1, done)
+
+        if idx >= len(self._storage):
             self._storage.append(data)
         else:
-            self._storage[self._next_idx] = data
-        self._next_idx = (self._next_idx + 1) % self._maxsize
+            self._storage[idx] = data
+        self._next_idx = (idx + 1) % self._maxsize
+        return idx
 
-    def _encode_sample(self, idxes):
+    def _encode_sample(self, idxes, out=None):
+        if out is not None:
+            # Write the transitions over the arrays of a previously encoded sample
+            for k, i in enumerate(idxes):
+                for array, value in zip(out, self._storage[i]):
+                    array[k] = value
+            return out
         obses_t, actions, rewards, obses_tp1, dones = [], [], [], [], []
+        biases_t, biases_tp1 = [], []
         for i in idxes:
             data = self._storage[i]
-            obs_t, action, reward, obs_tp1, done = data
+            obs_t, action, reward, obs_tp1, done = data[:5]
             obses_t.append(np.array(obs_t, copy=False))
             actions.append(np.array(action, copy=False))
             rewards.append(reward)
             obses_tp1.append(np.array(obs_tp1, copy=False))
             dones.append(done)
-        return np.array(obses_t), np.array(actions), np.array(rewards), np.array(obses_tp1), np.array(dones)
+            if self._store_biases:
+                biases_t.append(data[5])
+                biases_tp1.append(data[6])
+        encoded_sample = (np.array(obses_t), np.array(actions), np.array(rewards), np.array(obses_tp1), np.array(dones))
+        if self._store_biases:
+            encoded_sample += (np.array(biases_t), np.array(biases_tp1))
+        return encoded_sample
 
-    def sample(self, batch_size):
+    def sample(self, batch_size, out=None):
         """Sample a batch of experiences.
 
         Parameters
         ----------
         batch_size: int
             How many transitions to sample.
+        out: tuple of np.array or None
+            a sample of the same batch size previously returned by this buffer
+            (without weights and idxes) to write the new one over.
 
         Returns
         -------
@@ -63,13 +111,17 @@ class ReplayBuffer(object):
         done_mask: np.array
             done_mask[i] = 1 if executing act_batch[i] resulted in
             the end of an episode and 0 otherwise.
+        biases_batch: np.array
+            only if store_biases is set, action biases of obs_batch
+        next_biases_batch: np.array
+            only if store_biases is set, action biases of next_obs_batch
         """
         idxes = [random.randint(0, len(self._storage) - 1) for _ in range(batch_size)]
-        return self._encode_sample(idxes)
+        return self._encode_sample(idxes, out=out)
 
 
 class PrioritizedReplayBuffer(ReplayBuffer):
-    def __init__(self, size, alpha):
+    def __init__(self, size, alpha, store_biases=False):
         """Create Prioritized Replay buffer.
 
         Parameters
@@ -80,12 +132,14 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         alpha: float
             how much prioritization is used
             (0 - no prioritization, 1 - full prioritization)
+        store_biases: bool
+            whether to keep the action biases with the transitions
 
         See Also
         --------
         ReplayBuffer.__init__
         """
-        super(PrioritizedReplayBuffer, self).__init__(size)
+        super(PrioritizedReplayBuffer, self).__init__(size, store_biases=store_biases)
         assert alpha >= 0
         self._alpha = alpha
 
@@ -97,12 +151,19 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         self._it_min = MinSegmentTree(it_capacity)
         self._max_priority = 1.0
 
+    def snapshot(self):
+        """See ReplayBuffer.snapshot, the priorities are copied as well"""
+        snapshot = super().snapshot()
+        snapshot._it_sum = _copy_segment_tree(self._it_sum)
+        snapshot._it_min = _copy_segment_tree(self._it_min)
+        return snapshot
+
     def add(self, *args, **kwargs):
         """See ReplayBuffer.store_effect"""
-        idx = self._next_idx
-        super().add(*args, **kwargs)
+        idx = super().add(*args, **kwargs)
         self._it_sum[idx] = self._max_priority ** self._alpha
         self._it_min[idx] = self._max_priority ** self._alpha
+        return idx
 
     def _sample_proportional(self, batch_size):
         res = []
@@ -114,7 +175,7 @@ class PrioritizedReplayBuffer(ReplayBuffer):
             res.append(idx)
         return res
 
-    def sample(self, batch_size, beta):
+    def sample(self, batch_size, beta, out=None):
         """Sample a batch of experiences.
 
         compared to ReplayBuffer.sample
@@ -129,6 +190,8 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         beta: float
             To what degree to use importance weights
             (0 - no corrections, 1 - full correction)
+        out: tuple of np.array or None
+            see ReplayBuffer.sample
 
         Returns
         -------
@@ -143,6 +206,10 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         done_mask: np.array
             done_mask[i] = 1 if executing act_batch[i] resulted in
             the end of an episode and 0 otherwise.
+        biases_batch: np.array
+            only if store_biases is set, action biases of obs_batch
+        next_biases_batch: np.array
+            only if store_biases is set, action biases of next_obs_batch
         weights: np.array
             Array of shape (batch_size,) and dtype np.float32
             denoting importance weight of each sampled transition
@@ -163,7 +230,7 @@ class PrioritizedReplayBuffer(ReplayBuffer):
             weight = (p_sample * len(self._storage)) ** (-beta)
             weights.append(weight / max_weight)
         weights = np.array(weights)
-        encoded_sample = self._encode_sample(idxes)
+        encoded_sample = self._encode_sample(idxes, out=out)
         return tuple(list(encoded_sample) + [weights, idxes])
 
     def update_priorities(self, idxes, priorities):
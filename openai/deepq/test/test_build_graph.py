@@ -0,0 +1,74 @@
+import unittest
+
+import numpy as np
+import tensorflow as tf
+
+from openai.deepq.build_graph import build_train, build_multi_train
+from openai.deepq.models import mlp
+from openai.deepq.utils import PlaceholderTfInput
+
+
+def make_obs_ph(name):
+    return PlaceholderTfInput(tf.placeholder(tf.float32, (None, 18), name=name))
+
+
+class TestMultiTrain(unittest.TestCase):
+    num_updates = 3
+    batch_size = 8
+
+    def setUp(self):
+        tf.reset_default_graph()
+        rng = np.random.RandomState(0)
+        size = self.num_updates * self.batch_size
+        # The batches of the steps concatenated, in the order of the arguments of train
+        self.inputs = [
+            rng.uniform(-1, 1, size=(size, 18)).astype(np.float32),
+            np.zeros((size, 25), dtype=np.float32),
+            rng.randint(25, size=size),
+            rng.uniform(-1, 1, size=size).astype(np.float32),
+            rng.uniform(-1, 1, size=(size, 18)).astype(np.float32),
+            np.zeros((size, 25), dtype=np.float32),
+            (rng.uniform(size=size) < 0.25).astype(np.float32),
+            rng.uniform(0.5, 1, size=size).astype(np.float32),
+        ]
+
+    def build(self, use_resource):
+        q_func = mlp([16])
+        optimizer = tf.train.AdamOptimizer(learning_rate=1e-2)
+        with tf.variable_scope(tf.get_variable_scope(), use_resource=use_resource):
+            _, train, _, _ = build_train(make_obs_ph, q_func, 25, optimizer, grad_norm_clipping=10, gamma=0.99)
+            multi_train = build_multi_train(make_obs_ph, q_func, 25, optimizer, self.num_updates,
+                                            grad_norm_clipping=10, gamma=0.99)
+        return train, multi_train
+
+    def test_multi_train_matches_train(self):
+        train, multi_train = self.build(use_resource=True)
+        variables = tf.global_variables()
+        q_func_vars = tf.trainable_variables("deepq/q_func/")
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            # Both ways start from the same parameters and optimizer slots
+            initial_values = sess.run(variables)
+            expected_td_errors, expected_weighted_errors = [], []
+            for i in range(self.num_updates):
+                batch = [values[i * self.batch_size:(i + 1) * self.batch_size] for values in self.inputs]
+                td_errors, weighted_error = train(*batch)
+                expected_td_errors.append(td_errors)
+                expected_weighted_errors.append(weighted_error)
+            expected_params = sess.run(q_func_vars)
+            for var, value in zip(variables, initial_values):
+                var.load(value, sess)
+            td_errors, weighted_errors = multi_train(*self.inputs)
+            params = sess.run(q_func_vars)
+        self.assertTrue(np.allclose(td_errors, np.concatenate(expected_td_errors), atol=1e-5))
+        self.assertTrue(np.allclose(weighted_errors, expected_weighted_errors, atol=1e-5))
+        for param, expected in zip(params, expected_params):
+            self.assertTrue(np.allclose(param, expected, atol=1e-5))
+
+    def test_ref_variables(self):
+        with self.assertRaises(ValueError):
+            self.build(use_resource=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
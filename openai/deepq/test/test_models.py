@@ -0,0 +1,45 @@
+import unittest
+
+import numpy as np
+import tensorflow as tf
+
+from openai.deepq.models import build_q_func, build_numpy_q_func
+
+
+class TestNumpyQFunc(unittest.TestCase):
+
+    def setUp(self):
+        tf.reset_default_graph()
+        self.observations = tf.placeholder(tf.float32, (None, 18))
+        self.states = np.random.RandomState(0).uniform(-1, 1, size=(16, 18)).astype(np.float32)
+
+    def check_q_values(self, activation=None, **kwargs):
+        network_kwargs = dict(num_layers=2, num_hidden=16, **kwargs)
+        if activation is not None:
+            network_kwargs['activation'] = activation
+        q_func = build_q_func('mlp', hiddens=[8], dueling=True, **network_kwargs)
+        q_values = q_func(self.observations, 25, scope="deepq/q_func")
+        numpy_q_func = build_numpy_q_func("deepq/q_func", network_activation=activation or tf.tanh)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            numpy_q_func.refresh(sess)
+            expected = sess.run(q_values, feed_dict={self.observations: self.states})
+        self.assertTrue(np.allclose(numpy_q_func.outputs(self.states), expected, atol=1e-5))
+
+    def test_dueling_mlp(self):
+        self.check_q_values()
+
+    def test_relu_mlp(self):
+        self.check_q_values(activation=tf.nn.relu)
+
+    def test_unsupported_activation(self):
+        with self.assertRaises(ValueError):
+            self.check_q_values(activation=tf.nn.elu)
+
+    def test_layer_norm(self):
+        with self.assertRaises(ValueError):
+            self.check_q_values(layer_norm=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
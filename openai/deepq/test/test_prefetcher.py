@@ -0,0 +1,71 @@
+import threading
+import unittest
+
+import numpy as np
+
+from openai.deepq.prefetcher import BatchPrefetcher
+from openai.deepq.replay_buffer import PrioritizedReplayBuffer
+
+
+class RecordingSampler(object):
+    """Samples the batches of the transitions 0 and 1 and records the threads they are sampled on."""
+
+    def __init__(self):
+        self.threads = []
+        self._cond = threading.Condition()
+
+    def __call__(self, out):
+        with self._cond:
+            self.threads.append(threading.current_thread())
+            self._cond.notify_all()
+            return (len(self.threads),), [0, 1]
+
+    def wait_for_samples(self, count):
+        with self._cond:
+            self._cond.wait_for(lambda: len(self.threads) >= count, timeout=10)
+
+
+class TestBatchPrefetcher(unittest.TestCase):
+    depth = 2
+
+    def make_prefetcher(self, size, transitions):
+        replay_buffer = PrioritizedReplayBuffer(size, alpha=0.6)
+        for i in range(transitions):
+            replay_buffer.add(np.full(4, i), 0, 0.0, np.full(4, i + 1), False)
+        sampler = RecordingSampler()
+        prefetcher = BatchPrefetcher(replay_buffer, sampler, depth=self.depth)
+        self.addCleanup(prefetcher.close)
+        # The prepared batches are left as they are until one is taken
+        sampler.wait_for_samples(self.depth)
+        return prefetcher, sampler
+
+    def assert_resampled(self, prefetcher, sampler, resampled):
+        (sample,), idxes = prefetcher.get()
+        self.assertEqual(idxes, [0, 1])
+        sampled_by_trainer = sampler.threads[sample - 1] is threading.current_thread()
+        self.assertEqual(sampled_by_trainer, resampled)
+
+    def test_updated_priorities(self):
+        prefetcher, sampler = self.make_prefetcher(size=8, transitions=8)
+        prefetcher.update_priorities([0], [2.0])
+        self.assert_resampled(prefetcher, sampler, resampled=True)
+
+    def test_other_updated_priorities(self):
+        prefetcher, sampler = self.make_prefetcher(size=8, transitions=8)
+        prefetcher.update_priorities([5], [2.0])
+        self.assert_resampled(prefetcher, sampler, resampled=False)
+
+    def test_overwritten_transition(self):
+        prefetcher, sampler = self.make_prefetcher(size=8, transitions=8)
+        # The buffer is full, the transition 0 is overwritten
+        prefetcher.add(np.full(4, 8), 0, 0.0, np.full(4, 9), False)
+        self.assert_resampled(prefetcher, sampler, resampled=True)
+
+    def test_added_transition(self):
+        prefetcher, sampler = self.make_prefetcher(size=16, transitions=8)
+        prefetcher.add(np.full(4, 8), 0, 0.0, np.full(4, 9), False)
+        self.assert_resampled(prefetcher, sampler, resampled=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
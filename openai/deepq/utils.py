@@ -31,6 +31,10 @@ class PlaceholderTfInput(TfInput):
         super().__init__(placeholder.name)
         self._placeholder = placeholder
 
+    @property
+    def placeholder(self):
+        return self._placeholder
+
     def get(self):
         return self._placeholder
 
@@ -1,5 +1,4 @@
 import sys
-import multiprocessing
 import os.path as osp
 import gym
 from collections import defaultdict
@@ -68,14 +67,11 @@ def train(args, extra_args):
 
     print('Training {} on {}:{} with arguments \n{}'.format(args.alg, env_type, env_id, alg_kwargs))
 
-    pool_size = multiprocessing.cpu_count()
-    with multiprocessing.Pool(processes=pool_size) as pool:
-        model = learn(
-            env=env,
-            seed=seed,
-            pool=pool,
-            **alg_kwargs
-        )
+    model = learn(
+        env=env,
+        seed=seed,
+        **alg_kwargs
+    )
 
     return model, env
 
@@ -1,22 +1,27 @@
 import logging
-import pickle
 import random
 
 import numpy as np
-from sklearn.preprocessing import OneHotEncoder
 
 from policy_gradient.analyze_model import print_network_weights
+from policy_gradient.chunk_log import append_chunk, load_rewards, rewrite_chunks
 from policy_gradient.network import Network
 from policy_gradient.replay_buffer import ReplayBuffer
 from dotaenv.codes import STATE_DIM, ACTIONS_TOTAL
 from deepq.reward_shaper import StatePotentialRewardShaper
 from deepq.state_preprocessor import StatePreprocessor
+from deepq.profiling import PhaseTimers
+from deepq.returns import discounted_returns, shape_rewards
+from deepq.telemetry import Telemetry
 
 logger = logging.getLogger('DotaRL.PGAgent')
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
 input_shape = STATE_DIM
 output_shape = ACTIONS_TOTAL
+# Batches trained on after every episode
+UPDATES_PER_CALL = 10
+REWARDS_FILE = 'saved_rewards.pkl'
 
 
 class PGAgent:
@@ -26,47 +31,69 @@ class PGAgent:
     __slots__ = ('env',
                  'replay_buffer',
                  'network',
+                 'numpy_network',
                  'episodes',
                  'discount',
                  'batch_size',
                  'eps_update',
                  'eps',
-                 'total_rewards')
+                 'total_rewards',
+                 'reward_shaper',
+                 'telemetry',
+                 'timers',
+                 'batch')
 
     def __init__(self, environment, episodes=100, batch_size=100, eps=0.7,
-                 discount=0.99, eps_update=0.99, restore=False):
+                 discount=0.99, eps_update=0.99, restore=False, numpy_refresh_every=None, verbose_every=100,
+                 profile_phases=False, debug_network=False):
+        # The demos are compiled before the network's session exists, the compilation may fork worker processes
+        self.reward_shaper = StatePotentialRewardShaper('replays/')
+        self.reward_shaper.load()
         self.replay_buffer = ReplayBuffer()
+        # Only every verbose_every-th step of an episode is logged
+        self.telemetry = Telemetry(verbose_every=verbose_every)
+        # The phases of the training are timed, the report is logged when the training finishes
+        self.timers = PhaseTimers(enabled=profile_phases)
+        if profile_phases:
+            self.timers.install_signal_handler('policy_gradient.prof')
         self.network = Network(input_shape=input_shape,
                                output_shape=output_shape,
-                               restore=restore)
+                               restore=restore,
+                               updates_per_call=UPDATES_PER_CALL,
+                               debug=debug_network,
+                               freeze=not debug_network)
+        # Acting with a NumPy snapshot of the network skips a session call per step
+        self.numpy_network = None
+        if numpy_refresh_every is not None:
+            self.numpy_network = self.network.to_numpy(refresh_every=numpy_refresh_every)
+            self.numpy_network.refresh(self.network.session)
         self.env = environment()
         self.episodes = episodes
         self.batch_size = batch_size
         self.eps = eps
         self.discount = discount
         self.eps_update = eps_update
+        # The batches trained on in a session call are sampled into the same arrays every time
+        self.batch = (np.zeros((UPDATES_PER_CALL * batch_size, input_shape), dtype=np.float32),
+                      np.zeros(UPDATES_PER_CALL * batch_size, dtype=np.int64),
+                      np.zeros(UPDATES_PER_CALL * batch_size, dtype=np.float32))
         if restore:
             self.replay_buffer.load_data()
-            with open('saved_rewards.pkl', 'rb') as input_file:
-                self.total_rewards = pickle.load(input_file)
+            self.total_rewards = load_rewards(REWARDS_FILE)
         else:
             self.total_rewards = []
 
     def show_performance(self):
+        # The greedy actions are served on the bot server's request thread, nothing waits for the agent's steps
+        policy = lambda observation: self.get_action(state=StatePreprocessor.process(observation), eps=0.0)
         for episode in range(self.episodes):
-            # sample data
-            states, actions, rewards, next_states, terminal = \
-                self.sample_episode(batch_size=self.batch_size, eps=0.00)
-            rewards = np.array(rewards, dtype='float32')
+            rewards = np.array(self.env.play_inline(policy), dtype='float32')
 
             temp = 'Finished episode {ep} with total reward {rew}. eps={eps}'
             logger.debug(temp.format(ep=episode, rew=np.sum(rewards),
                                      eps=self.eps))
 
     def train(self):
-        reward_shaper = StatePotentialRewardShaper('replays/')
-        reward_shaper.load()
-
         episode_rewards = []
         for episode in range(self.episodes):
             # sample data
@@ -83,37 +110,60 @@ class PGAgent:
                     # The game was restarted right after it started
                     continue
                 self.total_rewards.append(total_reward)
-                with open('saved_rewards.pkl', 'wb') as output_file:
-                    pickle.dump(obj=self.total_rewards, file=output_file)
+                # Only the new reward is written, the file is an append-only log started by the first reward
+                if len(self.total_rewards) == 1:
+                    rewrite_chunks(REWARDS_FILE, [self.total_rewards])
+                else:
+                    append_chunk(REWARDS_FILE, [total_reward])
 
             rewards = np.array(rewards, dtype='float32')
             temp = 'Finished episode {ep} with total reward {rew}. eps={eps}'
             logger.debug(temp.format(ep=episode, rew=np.sum(rewards), eps=self.eps))
 
             # Potential-based reward shaping from the demo
-            for i in range(len(states)):
-                rewards[i] += (
-                        self.discount * reward_shaper.get_state_potential(next_states[i]) -
-                        reward_shaper.get_state_potential(states[i]))
+            with self.timers.phase('shaping'):
+                # Every next state of the episode is the following state, only the last one is new
+                potentials = [self.reward_shaper.get_state_potential(state) for state in states]
+                next_potentials = potentials[1:] + [self.reward_shaper.get_state_potential(next_states[-1])]
+                rewards = shape_rewards(rewards, potentials, next_potentials, self.discount).astype(np.float32)
 
             # Discount rewards
             disc_rewards = self.disc_rewards(rewards)
 
             # Extend replay buffer with sampled data
-            self.replay_buffer.extend(zip(states, actions, disc_rewards))
+            with self.timers.phase('replay_push'):
+                self.replay_buffer.extend(zip(states, actions, disc_rewards))
 
             # Update the parameter for epsilon-greedy strategy
             self.eps *= self.eps_update
 
             # If there is enough data in replay buffer, train the model on it
             if len(self.replay_buffer) >= self.batch_size:
-                for i in range(10):
-                    states, actions, rewards = self.replay_buffer.get_data(self.batch_size)
-                    rewards = self.normalize_rewards(rewards)
-                    self.train_network((states, actions, rewards))
+                with self.timers.phase('sampling'):
+                    batch = self.sample_batches()
+                # Train on all of the batches in one session call
+                self.train_network(batch, num_updates=UPDATES_PER_CALL)
 
             print_network_weights(self.network)
+        # Wait for the last checkpoint to be written
+        with self.timers.phase('checkpoint'):
+            self.network.checkpoints.flush()
         logger.debug('Finished training.')
+        if self.timers.enabled:
+            logger.debug('Phase timings:\n' + self.timers.format_report())
+
+    def sample_batches(self):
+        """
+        Sample UPDATES_PER_CALL batches from the replay buffer into the reused batch arrays.
+
+        :return: the batch arrays, the rewards of every batch are normalized separately
+        """
+        for i in range(UPDATES_PER_CALL):
+            batch_slice = slice(i * self.batch_size, (i + 1) * self.batch_size)
+            _, _, rewards = self.replay_buffer.get_data(
+                self.batch_size, out=tuple(array[batch_slice] for array in self.batch))
+            rewards[:] = self.normalize_rewards(rewards)
+        return self.batch
 
     def sample_episode(self, batch_size, eps):
         states = []
@@ -121,20 +171,24 @@ class PGAgent:
         next_states = []
         rewards = []
         terminal = False
-        state = self.env.reset()
+        with self.timers.phase('env'):
+            state = self.env.reset()
         state = StatePreprocessor.process(state)
         for i in range(batch_size):
             states.append(state)
-            action = self.get_action(state=state, eps=eps)
+            with self.timers.phase('inference'):
+                action = self.get_action(state=state, eps=eps)
             actions.append(action)
-            state, reward, terminal_action, _ = self.env.step(action=action)
+            with self.timers.phase('env'):
+                state, reward, terminal_action, _ = self.env.step(action=action)
             state = StatePreprocessor.process(state)
             next_states.append(state)
             rewards.append(reward)
             terminal = terminal_action
             if terminal_action:
                 break
-            logger.debug('Step {step} state: {state}, action: {action}.'.format(step=i, rew=reward, action=action, state=state))
+            if self.telemetry.verbose(i):
+                logger.debug('Step {step} state: {state}, action: {action}.'.format(step=i, action=action, state=state))
         return states, actions, next_states, rewards, terminal
 
     def get_action(self, state, eps):
@@ -144,19 +198,21 @@ class PGAgent:
         :return: action
         """
         if random.uniform(0, 1) > eps:
+            if self.numpy_network is not None:
+                return np.argmax(self.numpy_network.outputs([state])[0])
             return self.network.predict(state=state)
         else:
             return random.randint(0, output_shape - 1)
 
     def disc_rewards(self, rewards):
-        disc_rewards = np.zeros_like(rewards)
-        cumulative = 0.0
-        for i in reversed(range(len(rewards))):
-            cumulative = cumulative * self.discount + rewards[i]
-            disc_rewards[i] = cumulative
-        return disc_rewards
-
-    def normalize_rewards(self, rewards):
+        return PGAgent.discount_rewards(rewards, self.discount)
+
+    @staticmethod
+    def discount_rewards(rewards, gamma):
+        return discounted_returns(rewards, gamma).astype(np.float32)
+
+    @staticmethod
+    def normalize_rewards(rewards):
         norm_rewards = np.copy(rewards)
         mean = np.mean(norm_rewards)
         std = np.std(norm_rewards)
@@ -165,18 +221,17 @@ class PGAgent:
             norm_rewards /= std
         return norm_rewards
 
-    def train_network(self, batch):
-        states, actions, rewards = batch
-        states = np.array(states)
-
-        enc = OneHotEncoder(n_values=output_shape)
-        actions = np.array(actions).reshape(-1, 1)
-        actions = enc.fit_transform(actions).toarray()
-
-        rewards = np.array(rewards, dtype='float32')
+    def train_network(self, batch, num_updates=1):
+        # The actions are the indices, they are one-hot encoded by the network
+        states, actions, rewards = (np.asarray(array) for array in batch)
 
         logger.debug('Training network on batch: states {s_shape}, actions {a_shape}, rewards {r_shape}.\n'
                      .format(s_shape=states.shape, a_shape=actions.shape, r_shape=rewards.shape))
 
-        self.replay_buffer.save_data()
-        self.network.train(states=states, actions=actions, rewards=rewards)
+        with self.timers.phase('checkpoint'):
+            self.replay_buffer.save_data()
+        with self.timers.phase('update'):
+            self.network.train(states=states, actions=actions, rewards=rewards, num_updates=num_updates)
+        if self.numpy_network is not None:
+            with self.timers.phase('target_sync'):
+                self.numpy_network.maybe_refresh(self.network.session, updates=num_updates)
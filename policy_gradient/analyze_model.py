@@ -31,14 +31,11 @@ def main():
 
     print("Replays:")
     replay_buffer.load_data()
-    N = len(replay_buffer.data)
+    N = len(replay_buffer)
     print("N: ", N)
-    x = np.zeros(N)
-    y = np.zeros(N)
-    for i in range(N):
-        state, action, reward = replay_buffer.data[i]
-        x[i] = state[0]
-        y[i] = state[1]
+    states, _, _ = replay_buffer.get_all()
+    x = states[:, 0]
+    y = states[:, 1]
 
     print("x.mean x.std", x.mean(), x.std())
     print("y.mean y.std", y.mean(), y.std())
@@ -0,0 +1,52 @@
+import os
+import pickle
+
+
+def append_chunk(path, chunk):
+    """
+    Append a chunk to the log, the cost depends only on the size of the chunk.
+    :param path: path to the log
+    :param chunk: picklable chunk of data
+    """
+    with open(path, 'ab') as log_file:
+        pickle.dump(chunk, log_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def iter_chunks(path):
+    """
+    Stream the chunks of the log in the order they were appended.
+
+    A file holding a single pickled object, as written before the logs, is
+    read as a log of one chunk. A chunk truncated by an interrupted write ends
+    the log.
+    :param path: path to the log
+    :return: iterator over the chunks
+    """
+    with open(path, 'rb') as log_file:
+        while True:
+            try:
+                yield pickle.load(log_file)
+            except (EOFError, pickle.UnpicklingError):
+                return
+
+
+def rewrite_chunks(path, chunks):
+    """
+    Replace the log with the chunks atomically.
+    :param path: path to the log
+    :param chunks: iterable of chunks
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as log_file:
+        for chunk in chunks:
+            pickle.dump(chunk, log_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_rewards(path):
+    """
+    Read the rewards appended to the log in lists.
+    :param path: path to the log
+    :return: list of the rewards
+    """
+    return [reward for chunk in iter_chunks(path) for reward in chunk]
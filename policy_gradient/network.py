@@ -3,6 +3,10 @@ import logging
 import tensorflow as tf
 import numpy as np
 
+from deepq.checkpoint_manager import CheckpointManager
+from deepq.numpy_network import NumpyNetwork
+from deepq.session_callable import SessionCallable
+
 logger = logging.getLogger('DotaRL.Network')
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
@@ -10,32 +14,64 @@ logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(leve
 class Network:
     """
     Policy gradient network for predicting actions by a given state.
+
+    In the debug mode the input and the activations of every layer are printed
+    by the graph whenever it is run. The production mode builds the graph
+    without the print ops, and if freeze is set the graph is finalized once
+    the network is set up, so that no op can be added to it by accident.
     """
     __slots__ = ('predict_op',
+                 'predict_fn',
                  'train_op',
+                 'multi_train_op',
                  'states',
                  'actions',
                  'rewards',
                  'loss',
+                 'multi_loss',
+                 'dense_layers',
+                 'updates_per_call',
                  'session',
-                 'saver')
+                 'saver',
+                 'checkpoints',
+                 'train_steps',
+                 'debug')
 
     def __init__(self, input_shape, output_shape, learning_rate=0.01,
-                 restore=False):
+                 restore=False, updates_per_call=1, checkpoint_every_seconds=60, debug=False, freeze=False):
+        self.debug = debug
         self.predict_op = None
+        self.predict_fn = None
         self.train_op = None
+        self.multi_train_op = None
         self.states = None
         self.actions = None
         self.rewards = None
         self.loss = None
-        self.build(input_shape=input_shape, output_shape=output_shape, learning_rate=learning_rate)
+        self.multi_loss = None
+        self.dense_layers = None
+        self.updates_per_call = updates_per_call
+        # The chained steps of multi_train_op have to read the variables updated by the previous step
+        with tf.variable_scope(tf.get_variable_scope(), use_resource=updates_per_call > 1):
+            self.build(input_shape=input_shape, output_shape=output_shape, learning_rate=learning_rate)
         self.session = tf.Session()
         self.session.run(tf.global_variables_initializer())
 
-        # initialize saver and restore if needed
+        # initialize checkpoints and restore if needed, they are written in the background
         self.saver = tf.train.Saver()
+        self.checkpoints = CheckpointManager(self.session, 'saved_model', every_seconds=checkpoint_every_seconds)
+        self.train_steps = 0
         if restore:
-            self.saver.restore(self.session, 'saved_model/model.ckpt')
+            checkpoint = self.checkpoints.restore()
+            if checkpoint is not None:
+                self.train_steps = checkpoint['step']
+            else:
+                self.saver.restore(self.session, 'saved_model/model.ckpt')
+
+        # The prediction step is compiled once, a call runs it without building a feed dict
+        self.predict_fn = SessionCallable(self.session, [self.states], [self.predict_op])
+        if freeze:
+            self.session.graph.finalize()
 
     def build(self, input_shape, output_shape, learning_rate=0.01,
               layer_shape=20):
@@ -47,59 +83,101 @@ class Network:
         :param learning_rate: learning rate
         :param layer_shape: inner layer shape
         """
-        onehot_actions = tf.placeholder(dtype='float32', shape=(None, output_shape), name='y')
+        action_indices = tf.placeholder(dtype='int64', shape=(None,), name='y')
         input_layer = tf.placeholder(dtype='float32', shape=(None, input_shape), name='x')
         normalized_rewards = tf.placeholder(dtype='float32', shape=(None,), name='rewards')
 
         self.states = input_layer
-        self.actions = onehot_actions
+        self.actions = action_indices
         self.rewards = normalized_rewards
 
-        in_layer = tf.Print(input_layer, [input_layer], message='input_layer', summarize=input_shape)
+        fc1_layer = tf.layers.Dense(units=layer_shape, activation=tf.nn.relu)
+        fc2_layer = tf.layers.Dense(units=layer_shape, activation=tf.nn.relu)
+        fc3_layer = tf.layers.Dense(units=output_shape, activation=None)
+        self.dense_layers = [fc1_layer, fc2_layer, fc3_layer]
+
+        def debug_print(tensor, message, summarize):
+            if not self.debug:
+                return tensor
+            return tf.Print(tensor, [tensor], message=message, summarize=summarize)
+
+        def logits(states):
+            in_layer = debug_print(states, 'input_layer', input_shape)
 
-        # network
-        fc1 = tf.layers.dense(inputs=in_layer, units=layer_shape, activation=tf.nn.relu)
-        fc1_print = tf.Print(fc1, [fc1], message='fc1', summarize=layer_shape)
+            # network
+            fc1 = fc1_layer(in_layer)
+            fc1_print = debug_print(fc1, 'fc1', layer_shape)
 
-        fc2 = tf.layers.dense(inputs=fc1_print, units=layer_shape, activation=tf.nn.relu)
-        fc2_print = tf.Print(fc2, [fc2], message='fc2', summarize=layer_shape)
+            fc2 = fc2_layer(fc1_print)
+            fc2_print = debug_print(fc2, 'fc2', layer_shape)
 
-        fc3 = tf.layers.dense(inputs=fc2_print, units=output_shape, activation=None)
-        fc3_print = tf.Print(fc3, [fc3], message='fc3', summarize=output_shape)
+            fc3 = fc3_layer(fc2_print)
+            return debug_print(fc3, 'fc3', output_shape)
+
+        def loss(fc3, actions, rewards):
+            # The actions are one-hot encoded in the graph
+            neg_log_prob = tf.nn.softmax_cross_entropy_with_logits_v2(logits=fc3,
+                                                                      labels=tf.one_hot(actions, output_shape))
+            return tf.reduce_mean(neg_log_prob * rewards)
+
+        def minimize(loss):
+            gradients, variables = zip(*optimizer.compute_gradients(loss=loss))
+            gradients, _ = tf.clip_by_global_norm(gradients, 5.0)
+            return optimizer.apply_gradients(zip(gradients, variables))
+
+        fc3 = logits(self.states)
 
         # predict operation
-        self.predict_op = tf.nn.softmax(logits=fc3_print)
+        self.predict_op = tf.nn.softmax(logits=fc3, name='policy')
 
         # loss function
-        neg_log_prob = tf.nn.softmax_cross_entropy_with_logits_v2(logits=fc3_print,
-                                                                  labels=self.actions)
-        self.loss = tf.reduce_mean(neg_log_prob * self.rewards)
+        self.loss = loss(fc3, self.actions, self.rewards)
 
         # train operation
         optimizer = tf.train.AdamOptimizer(learning_rate=learning_rate)
-        gradients, variables = zip(*optimizer.compute_gradients(loss=self.loss))
-        gradients, _ = tf.clip_by_global_norm(gradients, 5.0)
-        self.train_op = optimizer.apply_gradients(zip(gradients, variables))
-
-    def train(self, states, actions, rewards):
+        self.train_op = minimize(self.loss)
+
+        if self.updates_per_call > 1:
+            # updates_per_call batches concatenated in the placeholders are trained on one after another
+            losses = []
+            step_op = tf.no_op()
+            batches = zip(*[tf.split(tensor, self.updates_per_call)
+                            for tensor in (self.states, self.actions, self.rewards)])
+            for states, actions, rewards in batches:
+                with tf.control_dependencies([step_op]):
+                    losses.append(loss(logits(states), actions, rewards))
+                    step_op = minimize(losses[-1])
+            self.multi_train_op = step_op
+            self.multi_loss = tf.stack(losses)
+
+    def train(self, states, actions, rewards, num_updates=1):
         """
         Train network with given batch of rollout data.
         Batch size is considered as states.shape[0]
 
         :param states: np array of shape (batch_size, input_shape)
-        :param actions:  np array of shape (batch_size, output_shape)
+        :param actions: np array of the action indices of shape (batch_size, )
         :param rewards: normalized discounted rewards np.array of shape (batch_size, )
+        :param num_updates: 1 or updates_per_call, the number of equal batches concatenated
+        in the arrays which are trained on one after another in a single session call
         """
         var_dict = {
             self.states: states,
             self.actions: actions,
             self.rewards: rewards
         }
-        self.session.run(self.train_op, feed_dict=var_dict)
-        loss = self.session.run(self.loss, feed_dict=var_dict)
+        if num_updates == 1:
+            # The loss is fetched by the same run as the update, it is computed before the update
+            _, loss = self.session.run([self.train_op, self.loss], feed_dict=var_dict)
+        elif num_updates == self.updates_per_call:
+            _, loss = self.session.run([self.multi_train_op, self.multi_loss], feed_dict=var_dict)
+        else:
+            raise ValueError('The network trains on 1 or {} batches per call, got {}'.format(
+                self.updates_per_call, num_updates))
         logger.debug('Loss:')
         logger.debug(loss)
-        self.saver.save(self.session, 'saved_model/model.ckpt')
+        self.train_steps += num_updates
+        self.checkpoints.maybe_save(self.train_steps)
 
     def predict(self, state):
         """
@@ -108,5 +186,28 @@ class Network:
         :param state: a given state
         :return: the predicted action to take
         """
-        var_dict = {self.states: np.array([state])}
-        return np.argmax(self.session.run(self.predict_op, feed_dict=var_dict))
+        return np.argmax(self.predict_fn([state])[0])
+
+    def export_inference_graph(self, path):
+        """
+        Write the prediction graph with the variables converted into constants.
+
+        The frozen graph maps the placeholder 'x' to the action probabilities 'policy'
+        and can be loaded by tf.import_graph_def without the checkpoints.
+
+        :param path: path to the GraphDef file to write
+        """
+        graph_def = tf.graph_util.convert_variables_to_constants(
+            self.session, self.session.graph.as_graph_def(), [self.predict_op.op.name])
+        with tf.gfile.GFile(path, 'wb') as graph_file:
+            graph_file.write(graph_def.SerializeToString())
+
+    def to_numpy(self, refresh_every=1):
+        """
+        Create a NumpyNetwork computing the same logits. It has to be refreshed before it is used.
+
+        :param refresh_every: number of the updates between the snapshots taken by maybe_refresh
+        :return: the NumpyNetwork
+        """
+        return NumpyNetwork.from_dense_layers(self.dense_layers[:-1], self.dense_layers[-1:],
+                                              refresh_every=refresh_every)
@@ -1,16 +1,23 @@
-import itertools
 import os
-import pickle
 import random
 from collections import deque
-from random import shuffle
+
+import numpy as np
+
+from policy_gradient.chunk_log import append_chunk, iter_chunks, rewrite_chunks
 
 
 class ReplayBuffer:
     """
     Replay buffer for storing sampled data.
+
+    The states, actions and rewards are kept in preallocated arrays used as a
+    ring, so a batch is sampled by indexing them directly. The file of the
+    buffer is an append-only log: saving appends the elements inserted since
+    the last save, and the log is rewritten with the buffer's contents only
+    once it holds twice as many elements as the buffer can.
     """
-    __slots__ = ('data', 'filename')
+    __slots__ = ('states', 'actions', 'rewards', 'size', 'position', 'max_size', 'filename', 'unsaved', 'logged')
 
     def __init__(self, directory='./', max_size=1000000):
         """
@@ -19,55 +26,120 @@ class ReplayBuffer:
         :param max_size: maximal size of a buffer
         """
         self.filename = os.path.join(directory, 'replay_buffer.pkl')
-        self.data = deque(maxlen=max_size)
+        self.max_size = max_size
+        # The arrays are allocated on the first insertion, when the state size is known
+        self.states = None
+        self.actions = None
+        self.rewards = None
+        self.size = 0
+        self.position = 0
+        # Number of the latest elements not saved yet and of the elements in the file, None until
+        # the file is either loaded or rewritten
+        self.unsaved = 0
+        self.logged = None
 
     def save_data(self):
         """
         Save buffer data to file.
         """
-        with open(self.filename, 'wb') as output_file:
-            pickle.dump(obj=self.data, file=output_file)
+        if self.logged is None or self.logged + self.unsaved > 2 * self.max_size:
+            states, actions, rewards = self.get_all()
+            rewrite_chunks(self.filename, [{'states': states, 'actions': actions, 'rewards': rewards}])
+            self.logged = self.size
+        elif self.unsaved > 0:
+            states, actions, rewards = self._get_latest(self.unsaved)
+            append_chunk(self.filename, {'states': states, 'actions': actions, 'rewards': rewards})
+            self.logged += self.unsaved
+        self.unsaved = 0
 
     def load_data(self):
         """
         Load buffer data from file.
         """
-        with open(self.filename, 'rb') as input_file:
-            self.data = pickle.load(file=input_file)
+        self.size = 0
+        self.position = 0
+        self.logged = 0
+        for chunk in iter_chunks(self.filename):
+            if isinstance(chunk, deque):
+                # The buffers saved before the arrays were a deque of (state, action, reward)
+                self.extend(chunk)
+                self.logged += len(chunk)
+            elif len(chunk['states']) > 0:
+                self._insert(chunk['states'], chunk['actions'], chunk['rewards'])
+                self.logged += len(chunk['states'])
+        self.unsaved = 0
 
     def __len__(self):
         """
         :return: length of this buffer
         """
-        return len(self.data)
+        return self.size
 
     def append(self, element):
         """
         Add single element to buffer.
         :param element: element to add
         """
-        self.data.append(element)
+        self.extend([element])
 
     def extend(self, elements):
         """
         Extend buffer with list of elements
         :param elements: list of elements
         """
-        self.data.extend(elements)
+        elements = list(elements)
+        if not elements:
+            return
+        states, actions, rewards = zip(*elements)
+        self._insert(np.array(states, dtype=np.float32), np.array(actions), np.array(rewards, dtype=np.float32))
+
+    def _insert(self, states, actions, rewards):
+        if self.states is None:
+            self.states = np.zeros((self.max_size,) + states.shape[1:], dtype=np.float32)
+            self.actions = np.zeros(self.max_size, dtype=np.int64)
+            self.rewards = np.zeros(self.max_size, dtype=np.float32)
+        # Only the last max_size elements stay in the buffer
+        states, actions, rewards = states[-self.max_size:], actions[-self.max_size:], rewards[-self.max_size:]
+        idx = (self.position + np.arange(len(states))) % self.max_size
+        self.states[idx] = states
+        self.actions[idx] = actions
+        self.rewards[idx] = rewards
+        self.position = (self.position + len(states)) % self.max_size
+        self.size = min(self.size + len(states), self.max_size)
+        self.unsaved = min(self.unsaved + len(states), self.max_size)
 
-    def get_data(self, batch_size):
+    def get_data(self, batch_size, out=None):
         """
         Get randomly sampled batch of data from the buffer.
         :param batch_size: batch size
-        :return: 3 iterators: states, actions, rewards
+        :param out: if set, 3 arrays of batch_size elements the batch is written to
+        :return: 3 arrays: states, actions, rewards
+        """
+        # Sampling the indices from a range takes O(batch_size) regardless of the size
+        idx = random.sample(range(self.size), batch_size)
+        if out is None:
+            return self.states[idx], self.actions[idx], self.rewards[idx]
+        for array, out_array in zip((self.states, self.actions, self.rewards), out):
+            np.take(array, idx, axis=0, out=out_array)
+        return out
+
+    def get_all(self):
+        """
+        Get all data of the buffer from the oldest to the newest element.
+        :return: 3 arrays: states, actions, rewards
         """
-        size = len(self.data)
-        idx_data = set(random.sample(range(size), batch_size))
-        data = [elem for i, elem in enumerate(self.data) if i in idx_data]
+        return self._get_latest(self.size)
 
-        return [s for s, a, r in data], \
-               [a for s, a, r in data], \
-               [r for s, a, r in data]
+    def _get_latest(self, count):
+        if count == 0:
+            return np.zeros((0,)), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        idx = (self.position - count + np.arange(count)) % self.max_size
+        return self.states[idx], self.actions[idx], self.rewards[idx]
 
     def shuffle_data(self):
-        shuffle(shuffle(self.data))
+        idx = np.random.permutation(self.size)
+        self.states[:self.size] = self.states[idx]
+        self.actions[:self.size] = self.actions[idx]
+        self.rewards[:self.size] = self.rewards[idx]
+        # The order of the file no longer matches the buffer
+        self.logged = None
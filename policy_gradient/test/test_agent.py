@@ -1,9 +1,13 @@
+import random
+import tempfile
 import unittest
 
 import numpy as np
 from matplotlib import pyplot as plt
 
-from policy_gradient.agent import PGAgent
+from dotaenv.codes import STATE_DIM
+from policy_gradient.agent import PGAgent, UPDATES_PER_CALL
+from policy_gradient.replay_buffer import ReplayBuffer
 
 
 class TestPGAgent(unittest.TestCase):
@@ -28,3 +32,28 @@ class TestPGAgent(unittest.TestCase):
         plt.hist(norm)
         plt.show()
 
+    def test_sample_batches(self):
+        random.seed(0)
+        # Only the replay buffer and the batch arrays are needed to sample, not the network and the environment
+        agent = PGAgent.__new__(PGAgent)
+        agent.batch_size = 4
+        agent.replay_buffer = ReplayBuffer(directory=tempfile.mkdtemp(), max_size=100)
+        agent.replay_buffer.extend((np.full(STATE_DIM, i, dtype=np.float32), i % 5, float(i)) for i in range(50))
+        size = UPDATES_PER_CALL * agent.batch_size
+        agent.batch = (np.zeros((size, STATE_DIM), dtype=np.float32),
+                       np.zeros(size, dtype=np.int64),
+                       np.zeros(size, dtype=np.float32))
+        first = [array.copy() for array in agent.sample_batches()]
+        second = agent.sample_batches()
+        for array, batch_array in zip(second, agent.batch):
+            self.assertIs(array, batch_array)
+        states, actions, rewards = second
+        self.assertFalse(np.array_equal(states, first[0]))
+        self.assertTrue(np.array_equal(actions, states[:, 0].astype(np.int64) % 5))
+        for i in range(UPDATES_PER_CALL):
+            batch_slice = slice(i * agent.batch_size, (i + 1) * agent.batch_size)
+            # Every batch's rewards are normalized on their own, the stored elements stay as they were
+            expected = PGAgent.normalize_rewards(states[batch_slice, 0])
+            self.assertTrue(np.allclose(rewards[batch_slice], expected, atol=1e-5))
+        _, _, stored_rewards = agent.replay_buffer.get_all()
+        self.assertTrue(np.array_equal(stored_rewards, np.arange(50)))
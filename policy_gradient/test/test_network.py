@@ -2,11 +2,18 @@ from policy_gradient import PGAgent
 from policy_gradient.network import Network
 
 import numpy as np
+import os
+import tempfile
+import tensorflow as tf
 import unittest
 
 
 class TestNetwork(unittest.TestCase):
 
+    def setUp(self):
+        # A frozen network finalizes the default graph
+        tf.reset_default_graph()
+
     def test_predict(self):
         net = Network()
         state = [2.5] * 172
@@ -15,10 +22,63 @@ class TestNetwork(unittest.TestCase):
     def test_train(self):
         net = Network()
         states = np.array([[2.5] * 172] * 100, dtype='float32')
-        action = [1] + ([0] * 24)
-        actions = np.array([action] * 100, dtype='float32')
+        actions = np.zeros(shape=(100,), dtype='int64')
         rewards = np.zeros(shape=(100,))
         rewards[-1] = 1000
         rewards[50] = 100
         rewards = PGAgent.discount_rewards(rewards=rewards, gamma=0.7)
         net.train(states=states, actions=actions, rewards=rewards)
+
+    def test_multi_train(self):
+        net = Network(input_shape=18, output_shape=25, updates_per_call=3)
+        rng = np.random.RandomState(0)
+        states = rng.uniform(-1, 1, size=(30, 18)).astype('float32')
+        actions = rng.randint(25, size=30)
+        rewards = rng.uniform(-1, 1, size=30)
+        variables = tf.global_variables()
+        # Both ways start from the same weights and optimizer slots
+        initial_values = net.session.run(variables)
+        for i in range(0, 30, 10):
+            net.train(states=states[i:i + 10], actions=actions[i:i + 10], rewards=rewards[i:i + 10])
+        expected = net.session.run(tf.trainable_variables())
+        for var, value in zip(variables, initial_values):
+            var.load(value, net.session)
+        net.train(states=states, actions=actions, rewards=rewards, num_updates=3)
+        for weights, expected_weights in zip(net.session.run(tf.trainable_variables()), expected):
+            self.assertTrue(np.allclose(weights, expected_weights, atol=1e-5))
+
+    def test_production_mode(self):
+        net = Network(input_shape=18, output_shape=25, freeze=True)
+        graph = net.session.graph
+        self.assertTrue(graph.finalized)
+        self.assertNotIn('Print', [op.type for op in graph.get_operations()])
+        with self.assertRaises(RuntimeError):
+            with graph.as_default():
+                tf.constant(0)
+        # The network is still trained and used with the finalized graph
+        states = np.random.RandomState(0).uniform(-1, 1, size=(10, 18)).astype('float32')
+        net.train(states=states, actions=np.zeros(10, dtype='int64'), rewards=np.ones(10))
+        net.predict(state=states[0])
+
+    def test_debug_mode(self):
+        net = Network(input_shape=18, output_shape=25, debug=True)
+        self.assertFalse(net.session.graph.finalized)
+        self.assertIn('Print', [op.type for op in net.session.graph.get_operations()])
+
+    def test_export_inference_graph(self):
+        net = Network(input_shape=18, output_shape=25, freeze=True)
+        path = os.path.join(tempfile.mkdtemp(), 'policy.pb')
+        net.export_inference_graph(path)
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(path, 'rb') as graph_file:
+            graph_def.ParseFromString(graph_file.read())
+        op_types = set(node.op for node in graph_def.node)
+        self.assertTrue(op_types.isdisjoint({'Variable', 'VariableV2', 'VarHandleOp', 'ReadVariableOp'}))
+        states = np.random.RandomState(0).uniform(-1, 1, size=(10, 18)).astype('float32')
+        expected = net.session.run(net.predict_op, feed_dict={net.states: states})
+        # The frozen graph is loaded without the checkpoints
+        with tf.Graph().as_default():
+            policy, = tf.import_graph_def(graph_def, return_elements=['policy:0'])
+            with tf.Session() as sess:
+                probabilities = sess.run(policy, feed_dict={'import/x:0': states})
+        self.assertTrue(np.allclose(probabilities, expected, atol=1e-6))
@@ -0,0 +1,100 @@
+import random
+import tempfile
+import unittest
+
+import numpy as np
+
+from policy_gradient.chunk_log import iter_chunks
+from policy_gradient.replay_buffer import ReplayBuffer
+
+
+class TestReplayBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def make_elements(self, start, stop):
+        return [(np.full(3, i, dtype=np.float32), i % 5, float(i)) for i in range(start, stop)]
+
+    def test_get_data(self):
+        buffer = ReplayBuffer(directory=self.directory, max_size=100)
+        buffer.extend(self.make_elements(0, 50))
+        states, actions, rewards = buffer.get_data(20)
+        self.assertEqual(states.shape, (20, 3))
+        self.assertEqual(len(set(rewards)), 20)
+        self.assertTrue(np.array_equal(states[:, 0], rewards))
+        self.assertTrue(np.array_equal(actions, rewards.astype(np.int64) % 5))
+
+    def test_get_data_into_arrays(self):
+        buffer = ReplayBuffer(directory=self.directory, max_size=100)
+        buffer.extend(self.make_elements(0, 50))
+        out = (np.zeros((40, 3), dtype=np.float32), np.zeros(40, dtype=np.int64), np.zeros(40, dtype=np.float32))
+        states, actions, rewards = buffer.get_data(20, out=tuple(array[20:] for array in out))
+        self.assertTrue(np.array_equal(out[2][20:], rewards))
+        self.assertTrue(np.array_equal(out[0][20:, 0], rewards))
+        self.assertTrue(np.array_equal(out[1][20:], rewards.astype(np.int64) % 5))
+        self.assertFalse(out[2][:20].any())
+
+    def test_get_data_reuses_arrays(self):
+        random.seed(0)
+        buffer = ReplayBuffer(directory=self.directory, max_size=100)
+        buffer.extend(self.make_elements(0, 50))
+        out = (np.zeros((20, 3), dtype=np.float32), np.zeros(20, dtype=np.int64), np.zeros(20, dtype=np.float32))
+        first = [array.copy() for array in buffer.get_data(20, out=out)]
+        # The batch is trained on in place, e.g. its rewards are normalized
+        out[2][:] = -1
+        second = buffer.get_data(20, out=out)
+        for array, out_array in zip(second, out):
+            self.assertIs(array, out_array)
+            self.assertFalse(np.shares_memory(out_array, buffer.states) or
+                             np.shares_memory(out_array, buffer.actions) or
+                             np.shares_memory(out_array, buffer.rewards))
+        states, actions, rewards = second
+        # Every element of the second batch is written over the first one
+        self.assertFalse(np.array_equal(rewards, first[2]))
+        self.assertTrue(np.array_equal(states[:, 0], rewards))
+        self.assertTrue(np.array_equal(actions, rewards.astype(np.int64) % 5))
+        # Writing over the batch does not change the buffer
+        _, _, stored_rewards = buffer.get_all()
+        self.assertTrue(np.array_equal(stored_rewards, np.arange(50)))
+
+    def test_overflow_keeps_latest(self):
+        buffer = ReplayBuffer(directory=self.directory, max_size=10)
+        buffer.extend(self.make_elements(0, 7))
+        buffer.extend(self.make_elements(7, 15))
+        buffer.append(self.make_elements(15, 16)[0])
+        self.assertEqual(len(buffer), 10)
+        _, _, rewards = buffer.get_all()
+        self.assertTrue(np.array_equal(rewards, np.arange(6, 16)))
+
+    def test_save_and_load(self):
+        buffer = ReplayBuffer(directory=self.directory, max_size=10)
+        buffer.extend(self.make_elements(0, 13))
+        buffer.save_data()
+        loaded = ReplayBuffer(directory=self.directory, max_size=10)
+        loaded.load_data()
+        for expected, actual in zip(buffer.get_all(), loaded.get_all()):
+            self.assertTrue(np.array_equal(expected, actual))
+
+    def test_save_appends_new_elements(self):
+        buffer = ReplayBuffer(directory=self.directory, max_size=10)
+        buffer.extend(self.make_elements(0, 4))
+        buffer.save_data()
+        buffer.extend(self.make_elements(4, 8))
+        buffer.save_data()
+        self.assertEqual(len(list(iter_chunks(buffer.filename))), 2)
+        # The log is rewritten once it holds more than twice the size of the buffer
+        buffer.extend(self.make_elements(8, 30))
+        buffer.save_data()
+        self.assertEqual(len(list(iter_chunks(buffer.filename))), 3)
+        buffer.extend(self.make_elements(30, 35))
+        buffer.save_data()
+        self.assertEqual(len(list(iter_chunks(buffer.filename))), 1)
+        loaded = ReplayBuffer(directory=self.directory, max_size=10)
+        loaded.load_data()
+        _, _, rewards = loaded.get_all()
+        self.assertTrue(np.array_equal(rewards, np.arange(25, 35)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+import argparse
 import logging
 import sys
 import time
@@ -15,19 +16,26 @@ logger.addHandler(fh)
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
 
-def create_dota_agent():
+def create_dota_agent(restore=False):
     return PGAgent(environment=DotaEnvironment,
                    episodes=10000,
-                   restore=False,
+                   restore=restore,
                    batch_size=100,
                    eps=0.99,
                    eps_update=0.99)
 
 
 def main():
-    agent = create_dota_agent()
-    agent.train()
-    # agent.show_performance()
+    parser = argparse.ArgumentParser(description='Trains the agent by policy gradient')
+    parser.add_argument('--evaluate', action='store_true',
+                        help='plays the restored policy greedily with the actions served on the bot server')
+    args = parser.parse_args()
+
+    agent = create_dota_agent(restore=args.evaluate)
+    if args.evaluate:
+        agent.show_performance()
+    else:
+        agent.train()
 
 
 if __name__ == '__main__':
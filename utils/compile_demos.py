@@ -0,0 +1,26 @@
+import argparse
+
+from deepq.reward_shaper import ActionAdviceRewardShaper, StatePotentialRewardShaper
+
+SHAPERS = {
+    'action-advice': ActionAdviceRewardShaper,
+    'state-potential': StatePotentialRewardShaper,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuilds the compiled demo store of a reward shaper.')
+    parser.add_argument('shaper', choices=sorted(SHAPERS.keys()),
+                        help='the reward shaper to compile the demos for')
+    parser.add_argument('replay_dir', type=str,
+                        help='a path to the directory with the demos')
+    parser.add_argument('--store-dir', type=str, default=None,
+                        help='a path to the directory for the compiled demos')
+    args = parser.parse_args()
+
+    reward_shaper = SHAPERS[args.shaper](args.replay_dir, store_dir=args.store_dir)
+    reward_shaper.load(rebuild=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import os
+
+import tensorflow as tf
+
+from deepq.checkpoint_manager import CheckpointManager
+from deepq.estimator import Estimator
+from deepq.lua_export import export_to_lua
+from dotaenv.codes import STATE_DIM, ACTIONS_TOTAL
+from openai.deepq.models import build_q_func, build_numpy_q_func
+from policy_gradient.network import Network
+
+DEFAULT_OUTPUT = os.path.join('bot', 'agent_utils', 'policy_weights.lua')
+MLP_ACTIVATIONS = {'tanh': tf.tanh, 'relu': tf.nn.relu}
+
+
+def load_dqn(checkpoint_dir):
+    tf.Variable(0, name="global_step", trainable=False)
+    q_estimator = Estimator(STATE_DIM, ACTIONS_TOTAL, scope="q")
+    # The target estimator is built to match the variables of the checkpoint
+    Estimator(STATE_DIM, ACTIONS_TOTAL, scope="target_q")
+    sess = tf.Session()
+    checkpoints = CheckpointManager(sess, checkpoint_dir)
+    if checkpoints.latest() is not None:
+        checkpoints.restore()
+    else:
+        tf.train.Saver().restore(sess, tf.train.latest_checkpoint(checkpoint_dir))
+    checkpoints.close()
+    numpy_network = q_estimator.to_numpy()
+    numpy_network.refresh(sess)
+    return numpy_network
+
+
+def load_openai_deepq(checkpoint_dir, num_layers, num_hidden, activation, hiddens, dueling):
+    # The q function is built as openai/train.py builds it, on top of an mlp network
+    network_activation = MLP_ACTIVATIONS[activation]
+    q_func = build_q_func('mlp', hiddens=hiddens, dueling=dueling,
+                          num_layers=num_layers, num_hidden=num_hidden, activation=network_activation)
+    q_func(tf.placeholder(tf.float32, (None, STATE_DIM)), ACTIONS_TOTAL, scope="deepq/q_func")
+    numpy_network = build_numpy_q_func("deepq/q_func", network_activation=network_activation)
+    sess = tf.Session()
+    checkpoints = CheckpointManager(sess, checkpoint_dir,
+                                    var_list=tf.trainable_variables("deepq/q_func/"))
+    if checkpoints.restore(checkpoints.best()) is None:
+        raise ValueError('There are no checkpoints in {}'.format(checkpoint_dir))
+    checkpoints.close()
+    numpy_network.refresh(sess)
+    return numpy_network
+
+
+def load_policy_gradient():
+    network = Network(input_shape=STATE_DIM, output_shape=ACTIONS_TOTAL, restore=True)
+    numpy_network = network.to_numpy()
+    numpy_network.refresh(network.session)
+    return numpy_network
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Exports a trained network into a Lua module for the bot.')
+    parser.add_argument('model', choices=['dqn', 'openai-deepq', 'policy-gradient'],
+                        help='the model to export, policy-gradient is restored from saved_model/')
+    parser.add_argument('--checkpoint-dir', type=str, default=None,
+                        help='a path to the checkpoints of the dqn or openai-deepq experiment')
+    parser.add_argument('--num-layers', type=int, default=1,
+                        help='the number of the layers of the openai-deepq mlp network')
+    parser.add_argument('--num-hidden', type=int, default=128,
+                        help='the size of the layers of the openai-deepq mlp network')
+    parser.add_argument('--activation', choices=sorted(MLP_ACTIVATIONS), default='tanh',
+                        help='the activation of the openai-deepq mlp network')
+    parser.add_argument('--hiddens', type=int, nargs='*', default=[256],
+                        help='the sizes of the hidden layers of the openai-deepq q function heads')
+    parser.add_argument('--no-dueling', action='store_true',
+                        help='the openai-deepq q function has no state value head')
+    parser.add_argument('--output', type=str, default=DEFAULT_OUTPUT,
+                        help='a path to the Lua module to write')
+    args = parser.parse_args()
+
+    if args.model in ('dqn', 'openai-deepq') and args.checkpoint_dir is None:
+        parser.error('--checkpoint-dir is required for the {} model'.format(args.model))
+    if args.model == 'dqn':
+        numpy_network = load_dqn(args.checkpoint_dir)
+    elif args.model == 'openai-deepq':
+        numpy_network = load_openai_deepq(args.checkpoint_dir, args.num_layers, args.num_hidden,
+                                          args.activation, args.hiddens, not args.no_dueling)
+    else:
+        numpy_network = load_policy_gradient()
+    export_to_lua(numpy_network, args.output)
+    print('Exported the network to', args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,12 @@
-import pickle
 import argparse
 
 import matplotlib.pyplot as plt
 
+from policy_gradient.chunk_log import load_rewards
+
 
 def plot_saved_rewards(rewards_file):
-    with open(rewards_file, 'rb') as output_file:
-        reward = pickle.load(output_file)
+    reward = load_rewards(rewards_file)
 
     non_zero_rewards = []
     for r in reward: